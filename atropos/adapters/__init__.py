@@ -308,18 +308,40 @@ class Adapter(object):
         self.errors_front = NestedDict()
         self.errors_back = NestedDict()
         self.adjacent_bases = { 'A': 0, 'C': 0, 'G': 0, 'T': 0, '': 0 }
-        self.aligner = align.Aligner(
-            self.sequence, self.max_error_rate, flags=self.where,
-            wildcard_ref=self.adapter_wildcards,
-            wildcard_query=self.read_wildcards)
-        self.aligner.min_overlap = self.min_overlap
         if self.indels:
-            self.aligner.indel_cost = indel_cost
+            self.aligner = align.Aligner(
+                self.sequence, self.max_error_rate, flags=self.where,
+                wildcard_ref=self.adapter_wildcards,
+                wildcard_query=self.read_wildcards,
+                indel_cost=indel_cost)
         else:
-            # TODO
-            # When indels are disallowed, an entirely different algorithm
-            # should be used.
-            self.aligner.indel_cost = 100000
+            # Only mismatches need to be counted
+            self.aligner = align.HammingAligner(
+                self.sequence, self.max_error_rate, flags=self.where,
+                wildcard_ref=self.adapter_wildcards,
+                wildcard_query=self.read_wildcards)
+        self.aligner.min_overlap = self.min_overlap
+        # Reads without any seed of the adapter cannot match. The seeds are
+        # also used by AdapterIndex. Aligners of adapters that fit in a
+        # machine word already rule out such reads more cheaply with a
+        # bit-parallel scan, so match_to only uses the filter for longer
+        # adapters.
+        self.seed_filter = None
+        if (
+                where in (BACK, FRONT, ANYWHERE) and
+                not (self.adapter_wildcards or self.read_wildcards)):
+            seed_filter = align.SeedFilter(
+                self.sequence, self.max_error_rate, flags=self.where,
+                min_overlap=self.min_overlap)
+            if seed_filter.seed_length > 0:
+                self.seed_filter = seed_filter
+        self.use_seed_filter = (
+            self.seed_filter is not None and self.indels and
+            not self.aligner.bit_parallel)
+        # Set by AdapterIndex, which then filters the reads instead
+        self.seed_filter_indexed = False
+        self.seed_filter_aligned = 0
+        self.seed_filter_skipped = 0
     
     def __repr__(self):
         return '<Adapter(name="{name}", sequence="{sequence}", where={where}, '\
@@ -349,22 +371,9 @@ class Adapter(object):
         read_seq = read.sequence.upper()
         
         # try to find an exact match first unless wildcards are allowed
-        pos = -1
-        if not self.adapter_wildcards:
-            if self.where == PREFIX:
-                if read_seq.startswith(self.sequence):
-                    pos = 0
-            elif self.where == SUFFIX:
-                if read_seq.endswith(self.sequence):
-                    pos = (len(read_seq) - len(self.sequence))
-            else:
-                pos = read_seq.find(self.sequence)
-        
-        if pos >= 0:
-            seqlen = len(self.sequence)
-            return Match(
-                0, seqlen, pos, pos + seqlen, seqlen, 0, self._front_flag,
-                self, read)
+        match = self._match_exact(read, read_seq)
+        if match is not None:
+            return match
         
         # try approximate matching
         alignment = None
@@ -379,25 +388,101 @@ class Adapter(object):
                     self.sequence, read_seq,
                     wildcard_ref=self.adapter_wildcards,
                     wildcard_query=self.read_wildcards)
-        else:
+        elif self._may_match(read_seq):
             alignment = self.aligner.locate(read_seq)
             if self.debug:
                 print(self.aligner.dpmatrix)  # pragma: no cover
         
         if alignment:
-            astart, astop, rstart, rstop, matches, errors = alignment
-            size = astop - astart
-            if ((
-                    size >=
-                    self.min_overlap and errors / size <=
-                    self.max_error_rate
-                ) and (
-                    self.max_rmp is None or
-                    self.match_probability(matches, size) <= self.max_rmp)):
-                return Match(
-                    astart, astop, rstart, rstop, matches, errors,
-                    self._front_flag, self, read)
+            return self._create_match(alignment, read)
+        return None
+    
+    def match_to_batch(self, reads):
+        """Attempt to match this adapter to each of a list of reads. The
+        result is the same as that of calling :method:`match_to` on each
+        read, but the reads are aligned with a single call to the aligner.
+        
+        Args:
+            reads: A list of :class:`Sequence` instances.
+        
+        Returns:
+            A list with a :class:`Match` instance or None for each read.
+        """
+        if self.debug or (not self.indels and self.where in (PREFIX, SUFFIX)):
+            return [self.match_to(read) for read in reads]
+        
+        matches = [None] * len(reads)
+        to_align = []
+        read_seqs = []
+        for i, read in enumerate(reads):
+            read_seq = read.sequence.upper()
+            match = self._match_exact(read, read_seq)
+            if match is not None:
+                matches[i] = match
+            elif self._may_match(read_seq):
+                to_align.append(i)
+                read_seqs.append(read_seq)
+        
+        if read_seqs:
+            alignments = self.aligner.locate_batch(read_seqs)
+            for j, i in enumerate(to_align):
+                if alignments[6 * j] >= 0:
+                    matches[i] = self._create_match(
+                        tuple(alignments[6 * j:6 * j + 6]), reads[i])
+        
+        return matches
+    
+    def _match_exact(self, read, read_seq):
+        """Returns a :class:`Match` if the adapter occurs in the read without
+        errors, unless wildcards are allowed.
+        """
+        pos = -1
+        if not self.adapter_wildcards:
+            if self.where == PREFIX:
+                if read_seq.startswith(self.sequence):
+                    pos = 0
+            elif self.where == SUFFIX:
+                if read_seq.endswith(self.sequence):
+                    pos = (len(read_seq) - len(self.sequence))
+            else:
+                pos = read_seq.find(self.sequence)
         
+        if pos >= 0:
+            seqlen = len(self.sequence)
+            return Match(
+                0, seqlen, pos, pos + seqlen, seqlen, 0, self._front_flag,
+                self, read)
+        return None
+    
+    def _may_match(self, read_seq):
+        """Whether the read needs to be aligned, according to the seed filter.
+        """
+        if self.seed_filter_indexed:
+            # The read was already selected by the AdapterIndex
+            self.seed_filter_aligned += 1
+        elif self.use_seed_filter:
+            if not self.seed_filter.may_match(read_seq):
+                self.seed_filter_skipped += 1
+                return False
+            self.seed_filter_aligned += 1
+        return True
+    
+    def _create_match(self, alignment, read):
+        """Returns a :class:`Match` for an alignment if it satisfies the
+        matching criteria, otherwise None.
+        """
+        astart, astop, rstart, rstop, matches, errors = alignment
+        size = astop - astart
+        if ((
+                size >=
+                self.min_overlap and errors / size <=
+                self.max_error_rate
+            ) and (
+                self.max_rmp is None or
+                self.match_probability(matches, size) <= self.max_rmp)):
+            return Match(
+                astart, astop, rstart, rstop, matches, errors,
+                self._front_flag, self, read)
         return None
     
     def _trimmed_anywhere(self, match):
@@ -502,6 +587,11 @@ class Adapter(object):
             stats["errors_back"] = self.errors_back
         if where in (BACK, SUFFIX):
             stats["adjacent_bases"] = self.adjacent_bases
+        if self.use_seed_filter or self.seed_filter_indexed:
+            stats["seed_filter"] = dict(
+                seed_length=Const(self.seed_filter.seed_length),
+                aligned=self.seed_filter_aligned,
+                skipped=self.seed_filter_skipped)
         
         return stats
 
@@ -526,6 +616,8 @@ class ColorspaceAdapter(Adapter):
             raise ValueError(
                 "A 5' colorspace adapter needs to be given in nucleotide space")
         self.aligner.reference = self.sequence
+        self.seed_filter = None
+        self.use_seed_filter = False
     
     def match_to(self, read):
         """Attempt to match this adapter to the given read.
@@ -569,6 +661,10 @@ class ColorspaceAdapter(Adapter):
             match.errors / match.length <= self.max_error_rate)
         assert match.length >= self.min_overlap
         return match
+    
+    def match_to_batch(self, reads):
+        # The adapter sequence depends on the primer of each read
+        return [self.match_to(read) for read in reads]
 
     def _trimmed_front(self, match):
         """Trims an adapter from the front of sequence.
@@ -689,6 +785,11 @@ class LinkedAdapter(object):
         read = read[front_match.rstop:]
         back_match = self.back_adapter.match_to(read)
         return LinkedMatch(front_match, back_match, self)
+    
+    def match_to_batch(self, reads):
+        """Match the linked adapters against each of a list of reads.
+        """
+        return [self.match_to(read) for read in reads]
 
     def trimmed(self, match):
         """Returns the read trimmed with the front and/or back adapter
@@ -745,6 +846,50 @@ class LinkedAdapter(object):
         
         return stats
 
+class AdapterIndex(object):
+    """Index of the seeds of multiple adapters, used to select the adapters
+    that may match a read with a single scan of the read.
+    
+    The index takes over the seed filtering of the adapters: an indexed
+    adapter no longer checks its own seed filter, so it must only be matched
+    to the reads for which it is a candidate. Reads that are not candidates
+    are counted in the adapter's `seed_filter_skipped`.
+    
+    Args:
+        adapters: A list of adapters. Adapters without a seed filter (e.g.
+            adapters with wildcards) are candidates for every read.
+    """
+    def __init__(self, adapters):
+        self.adapters = adapters
+        seed_filters = [
+            getattr(adapter, 'seed_filter', None) for adapter in adapters]
+        self.seed_index = align.SeedIndex(seed_filters)
+        for adapter, seed_filter in zip(adapters, seed_filters):
+            if seed_filter is not None:
+                adapter.seed_filter_indexed = True
+    
+    def candidates(self, read_seq):
+        """Returns the adapters that may match a read, in their original
+        order.
+        
+        Args:
+            read_seq: The read sequence (uppercase).
+        """
+        adapters = self.adapters
+        return [adapters[i] for i in self.candidate_indexes(read_seq)]
+    
+    def candidate_indexes(self, read_seq):
+        """Returns the (increasing) indexes of the adapters that may match a
+        read.
+        """
+        indexes = self.seed_index.candidates(read_seq)
+        if len(indexes) < len(self.adapters):
+            candidates = set(indexes)
+            for i, adapter in enumerate(self.adapters):
+                if i not in candidates:
+                    adapter.seed_filter_skipped += 1
+        return indexes
+
 class AdapterCache(object):
     """Cache for known adapters.
     
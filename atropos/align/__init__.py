@@ -3,7 +3,9 @@
 Alignment module.
 """
 from collections import namedtuple
-from atropos.align._align import Aligner, MultiAligner, compare_prefixes, locate
+from atropos.align._align import (
+    Aligner, HammingAligner, MultiAligner, OverlapAligner, SeedFilter,
+    SeedIndex, compare_prefixes, locate)
 from atropos.util import RandomMatchProbability, reverse_complement
 
 # flags for global alignment
@@ -211,6 +213,17 @@ MatchInfo = namedtuple("MatchInfo", (
 # * http://www.combio.pl/alfree
 # * http://bioinformatics.org.au/tools/decaf+py/
 
+def _truncate_pair(seq1, seq2):
+    """Truncate the longer of two sequences to the length of the shorter one.
+    """
+    len1 = len(seq1)
+    len2 = len(seq2)
+    if len1 > len2:
+        seq1 = seq1[:len2]
+    elif len2 > len1:
+        seq2 = seq2[:len1]
+    return seq1, seq2
+
 class InsertAligner(object):
     """Implementation of an insert matching algorithm.
     
@@ -221,8 +234,9 @@ class InsertAligner(object):
     
     Args:
         adapter1, adapter2: read1, read2 adapters.
-        match_probability: Callable that calculates random match probability
-            given arguments (num_matches, match_len).
+        match_probability: :class:`atropos.util.RandomMatchProbability`,
+            which calculates random match probability given arguments
+            (num_matches, match_len).
         insert_max_rmp: Max random match probability for the insert match.
         adapter_max_rmp: Max random match probability for the adapter match.
         min_insert_overlap: Minimum number of bases the inserts must overlap
@@ -260,10 +274,22 @@ class InsertAligner(object):
         self.adapter_check_cutoff = adapter_check_cutoff
         self.base_probs = base_probs or dict(
             match_prob=0.25, mismatch_prob=0.75)
-        self.aligner = MultiAligner(
-            max_insert_mismatch_frac,
-            START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2,
-            min_insert_overlap)
+        # Finds the same matches as a MultiAligner with flags
+        # START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2, but by counting mismatches
+        # rather than computing a DP, and skipping matches that fail the
+        # random-match probability filter.
+        self.aligner = OverlapAligner(
+            max_insert_mismatch_frac, min_insert_overlap)
+    
+    def _update_min_matches(self, seq_len):
+        """Set the aligner's table of the minimum number of matches for which
+        an insert match of each length passes the random-match probability
+        filter, if it does not include length `seq_len`.
+        """
+        if len(self.aligner.min_matches) <= seq_len:
+            table = self.match_probability.get_table(
+                size=seq_len, **self.base_probs)
+            self.aligner.min_matches = table.min_matches(self.insert_max_rmp)
     
     def match_insert(self, seq1, seq2):
         """Use cutadapt aligner for insert and adapter matching.
@@ -276,14 +302,50 @@ class InsertAligner(object):
         """
         len1 = len(seq1)
         len2 = len(seq2)
+        seq1, seq2 = _truncate_pair(seq1, seq2)
+        self._update_min_matches(len(seq1))
+        insert_matches = self.aligner.locate(reverse_complement(seq2), seq1)
+        return self._match_insert(seq1, seq2, len1, len2, insert_matches)
+    
+    def match_insert_batch(self, seqs1, seqs2):
+        """Match the inserts of a batch of read pairs with a single call to
+        the aligner. The result is the same as that of calling
+        :method:`match_insert` on each pair.
+        
+        Args:
+            seqs1, seqs2: Lists of sequences to match.
+        
+        Returns:
+            A list with a :class:`Match` object or None for each pair.
+        """
+        lengths = [(len(seq1), len(seq2)) for seq1, seq2 in zip(seqs1, seqs2)]
+        pairs = [
+            _truncate_pair(seq1, seq2) for seq1, seq2 in zip(seqs1, seqs2)]
+        if pairs:
+            self._update_min_matches(max(len(seq1) for seq1, _ in pairs))
+        alignments, offsets = self.aligner.locate_batch(
+            [reverse_complement(seq2) for _, seq2 in pairs],
+            [seq1 for seq1, _ in pairs])
+        results = []
+        for i, ((seq1, seq2), (len1, len2)) in enumerate(zip(pairs, lengths)):
+            insert_matches = [
+                tuple(alignments[6 * j:6 * j + 6])
+                for j in range(offsets[i], offsets[i + 1])]
+            results.append(self._match_insert(
+                seq1, seq2, len1, len2, insert_matches or None))
+        return results
+    
+    def _match_insert(self, seq1, seq2, len1, len2, insert_matches):
+        """Select the insert match and match the adapters.
+        
+        Args:
+            seq1, seq2: The sequences, truncated to the same length.
+            len1, len2: The lengths of the original sequences.
+            insert_matches: The matches of seq1 to the reverse-complement of
+                seq2, or None.
+        """
         seq_len = min(len1, len2)
-        if len1 > len2:
-            seq1 = seq1[:len2]
-        elif len2 > len1:
-            seq2 = seq2[:len1]
-
-        seq2_rc = reverse_complement(seq2)
-
+        
         def _match(insert_match, offset, insert_match_size, prob): # pylint disable=unused-argument
             if offset < self.min_adapter_overlap:
                 # The reads are mostly overlapping, to the point where
@@ -354,13 +416,11 @@ class InsertAligner(object):
         #
         # return _match(insert_match, offset, insert_match_size, prob)
         
-        # Use an aligner that returns all matches that satisfy the
+        # The aligner returns all matches that satisfy the
         # overlap and error rate thresholds. We sort by matches and
         # then mismatches, and then check each in turn until we find
         # one with an adapter match (if any).
 
-        insert_matches = self.aligner.locate(seq2_rc, seq1)
-
         if insert_matches:
             # Filter by random-match probability
             filtered_matches = []
@@ -5,9 +5,11 @@
 # They provide a correct implementation (qalign: http://www.exelixis-lab.org/web/software/alignment/).
 
 from cpython.mem cimport PyMem_Malloc, PyMem_Free, PyMem_Realloc
-from cpython.array cimport array, clone
+from cpython.array cimport array, clone, resize_smart
 cdef array ld_array = array('d', [])
 from libc.math cimport ceil
+from libc.stdint cimport uint64_t
+from libc.string cimport memcpy
 
 DEF START_WITHIN_SEQ1 = 1
 DEF START_WITHIN_SEQ2 = 2
@@ -15,6 +17,15 @@ DEF STOP_WITHIN_SEQ1 = 4
 DEF STOP_WITHIN_SEQ2 = 8
 DEF SEMIGLOBAL = 15
 
+# Maximum reference length for which the bit-parallel prefilter is used (the
+# reference must fit in a machine word)
+DEF MAX_BIT_PARALLEL_LENGTH = 64
+
+# Masks for comparing eight characters at a time
+cdef uint64_t LOW_BITS = 0x7f7f7f7f7f7f7f7fULL
+cdef uint64_t HIGH_BITS = 0x8080808080808080ULL
+cdef uint64_t BYTE_ONES = 0x0101010101010101ULL
+
 # structure for a DP matrix entry
 ctypedef struct _Entry:
     int cost
@@ -85,6 +96,64 @@ def _iupac_table():
 cdef bytes ACGT_TABLE = _acgt_table()
 cdef bytes IUPAC_TABLE = _iupac_table()
 
+cdef array int_array = array('i', [])
+
+cdef bytes _translate_query(bytes query_bytes, bint wildcard_ref, bint wildcard_query):
+    if wildcard_query:
+        return query_bytes.translate(IUPAC_TABLE)
+    elif wildcard_ref:
+        return query_bytes.translate(ACGT_TABLE)
+    return query_bytes
+
+cdef tuple _pack_queries(queries, offsets):
+    """
+    Returns a batch of queries as a single bytes object and an int array with
+    the offset of each query in it, followed by the end of the last query.
+    The queries are either a sequence of strings (and offsets is None), or a
+    bytes-like object with the concatenated queries and their offsets.
+    """
+    cdef bytes buffer
+    cdef array query_offsets
+    cdef int i, pos = 0
+    if offsets is None:
+        query_offsets = clone(int_array, len(queries) + 1, False)
+        query_offsets.data.as_ints[0] = 0
+        for i, query in enumerate(queries):
+            pos += len(query)
+            query_offsets.data.as_ints[i + 1] = pos
+        return ''.join(queries).encode('ascii'), query_offsets
+    buffer = bytes(queries)
+    query_offsets = array('i', offsets)
+    if len(query_offsets) == 0:
+        raise ValueError("offsets must contain the end of the last query")
+    for i in range(len(query_offsets)):
+        if (query_offsets.data.as_ints[i] < pos or
+                query_offsets.data.as_ints[i] > len(buffer)):
+            raise ValueError("Invalid query offsets")
+        pos = query_offsets.data.as_ints[i]
+    return buffer, query_offsets
+
+cdef inline void _store_match(_Match* match, int* result) noexcept nogil:
+    """
+    Store a match as (refstart, refstop, querystart, querystop, matches,
+    errors).
+    """
+    if match.origin >= 0:
+        result[0] = 0
+        result[2] = match.origin
+    else:
+        result[0] = -match.origin
+        result[2] = 0
+    result[1] = match.ref_stop
+    result[3] = match.query_stop
+    result[4] = match.matches
+    result[5] = match.cost
+
+cdef inline void _store_no_match(int* result) noexcept nogil:
+    cdef int i
+    for i in range(6):
+        result[i] = -1
+
 class DPMatrix:
     """
     Representation of the dynamic-programming matrix.
@@ -118,6 +187,69 @@ class DPMatrix:
             rows.append(r)
         return '\n'.join(rows)
 
+cdef bint _scan_edit_distances(
+        const uint64_t* peq, const unsigned char* query, int n, bint reverse,
+        int m, bint free_column, bint free_row, bint check_last_row,
+        int first_i, int last_i, int min_overlap,
+        double max_error_rate) noexcept nogil:
+    """
+    Compute the unit-cost edit distances of the last row and the last column
+    of a DP matrix using the bit-parallel algorithm of Myers (1999) as
+    formulated by Hyyrö (2003). The reference (at most 64 characters) is given
+    as the bit vectors `peq` of the positions matching each query character.
+
+    Args:
+        reverse: Whether to process the query from its end.
+        free_column, free_row: Whether the costs of column 0 and row 0 are zero
+            (otherwise they are the row and column index, respectively).
+        check_last_row: Whether to check row m in every column.
+        first_i, last_i: Range of rows to check in the last column.
+
+    Returns True if any checked cell in row i >= min_overlap has a cost of at
+    most i * max_error_rate.
+    """
+    cdef uint64_t high = (<uint64_t>1) << (m - 1)
+    cdef uint64_t pv, mv = 0, eq, xv, xh, ph, mh
+    cdef double max_row_cost = m * max_error_rate
+    cdef int i, j, cost
+
+    check_last_row = check_last_row and m >= min_overlap
+    # vertical deltas of column 0 and cost of cell (m, 0)
+    if free_column:
+        pv = 0
+        cost = 0
+    else:
+        pv = ~(<uint64_t>0)
+        cost = m
+
+    for j in range(n):
+        eq = peq[query[n - 1 - j if reverse else j]]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            cost += 1
+        elif mh & high:
+            cost -= 1
+        if check_last_row and cost <= max_row_cost:
+            return True
+        ph <<= 1
+        mh <<= 1
+        if not free_row:
+            ph |= 1
+        pv = mh | ~(xv | ph)
+        mv = ph & xv
+
+    # recover the last column from its vertical deltas
+    cost = 0 if free_row else n
+    for i in range(1, last_i + 1):
+        cost += <int>((pv >> (i - 1)) & 1) - <int>((mv >> (i - 1)) & 1)
+        if (i >= first_i and i >= min_overlap and
+                cost <= i * max_error_rate):
+            return True
+    return False
+
 cdef class Aligner:
     """
     TODO documentation still uses s1 (reference) and s2 (query).
@@ -179,6 +311,12 @@ cdef class Aligner:
     If neither flag is set, the full ASCII alphabet is used for comparison.
     If any of the flags is set, all non-IUPAC characters in the sequences
     compare as 'not equal'.
+
+    If the reference is at most 64 bases long, each query is first scanned
+    with a bit-parallel (Myers/Hyyrö) edit-distance algorithm that computes the
+    cost of every cell in which the DP could end an alignment. The DP is only
+    computed if one of those costs is within the allowed error rate, so the
+    results are always the same as those of the DP alone.
     """
     cdef int m
     cdef _Entry* column  # one column of the DP matrix
@@ -192,7 +330,13 @@ cdef class Aligner:
     cdef bint debug
     cdef object _dpmatrix
     cdef bytes _reference  # TODO rename to translated_reference or so
+    cdef const char* _s1  # points into _reference
     cdef str str_reference
+    cdef bint _bit_parallel
+    # for each (translated) query character, a bit vector of the reference
+    # positions that it matches
+    cdef uint64_t _peq[256]
+    cdef uint64_t _peq_reverse[256]  # the same for the reversed reference
 
     def __cinit__(self, str reference, double max_error_rate, int flags=SEMIGLOBAL, bint wildcard_ref=False,
                   bint wildcard_query=False, int min_overlap=1, int indel_cost=1):
@@ -206,6 +350,17 @@ cdef class Aligner:
         self.indel_cost = indel_cost
         self.debug = False
         self._dpmatrix = None
+
+    def __reduce__(self):
+        return (
+            Aligner,
+            (self.str_reference, self.max_error_rate, self.flags,
+             self.wildcard_ref, self.wildcard_query, self._min_overlap,
+             self._insertion_cost),
+            (self._bit_parallel, self.debug))
+
+    def __setstate__(self, state):
+        self._bit_parallel, self.debug = state
     
     property min_overlap:
         def __get__(self):
@@ -242,7 +397,81 @@ cdef class Aligner:
                 self._reference = self._reference.translate(IUPAC_TABLE)
             elif self.wildcard_query:
                 self._reference = self._reference.translate(ACGT_TABLE)
+            self._s1 = self._reference
             self.str_reference = reference
+            self._init_peq()
+            self._bit_parallel = 0 < self.m <= MAX_BIT_PARALLEL_LENGTH
+
+    property bit_parallel:
+        """
+        Whether queries are prefiltered with the bit-parallel algorithm. This
+        is enabled whenever the reference is set to one of at most 64 bases,
+        and cannot be enabled for longer references.
+        """
+        def __get__(self):
+            return self._bit_parallel
+
+        def __set__(self, bint value):
+            if value and not 0 < self.m <= MAX_BIT_PARALLEL_LENGTH:
+                raise ValueError(
+                    'Bit-parallel alignment requires a reference of 1 to '
+                    '{} bases'.format(MAX_BIT_PARALLEL_LENGTH))
+            self._bit_parallel = value
+
+    cdef void _init_peq(self):
+        cdef const unsigned char* s1 = self._reference
+        cdef bint compare_ascii = not (self.wildcard_query or self.wildcard_ref)
+        cdef int m = min(self.m, MAX_BIT_PARALLEL_LENGTH)
+        cdef int c, i
+        cdef bint equal
+        for c in range(256):
+            self._peq[c] = 0
+            self._peq_reverse[c] = 0
+            for i in range(m):
+                if compare_ascii:
+                    equal = s1[i] == c
+                else:
+                    equal = (s1[i] & c) != 0
+                if equal:
+                    self._peq[c] |= (<uint64_t>1) << i
+                    self._peq_reverse[c] |= (<uint64_t>1) << (m - 1 - i)
+
+    cdef bint _may_match(self, const unsigned char* s2, int n) noexcept nogil:
+        """
+        Determine whether the DP can find an alignment of the (translated)
+        query. The DP costs are never lower than the edit distances computed
+        by _scan_edit_distances, so it is enough to check whether any cell in
+        which an alignment can end has an edit distance within the allowed
+        error rate. To know the length of the aligned part of the reference,
+        alignments that start at the beginning of the reference are scanned
+        separately from those that skip a prefix of the reference (which can
+        only start at the beginning of the query).
+        """
+        cdef int m = self.m
+        cdef bint start_in_ref = self.flags & START_WITHIN_SEQ1
+        cdef bint start_in_query = self.flags & START_WITHIN_SEQ2
+        cdef bint stop_in_ref = self.flags & STOP_WITHIN_SEQ1
+        cdef bint stop_in_query = self.flags & STOP_WITHIN_SEQ2
+        cdef int first_i = 0 if stop_in_ref else m
+
+        if _scan_edit_distances(
+                self._peq, s2, n, False, m, False, start_in_query,
+                stop_in_query, first_i, m, self._min_overlap,
+                self.max_error_rate):
+            return True
+        if not start_in_ref:
+            return False
+        # Alignments of a suffix of the reference to a prefix of the query,
+        # scanned from the end so that the row index is the aligned length.
+        if _scan_edit_distances(
+                self._peq_reverse, s2, n, True, m, False, stop_in_query,
+                False, 1, m, self._min_overlap, self.max_error_rate):
+            return True
+        # Alignments of the whole query within the reference. The aligned
+        # length is at most the row index.
+        return stop_in_ref and _scan_edit_distances(
+            self._peq, s2, n, False, m, True, False, False, 1, m - 1,
+            self._min_overlap, self.max_error_rate)
 
     property dpmatrix:
         """
@@ -273,25 +502,79 @@ cdef class Aligner:
 
         The alignment itself is not returned.
         """
-        cdef char* s1 = self._reference
-        cdef bytes query_bytes = query.encode('ascii')
-        cdef char* s2 = query_bytes
+        cdef bytes query_bytes = _translate_query(
+            query.encode('ascii'), self.wildcard_ref, self.wildcard_query)
+        cdef const char* s2 = query_bytes
+        cdef int n = len(query_bytes)
+        cdef int result[6]
+        cdef bint found
+        if self.debug:
+            self._dpmatrix = DPMatrix(self.str_reference, query)
+        with nogil:
+            found = self._locate(s2, n, result)
+        if not found:
+            return None
+        assert result[1] - result[0] > 0  # Do not return empty alignments.
+        return (result[0], result[1], result[2], result[3], result[4], result[5])
+
+    def locate_batch(self, queries, offsets=None):
+        """
+        locate_batch(queries, offsets=None) -> array('i')
+
+        Find the reference in each of a batch of queries. The queries are
+        either a sequence of strings, or a bytes-like object with the
+        concatenated queries, in which case offsets are the positions at which
+        the queries start, followed by the end of the last query.
+
+        Returns an int array with six values per query: those returned by
+        locate(), or -1 if there is no match.
+        """
+        cdef bytes raw_buffer, buffer
+        cdef array query_offsets
+        raw_buffer, query_offsets = _pack_queries(queries, offsets)
+        buffer = _translate_query(
+            raw_buffer, self.wildcard_ref, self.wildcard_query)
+        cdef int num_queries = len(query_offsets) - 1
+        cdef array results = clone(int_array, 6 * num_queries, False)
+        cdef const char* s2 = buffer
+        cdef int* starts = query_offsets.data.as_ints
+        cdef int* result = results.data.as_ints
+        cdef int i
+        if self.debug:
+            for i in range(num_queries):
+                alignment = self.locate(
+                    raw_buffer[starts[i]:starts[i + 1]].decode('ascii'))
+                if alignment is None:
+                    _store_no_match(result + 6 * i)
+                else:
+                    results[6 * i:6 * i + 6] = array('i', alignment)
+            return results
+        with nogil:
+            for i in range(num_queries):
+                if not self._locate(
+                        s2 + starts[i], starts[i + 1] - starts[i],
+                        result + 6 * i):
+                    _store_no_match(result + 6 * i)
+        return results
+
+    cdef bint _locate(self, const char* s2, int n, int* result) noexcept nogil:
+        """
+        Find the (translated) query s2 of length n. If there is a match, store
+        it in result and return True.
+        """
+        cdef const char* s1 = self._s1
         cdef int m = self.m
-        cdef int n = len(query)
         cdef _Entry* column = self.column
         cdef double max_error_rate = self.max_error_rate
         cdef bint start_in_ref = self.flags & START_WITHIN_SEQ1
         cdef bint start_in_query = self.flags & START_WITHIN_SEQ2
         cdef bint stop_in_ref = self.flags & STOP_WITHIN_SEQ1
         cdef bint stop_in_query = self.flags & STOP_WITHIN_SEQ2
-
-        if self.wildcard_query:
-            query_bytes = query_bytes.translate(IUPAC_TABLE)
-            s2 = query_bytes
-        elif self.wildcard_ref:
-            query_bytes = query_bytes.translate(ACGT_TABLE)
-            s2 = query_bytes
         cdef bint compare_ascii = not (self.wildcard_query or self.wildcard_ref)
+
+        if self._bit_parallel and not self.debug:
+            if not self._may_match(<const unsigned char*>s2, n):
+                return False
         """
         DP Matrix:
                    query (j)
@@ -302,7 +585,7 @@ cdef class Aligner:
                 V
                m
         """
-        cdef int i, j
+        cdef int i, j, first_i
 
         # maximum no. of errors
         cdef int k = <int> (max_error_rate * m)
@@ -348,9 +631,9 @@ cdef class Aligner:
                 column[i].origin = min_n - i
 
         if self.debug:
-            self._dpmatrix = DPMatrix(self.str_reference, query)
-            for i in range(m + 1):
-                self._dpmatrix.set_entry(i, min_n, column[i].cost)
+            with gil:
+                for i in range(m + 1):
+                    self._dpmatrix.set_entry(i, min_n, column[i].cost)
         cdef _Match best
         best.ref_stop = m
         best.query_stop = n
@@ -371,88 +654,87 @@ cdef class Aligner:
         cdef bint characters_equal
         cdef _Entry tmp_entry
 
-        with nogil:
-            # iterate over columns
-            for j in range(min_n + 1, max_n + 1):
-                # remember first entry
-                tmp_entry = column[0]
-
-                # fill in first entry in this column
-                if start_in_query:
-                    column[0].origin = j
+        # iterate over columns
+        for j in range(min_n + 1, max_n + 1):
+            # remember first entry
+            tmp_entry = column[0]
+
+            # fill in first entry in this column
+            if start_in_query:
+                column[0].origin = j
+            else:
+                column[0].cost = j * self._insertion_cost
+            for i in range(1, last + 1):
+                if compare_ascii:
+                    characters_equal = (s1[i-1] == s2[j-1])
                 else:
-                    column[0].cost = j * self._insertion_cost
-                for i in range(1, last + 1):
-                    if compare_ascii:
-                        characters_equal = (s1[i-1] == s2[j-1])
-                    else:
-                        characters_equal = (s1[i-1] & s2[j-1]) != 0
-                    if characters_equal:
-                        # Characters match: This cannot be an indel.
-                        cost = tmp_entry.cost
+                    characters_equal = (s1[i-1] & s2[j-1]) != 0
+                if characters_equal:
+                    # Characters match: This cannot be an indel.
+                    cost = tmp_entry.cost
+                    origin = tmp_entry.origin
+                    matches = tmp_entry.matches + 1
+                else:
+                    # Characters do not match.
+                    cost_diag = tmp_entry.cost + 1
+                    cost_deletion = column[i].cost + self._deletion_cost
+                    cost_insertion = column[i-1].cost + self._insertion_cost
+
+                    if cost_diag <= cost_deletion and cost_diag <= cost_insertion:
+                        # MISMATCH
+                        cost = cost_diag
                         origin = tmp_entry.origin
-                        matches = tmp_entry.matches + 1
+                        matches = tmp_entry.matches
+                    elif cost_insertion <= cost_deletion:
+                        # INSERTION
+                        cost = cost_insertion
+                        origin = column[i-1].origin
+                        matches = column[i-1].matches
                     else:
-                        # Characters do not match.
-                        cost_diag = tmp_entry.cost + 1
-                        cost_deletion = column[i].cost + self._deletion_cost
-                        cost_insertion = column[i-1].cost + self._insertion_cost
-
-                        if cost_diag <= cost_deletion and cost_diag <= cost_insertion:
-                            # MISMATCH
-                            cost = cost_diag
-                            origin = tmp_entry.origin
-                            matches = tmp_entry.matches
-                        elif cost_insertion <= cost_deletion:
-                            # INSERTION
-                            cost = cost_insertion
-                            origin = column[i-1].origin
-                            matches = column[i-1].matches
-                        else:
-                            # DELETION
-                            cost = cost_deletion
-                            origin = column[i].origin
-                            matches = column[i].matches
-
-                    # remember current cell for next iteration
-                    tmp_entry = column[i]
-
-                    column[i].cost = cost
-                    column[i].origin = origin
-                    column[i].matches = matches
-                
-                if self.debug:
-                    with gil:
-                        for i in range(last + 1):
-                            self._dpmatrix.set_entry(i, j, column[i].cost)
-                
-                while last >= 0 and column[last].cost > k:
-                    last -= 1
-                
-                # last can be -1 here, but will be incremented next.
-                # TODO if last is -1, can we stop searching?
-                if last < m:
-                    last += 1
-                elif stop_in_query:
-                    # Found a match. If requested, find best match in last row.
-                    # length of the aligned part of the reference
-                    length = m + min(column[m].origin, 0)
-                    cost = column[m].cost
-                    matches = column[m].matches
-                    if (length >= self._min_overlap and
-                            cost <= length * max_error_rate and
-                            (matches > best.matches or
-                                (matches == best.matches and cost < best.cost))):
-                        # update
-                        best.matches = matches
-                        best.cost = cost
-                        best.origin = column[m].origin
-                        best.ref_stop = m
-                        best.query_stop = j
-                        if cost == 0 and matches == m:
-                            # exact match, stop early
-                            break
-                # column finished
+                        # DELETION
+                        cost = cost_deletion
+                        origin = column[i].origin
+                        matches = column[i].matches
+
+                # remember current cell for next iteration
+                tmp_entry = column[i]
+
+                column[i].cost = cost
+                column[i].origin = origin
+                column[i].matches = matches
+
+            if self.debug:
+                with gil:
+                    for i in range(last + 1):
+                        self._dpmatrix.set_entry(i, j, column[i].cost)
+
+            while last >= 0 and column[last].cost > k:
+                last -= 1
+
+            # last can be -1 here, but will be incremented next.
+            # TODO if last is -1, can we stop searching?
+            if last < m:
+                last += 1
+            elif stop_in_query:
+                # Found a match. If requested, find best match in last row.
+                # length of the aligned part of the reference
+                length = m + min(column[m].origin, 0)
+                cost = column[m].cost
+                matches = column[m].matches
+                if (length >= self._min_overlap and
+                        cost <= length * max_error_rate and
+                        (matches > best.matches or
+                            (matches == best.matches and cost < best.cost))):
+                    # update
+                    best.matches = matches
+                    best.cost = cost
+                    best.origin = column[m].origin
+                    best.ref_stop = m
+                    best.query_stop = j
+                    if cost == 0 and matches == m:
+                        # exact match, stop early
+                        break
+            # column finished
 
         if max_n == n:
             first_i = 0 if stop_in_ref else m
@@ -468,26 +750,592 @@ cdef class Aligner:
                     best.origin = column[i].origin
                     best.ref_stop = i
                     best.query_stop = n
-        
+
         if best.cost == m + n:
             # best.cost was initialized with this value.
             # If it is unchanged, no alignment was found that has
             # an error rate within the allowed range.
+            return False
+
+        _store_match(&best, result)
+        return True
+
+    def __dealloc__(self):
+        PyMem_Free(self.column)
+
+cdef inline int _count_matches(
+        const unsigned char* s1, const unsigned char* s2, int length,
+        int max_mismatches, bint compare_ascii) noexcept nogil:
+    """
+    Count the positions at which two strings of the given length match, eight
+    characters at a time. If compare_ascii is False, the strings must have
+    been translated with the IUPAC/ACGT tables, and characters match if they
+    have a bit in common. Returns -1 as soon as there are more than
+    max_mismatches mismatches.
+    """
+    cdef uint64_t word1, word2, x, nonzero
+    cdef int i = 0
+    cdef int matches = 0
+    while i + 8 <= length:
+        memcpy(&word1, s1 + i, 8)
+        memcpy(&word2, s2 + i, 8)
+        if compare_ascii:
+            x = word1 ^ word2
+        else:
+            x = word1 & word2
+        # set the high bit of every nonzero byte
+        nonzero = (((x & LOW_BITS) + LOW_BITS) | x) & HIGH_BITS
+        if compare_ascii:
+            nonzero ^= HIGH_BITS
+        matches += <int>((((nonzero >> 7) * BYTE_ONES) >> 56))
+        i += 8
+        if i - matches > max_mismatches:
+            return -1
+    while i < length:
+        if compare_ascii:
+            matches += s1[i] == s2[i]
+        else:
+            matches += (s1[i] & s2[i]) != 0
+        i += 1
+    if length - matches > max_mismatches:
+        return -1
+    return matches
+
+cdef class HammingAligner:
+    """
+    Locate one string within another when no indels are allowed.
+
+    The arguments, flags and return values are the same as those of Aligner,
+    and so is the choice of the best alignment (the same tuple is returned as
+    by an Aligner with a prohibitive indel cost). Instead of computing a DP,
+    the number of mismatches is counted for every offset of the reference
+    within the query that is allowed by the flags, comparing eight
+    characters at a time.
+    """
+    cdef int m
+    cdef double max_error_rate
+    cdef int flags
+    cdef int _min_overlap
+    cdef bint wildcard_ref
+    cdef bint wildcard_query
+    cdef bint compare_ascii
+    cdef bytes _reference
+    cdef const unsigned char* s1  # points into _reference
+    cdef str str_reference
+
+    def __cinit__(self, str reference, double max_error_rate, int flags=SEMIGLOBAL, bint wildcard_ref=False,
+                  bint wildcard_query=False, int min_overlap=1):
+        self.max_error_rate = max_error_rate
+        self.flags = flags
+        self.wildcard_ref = wildcard_ref
+        self.wildcard_query = wildcard_query
+        self.compare_ascii = not (wildcard_query or wildcard_ref)
+        self.reference = reference
+        self.min_overlap = min_overlap
+
+    def __reduce__(self):
+        return (
+            HammingAligner,
+            (self.str_reference, self.max_error_rate, self.flags,
+             self.wildcard_ref, self.wildcard_query, self._min_overlap))
+
+    property min_overlap:
+        def __get__(self):
+            return self._min_overlap
+
+        def __set__(self, int value):
+            if value < 1:
+                raise ValueError('Minimum overlap must be at least 1')
+            self._min_overlap = value
+
+    property reference:
+        def __get__(self):
+            return self._reference
+
+        def __set__(self, str reference):
+            self._reference = reference.encode('ascii')
+            self.m = len(reference)
+            if self.wildcard_ref:
+                self._reference = self._reference.translate(IUPAC_TABLE)
+            elif self.wildcard_query:
+                self._reference = self._reference.translate(ACGT_TABLE)
+            self.s1 = self._reference
+            self.str_reference = reference
+
+    property dpmatrix:
+        """
+        Always None, since no DP matrix is computed.
+        """
+        def __get__(self):
             return None
 
-        cdef int start1, start2
-        if best.origin >= 0:
-            start1 = 0
-            start2 = best.origin
+    def enable_debug(self):
+        """
+        Does nothing; for compatibility with Aligner.
+        """
+        pass
+
+    cdef void _align_at(
+            self, const unsigned char* s2, int n, int offset,
+            _Match* best) noexcept nogil:
+        """
+        Align the reference at the given offset within the query (negative
+        offsets skip a prefix of the reference) and update best if the
+        alignment is allowed and better.
+        """
+        cdef int start1 = max(0, -offset)
+        cdef int stop1 = min(self.m, n - offset)
+        cdef int length = stop1 - start1
+        cdef int matches, cost
+        if length < self._min_overlap:
+            return
+        if ((start1 > 0 and not self.flags & START_WITHIN_SEQ1) or
+                (offset > 0 and not self.flags & START_WITHIN_SEQ2) or
+                (stop1 < self.m and not self.flags & STOP_WITHIN_SEQ1) or
+                (stop1 + offset < n and not self.flags & STOP_WITHIN_SEQ2)):
+            return
+        if length < best.matches:
+            # cannot be better than the best alignment so far
+            return
+        matches = _count_matches(
+            self.s1 + start1, s2 + start1 + offset, length,
+            <int>(length * self.max_error_rate), self.compare_ascii)
+        if matches < 0:
+            return
+        cost = length - matches
+        if (matches > best.matches or
+                (matches == best.matches and cost < best.cost)):
+            best.matches = matches
+            best.cost = cost
+            best.origin = offset
+            best.ref_stop = stop1
+            best.query_stop = stop1 + offset
+
+    def locate(self, str query):
+        """
+        locate(query) -> (refstart, refstop, querystart, querystop, matches, errors)
+
+        Find the query within the reference associated with this aligner,
+        without indels. See Aligner.locate.
+        """
+        cdef bytes query_bytes = _translate_query(
+            query.encode('ascii'), self.wildcard_ref, self.wildcard_query)
+        cdef const unsigned char* s2 = query_bytes
+        cdef int n = len(query_bytes)
+        cdef int result[6]
+        cdef bint found
+        with nogil:
+            found = self._locate(s2, n, result)
+        if not found:
+            return None
+        return (result[0], result[1], result[2], result[3], result[4], result[5])
+
+    def locate_batch(self, queries, offsets=None):
+        """
+        locate_batch(queries, offsets=None) -> array('i')
+
+        Find the reference in each of a batch of queries, without indels. See
+        Aligner.locate_batch.
+        """
+        cdef bytes buffer
+        cdef array query_offsets
+        buffer, query_offsets = _pack_queries(queries, offsets)
+        buffer = _translate_query(
+            buffer, self.wildcard_ref, self.wildcard_query)
+        cdef int num_queries = len(query_offsets) - 1
+        cdef array results = clone(int_array, 6 * num_queries, False)
+        cdef const unsigned char* s2 = buffer
+        cdef int* starts = query_offsets.data.as_ints
+        cdef int* result = results.data.as_ints
+        cdef int i
+        with nogil:
+            for i in range(num_queries):
+                if not self._locate(
+                        s2 + starts[i], starts[i + 1] - starts[i],
+                        result + 6 * i):
+                    _store_no_match(result + 6 * i)
+        return results
+
+    cdef bint _locate(
+            self, const unsigned char* s2, int n, int* result) noexcept nogil:
+        cdef int m = self.m
+        cdef int offset, i
+        cdef _Match best
+        best.ref_stop = m
+        best.query_stop = n
+        best.cost = m + n
+        best.origin = 0
+        best.matches = 0
+
+        # Offsets are visited in the same order in which Aligner visits the
+        # cells in which the alignments end, so that ties are resolved the
+        # same way.
+        if self.flags & STOP_WITHIN_SEQ2:
+            # alignments that end with the reference
+            for offset in range(1 - m, n - m + 1):
+                self._align_at(s2, n, offset, &best)
+        # alignments that end with the query
+        for i in range(1, m + 1):
+            self._align_at(s2, n, n - i, &best)
+
+        if best.cost == m + n:
+            return False
+        _store_match(&best, result)
+        return True
+
+# Maximum length of the seeds of a SeedFilter (so that a 2-bit encoded seed
+# plus one fits in 64 bits)
+DEF MAX_SEED_LENGTH = 31
+
+# 2-bit codes of the bases (-1 for other characters)
+cdef signed char _BASE_CODES[256]
+for _i in range(256):
+    _BASE_CODES[_i] = -1
+for _i, _c in enumerate('ACGT'):
+    _BASE_CODES[ord(_c)] = _i
+
+cdef uint64_t _encode(bytes seed):
+    cdef uint64_t code = 0
+    cdef unsigned char c
+    for c in seed:
+        code = (code << 2) | <uint64_t>_BASE_CODES[c]
+    return code
+
+cdef class SeedFilter:
+    """
+    Rule out queries that cannot contain an alignment with the reference.
+
+    The reference is split into pieces ('seeds') of equal length. An
+    alignment in which the aligned part of the reference fully contains more
+    pieces than it has errors must contain one of the pieces without error
+    (every mismatch or indel breaks at most one piece), so the query must
+    contain an exact copy of one of the seeds. The seed length is the largest
+    one for which this holds for an alignment of the full reference, and for
+    which all shorter alignments for which it does not hold are at most 64
+    bases long.
+
+    Those shorter alignments can only be partial alignments at the ends of
+    the query. They are checked by computing the edit distances between the
+    end of the reference and a window at the end of the query (if a suffix of
+    the reference may be skipped), and between the start of the reference and
+    a window at the start of the query (if a prefix may be skipped), using
+    the bit-parallel algorithm also used by Aligner. If both may be skipped,
+    queries that could lie entirely within the reference are never ruled out.
+
+    Thus a query for which may_match() returns False cannot be matched by an
+    Aligner (or HammingAligner) with the same arguments. Characters are
+    compared as ASCII; the filter must not be used with wildcards. If no
+    seed of at least min_seed_length can be used, or the reference contains
+    characters other than A, C, G and T, the filter is disabled (seed_length
+    is 0) and may_match() always returns True.
+    """
+    cdef readonly int seed_length
+    cdef readonly tuple seeds
+    cdef str reference
+    cdef int min_seed_length
+    cdef int m
+    cdef int flags
+    cdef int min_overlap
+    cdef double max_error_rate
+    # longest partial alignment that is checked at the ends of the query
+    cdef int max_end_length
+    cdef int end_window
+    cdef int max_contained_length
+    # bit vectors of the positions in the first (last, reversed)
+    # max_end_length characters of the reference matching each character
+    cdef uint64_t peq_prefix[256]
+    cdef uint64_t peq_suffix[256]
+    cdef uint64_t* table  # open-addressing hash table of seed codes plus one
+    cdef int table_bits
+
+    def __cinit__(
+            self, str reference, double max_error_rate, int flags=SEMIGLOBAL,
+            int min_overlap=1, int min_seed_length=5):
+        cdef bytes reference_bytes = reference.encode('ascii')
+        cdef int m = len(reference)
+        cdef int seed_length, length, max_unseeded, c, i
+        self.reference = reference
+        self.min_seed_length = min_seed_length
+        self.m = m
+        self.flags = flags
+        self.min_overlap = max(min_overlap, 1)
+        self.max_error_rate = max_error_rate
+        self.seed_length = 0
+        self.seeds = ()
+        self.table = NULL
+        if m == 0 or any(_BASE_CODES[c] < 0 for c in reference_bytes):
+            return
+
+        # Find the longest seed that every alignment of the full reference
+        # contains without errors, and such that the longest alignment that
+        # is not guaranteed to contain a seed fits in a machine word.
+        seed_length = min(m, MAX_SEED_LENGTH)
+        while seed_length >= min_seed_length:
+            max_unseeded = 0
+            for length in range(self.min_overlap, m + 1):
+                if length // seed_length <= <int>(length * max_error_rate):
+                    max_unseeded = length
+            if max_unseeded < m and max_unseeded <= MAX_BIT_PARALLEL_LENGTH:
+                break
+            seed_length -= 1
+        if seed_length < min_seed_length:
+            return
+        self.seed_length = seed_length
+        self.max_end_length = max_unseeded
+        self.end_window = max_unseeded + <int>(max_unseeded * max_error_rate)
+        for c in range(256):
+            self.peq_prefix[c] = 0
+            self.peq_suffix[c] = 0
+            for i in range(max_unseeded):
+                if reference_bytes[i] == c:
+                    self.peq_prefix[c] |= (<uint64_t>1) << i
+                if reference_bytes[m - 1 - i] == c:
+                    self.peq_suffix[c] |= (<uint64_t>1) << i
+
+        # The seeds are aligned to the start of the reference unless a prefix
+        # of the reference may be skipped (and, in that case, also to its end
+        # if a suffix may be skipped as well).
+        seeds = set()
+        num_seeds = m // seed_length
+        if not flags & START_WITHIN_SEQ1 or flags & STOP_WITHIN_SEQ1:
+            seeds.update(
+                reference[i * seed_length:(i + 1) * seed_length]
+                for i in range(num_seeds))
+        if flags & START_WITHIN_SEQ1:
+            seeds.update(
+                reference[m - (i + 1) * seed_length:m - i * seed_length]
+                for i in range(num_seeds))
+        if flags & START_WITHIN_SEQ1 and flags & STOP_WITHIN_SEQ1:
+            # An alignment that skips both a prefix and a suffix of the
+            # reference contains the whole query
+            self.max_contained_length = m + <int>(m * max_error_rate)
         else:
-            start1 = -best.origin
-            start2 = 0
+            self.max_contained_length = -1
+
+        self.table_bits = 2
+        while (1 << self.table_bits) < 4 * len(seeds):
+            self.table_bits += 1
+        self.table = <uint64_t*>PyMem_Malloc(
+            (1 << self.table_bits) * sizeof(uint64_t))
+        if not self.table:
+            raise MemoryError()
+        for i in range(1 << self.table_bits):
+            self.table[i] = 0
+        self.seeds = tuple(sorted(seeds))
+        for seed in self.seeds:
+            self._add(_encode(seed.encode('ascii')))
+
+    cdef inline uint64_t _slot(self, uint64_t code) noexcept nogil:
+        return (code * 0x9E3779B97F4A7C15ULL) >> (64 - self.table_bits)
+
+    cdef void _add(self, uint64_t code):
+        cdef uint64_t slot = self._slot(code)
+        cdef uint64_t mask = (1 << self.table_bits) - 1
+        while self.table[slot] != 0 and self.table[slot] != code + 1:
+            slot = (slot + 1) & mask
+        self.table[slot] = code + 1
+
+    cdef bint _contains(self, uint64_t code) noexcept nogil:
+        cdef uint64_t slot = self._slot(code)
+        cdef uint64_t mask = (1 << self.table_bits) - 1
+        while self.table[slot] != 0:
+            if self.table[slot] == code + 1:
+                return True
+            slot = (slot + 1) & mask
+        return False
+
+    def may_match(self, str query):
+        """
+        Returns False if the query cannot contain an alignment with the
+        reference.
+        """
+        if self.seed_length == 0:
+            return True
+        cdef bytes query_bytes = query.encode('ascii')
+        cdef const unsigned char* s2 = query_bytes
+        cdef int n = len(query_bytes)
+        cdef bint may_match
+        if n <= self.max_contained_length:
+            return True
+        with nogil:
+            may_match = self._may_match(s2, n)
+        return may_match
+
+    cdef bint _may_match(self, const unsigned char* s2, int n) noexcept nogil:
+        cdef int j
+        cdef int valid = 0
+        cdef signed char base
+        cdef uint64_t code = 0
+        cdef uint64_t mask = ((<uint64_t>1) << (2 * self.seed_length)) - 1
+
+        if self._may_match_ends(s2, n):
+            return True
+        for j in range(n):
+            base = _BASE_CODES[s2[j]]
+            if base < 0:
+                valid = 0
+                continue
+            code = ((code << 2) | <uint64_t>base) & mask
+            valid += 1
+            if valid >= self.seed_length and self._contains(code):
+                return True
+        return False
+
+    cdef bint _may_match_ends(self, const unsigned char* s2, int n) noexcept nogil:
+        """
+        Check for partial alignments at the ends of the query that are too
+        short to contain a seed.
+        """
+        cdef int window = min(self.end_window, n)
+        if self.max_end_length == 0:
+            return False
+        if self.flags & STOP_WITHIN_SEQ1 and _scan_edit_distances(
+                self.peq_prefix, s2 + n - window, window, False,
+                self.max_end_length, False, True, False, 1,
+                self.max_end_length, self.min_overlap, self.max_error_rate):
+            return True
+        return self.flags & START_WITHIN_SEQ1 and _scan_edit_distances(
+            self.peq_suffix, s2, window, True, self.max_end_length, False,
+            True, False, 1, self.max_end_length, self.min_overlap,
+            self.max_error_rate)
+
+    def __reduce__(self):
+        return (
+            SeedFilter,
+            (self.reference, self.max_error_rate, self.flags,
+             self.min_overlap, self.min_seed_length))
+
+    def __dealloc__(self):
+        PyMem_Free(self.table)
+
+cdef class SeedIndex:
+    """
+    Find the SeedFilters that may match a query with a single scan of the
+    query, using an index of the seeds of all filters.
+
+    Args:
+        seed_filters: A sequence of SeedFilters. None (or a disabled filter)
+            matches every query.
+    """
+    cdef list seed_filters
+    cdef int num_filters
+    cdef unsigned char* hits
+    # distinct seed lengths, and the longest one
+    cdef int num_lengths
+    cdef int seed_lengths[MAX_SEED_LENGTH]
+    cdef int max_seed_length
+    # open-addressing hash table of (seed code plus one, seed length) ->
+    # filter index; the same key may occur multiple times
+    cdef uint64_t* keys
+    cdef unsigned char* key_lengths
+    cdef int* values
+    cdef int table_bits
+
+    def __cinit__(self, seed_filters):
+        cdef SeedFilter seed_filter
+        cdef int i, length, num_seeds = 0
+        self.seed_filters = list(seed_filters)
+        self.num_filters = len(self.seed_filters)
+        self.hits = <unsigned char*>PyMem_Malloc(max(self.num_filters, 1))
+        lengths = set()
+        for seed_filter in self.seed_filters:
+            if seed_filter is not None and seed_filter.seed_length > 0:
+                lengths.add(seed_filter.seed_length)
+                num_seeds += len(seed_filter.seeds)
+        self.num_lengths = len(lengths)
+        self.max_seed_length = max(lengths) if lengths else 0
+        for i, length in enumerate(sorted(lengths)):
+            self.seed_lengths[i] = length
+
+        self.table_bits = 2
+        while (1 << self.table_bits) < 2 * num_seeds:
+            self.table_bits += 1
+        self.keys = <uint64_t*>PyMem_Malloc(
+            (1 << self.table_bits) * sizeof(uint64_t))
+        self.key_lengths = <unsigned char*>PyMem_Malloc(1 << self.table_bits)
+        self.values = <int*>PyMem_Malloc((1 << self.table_bits) * sizeof(int))
+        if not (self.hits and self.keys and self.key_lengths and self.values):
+            raise MemoryError()
+        for i in range(1 << self.table_bits):
+            self.keys[i] = 0
+        for i, seed_filter in enumerate(self.seed_filters):
+            if seed_filter is not None and seed_filter.seed_length > 0:
+                for seed in seed_filter.seeds:
+                    self._add(
+                        _encode(seed.encode('ascii')), seed_filter.seed_length,
+                        i)
+
+    cdef inline uint64_t _slot(self, uint64_t code, int length) noexcept nogil:
+        return (
+            ((code + <uint64_t>length) * 0x9E3779B97F4A7C15ULL) >>
+            (64 - self.table_bits))
+
+    cdef void _add(self, uint64_t code, int length, int value):
+        cdef uint64_t slot = self._slot(code, length)
+        cdef uint64_t mask = (1 << self.table_bits) - 1
+        while self.keys[slot] != 0:
+            slot = (slot + 1) & mask
+        self.keys[slot] = code + 1
+        self.key_lengths[slot] = length
+        self.values[slot] = value
+
+    cdef void _hit(self, uint64_t code, int length) noexcept nogil:
+        cdef uint64_t slot = self._slot(code, length)
+        cdef uint64_t mask = (1 << self.table_bits) - 1
+        while self.keys[slot] != 0:
+            if self.keys[slot] == code + 1 and self.key_lengths[slot] == length:
+                self.hits[self.values[slot]] = 1
+            slot = (slot + 1) & mask
+
+    def candidates(self, str query):
+        """
+        Returns the (increasing) indexes of the seed filters that may match
+        the query.
+        """
+        cdef bytes query_bytes = query.encode('ascii')
+        cdef const unsigned char* s2 = query_bytes
+        cdef int n = len(query_bytes)
+        cdef int i, j, length
+        cdef int valid = 0
+        cdef signed char base
+        cdef uint64_t code = 0
+        cdef SeedFilter seed_filter
+
+        for i in range(self.num_filters):
+            self.hits[i] = 0
+        with nogil:
+            for j in range(n):
+                base = _BASE_CODES[s2[j]]
+                if base < 0:
+                    valid = 0
+                    continue
+                code = (code << 2) | <uint64_t>base
+                valid += 1
+                for i in range(self.num_lengths):
+                    length = self.seed_lengths[i]
+                    if valid >= length:
+                        self._hit(
+                            code & (((<uint64_t>1) << (2 * length)) - 1),
+                            length)
+        result = []
+        for i in range(self.num_filters):
+            seed_filter = self.seed_filters[i]
+            if (
+                    self.hits[i] or seed_filter is None or
+                    seed_filter.seed_length == 0 or
+                    n <= seed_filter.max_contained_length or
+                    seed_filter._may_match_ends(s2, n)):
+                result.append(i)
+        return result
 
-        assert best.ref_stop - start1 > 0  # Do not return empty alignments.
-        return (start1, best.ref_stop, start2, best.query_stop, best.matches, best.cost)
+    def __reduce__(self):
+        return (SeedIndex, (self.seed_filters,))
 
     def __dealloc__(self):
-        PyMem_Free(self.column)
+        PyMem_Free(self.hits)
+        PyMem_Free(self.keys)
+        PyMem_Free(self.key_lengths)
+        PyMem_Free(self.values)
 
 def locate(str reference, str query, double max_error_rate, int flags=SEMIGLOBAL, bint wildcard_ref=False, bint wildcard_query=False, int min_overlap=1):
     aligner = Aligner(reference, max_error_rate, flags, wildcard_ref, wildcard_query)
@@ -504,14 +1352,10 @@ def compare_prefixes(str ref, str query, bint wildcard_ref=False, bint wildcard_
 
     This function returns a tuple compatible with what Aligner.locate outputs.
     """
-    cdef int m = len(ref)
-    cdef int n = len(query)
     cdef bytes query_bytes = query.encode('ascii')
     cdef bytes ref_bytes = ref.encode('ascii')
-    cdef char* r_ptr
-    cdef char* q_ptr
-    cdef int length = min(m, n)
-    cdef int i, matches = 0
+    cdef int length = min(len(ref_bytes), len(query_bytes))
+    cdef int matches
     cdef bint compare_ascii = False
 
     if wildcard_ref:
@@ -525,16 +1369,10 @@ def compare_prefixes(str ref, str query, bint wildcard_ref=False, bint wildcard_
     elif wildcard_ref:
         query_bytes = query_bytes.translate(ACGT_TABLE)
 
-    if compare_ascii:
-        for i in range(length):
-            if ref[i] == query[i]:
-                matches += 1
-    else:
-        r_ptr = ref_bytes
-        q_ptr = query_bytes
-        for i in range(length):
-            if (r_ptr[i] & q_ptr[i]) != 0:
-                matches += 1
+    cdef const unsigned char* r_ptr = ref_bytes
+    cdef const unsigned char* q_ptr = query_bytes
+    with nogil:
+        matches = _count_matches(r_ptr, q_ptr, length, length, compare_ascii)
 
     # length - matches = no. of errors
     return (0, length, 0, length, matches, length - matches)
@@ -598,12 +1436,71 @@ cdef class MultiAligner:
         self._resize_matches(max_matches)
         
         cdef bytes reference_bytes = reference.encode('ascii')
-        cdef char* s1 = reference_bytes
-        
         cdef bytes query_bytes = query.encode('ascii')
-        cdef char* s2 = query_bytes
-        cdef int n = len(query)
+        cdef const char* s1 = reference_bytes
+        cdef const char* s2 = query_bytes
+        cdef int n = len(query_bytes)
+        cdef int num_matches
+        with nogil:
+            num_matches = self._locate(s1, m, s2, n, max_matches)
         
+        if num_matches == 0:
+            return None
+        return [self._create_match(self.match_array[i]) for i in range(num_matches)]
+
+    def locate_batch(self, references, queries, int max_matches=100):
+        """
+        locate_batch(references, queries, max_matches=100) -> (array('i'), array('i'))
+
+        Find each query within the corresponding reference. Returns an int
+        array with six values per match (those returned by locate()), and an
+        int array with the index of the first match of each query, followed by
+        the total number of matches.
+        """
+        cdef bytes reference_buffer, query_buffer
+        cdef array reference_offsets, query_offsets
+        reference_buffer, reference_offsets = _pack_queries(references, None)
+        query_buffer, query_offsets = _pack_queries(queries, None)
+        cdef int num_queries = len(query_offsets) - 1
+        if len(reference_offsets) - 1 != num_queries:
+            raise ValueError(
+                "The numbers of references and queries must be the same")
+        cdef const char* s1 = reference_buffer
+        cdef const char* s2 = query_buffer
+        cdef int* ref_starts = reference_offsets.data.as_ints
+        cdef int* starts = query_offsets.data.as_ints
+        cdef int i, j, m, num_matches, total = 0, max_m = 1
+        
+        for i in range(num_queries):
+            max_m = max(max_m, ref_starts[i + 1] - ref_starts[i])
+        self._resize_matrix(max_m)
+        self._resize_matches(max_matches)
+        
+        cdef array results = clone(int_array, 0, False)
+        cdef array match_offsets = clone(int_array, num_queries + 1, False)
+        match_offsets.data.as_ints[0] = 0
+        for i in range(num_queries):
+            m = ref_starts[i + 1] - ref_starts[i]
+            with nogil:
+                num_matches = self._locate(
+                    s1 + ref_starts[i], m, s2 + starts[i],
+                    starts[i + 1] - starts[i], max_matches)
+            resize_smart(results, 6 * (total + num_matches))
+            for j in range(num_matches):
+                _store_match(
+                    &self.match_array[j], results.data.as_ints + 6 * (total + j))
+            total += num_matches
+            match_offsets.data.as_ints[i + 1] = total
+        return results, match_offsets
+
+    cdef int _locate(
+            self, const char* s1, int m, const char* s2, int n,
+            int max_matches) noexcept nogil:
+        """
+        Find all matches of the query s2 of length n within the reference s1
+        of length m and store them in match_array. An exact match is the only
+        match stored. Returns the number of matches.
+        """
         cdef _Match* match_array = self.match_array
         cdef int num_matches = 0
         cdef int exact_match = -1
@@ -616,7 +1513,7 @@ cdef class MultiAligner:
         cdef bint stop_in_ref = self.flags & STOP_WITHIN_SEQ1
         cdef bint stop_in_query = self.flags & STOP_WITHIN_SEQ2
 
-        cdef int i, j
+        cdef int i, j, first_i
 
         # maximum no. of errors
         cdef int k = <int> (max_error_rate * m)
@@ -662,102 +1559,101 @@ cdef class MultiAligner:
         cdef bint characters_equal
         cdef _Entry tmp_entry
 
-        with nogil:
-            # iterate over columns
-            for j in range(min_n + 1, max_n + 1):
-                # remember first entry
-                tmp_entry = column[0]
+        # iterate over columns
+        for j in range(min_n + 1, max_n + 1):
+            # remember first entry
+            tmp_entry = column[0]
                 
-                # fill in first entry in this column
-                if start_in_query:
-                    column[0].origin = j
-                else:
-                    column[0].cost = j * OVERHANG_MULTIPLIER
+            # fill in first entry in this column
+            if start_in_query:
+                column[0].origin = j
+            else:
+                column[0].cost = j * OVERHANG_MULTIPLIER
                 
-                for i in range(1, last + 1):
-                    characters_equal = (s1[i-1] == s2[j-1])
+            for i in range(1, last + 1):
+                characters_equal = (s1[i-1] == s2[j-1])
                     
-                    # TODO: this is where we can do qulity-based weighting
-                    # (i.e., add some transformation of Q, rather than 1)
+                # TODO: this is where we can do qulity-based weighting
+                # (i.e., add some transformation of Q, rather than 1)
                     
-                    if characters_equal:
-                        # Characters match: This cannot be an indel.
-                        cost = tmp_entry.cost
-                        origin = tmp_entry.origin
-                        matches = tmp_entry.matches + 1
-                    else:
-                        # Characters do not match.
-                        cost = tmp_entry.cost + 1
-                        origin = tmp_entry.origin
-                        matches = tmp_entry.matches
+                if characters_equal:
+                    # Characters match: This cannot be an indel.
+                    cost = tmp_entry.cost
+                    origin = tmp_entry.origin
+                    matches = tmp_entry.matches + 1
+                else:
+                    # Characters do not match.
+                    cost = tmp_entry.cost + 1
+                    origin = tmp_entry.origin
+                    matches = tmp_entry.matches
                     
-                    # remember current cell for next iteration
-                    tmp_entry = column[i]
+                # remember current cell for next iteration
+                tmp_entry = column[i]
                     
-                    column[i].cost = cost
-                    column[i].origin = origin
-                    column[i].matches = matches
+                column[i].cost = cost
+                column[i].origin = origin
+                column[i].matches = matches
                                 
-                while last >= 0 and column[last].cost > k:
-                    last -= 1
+            while last >= 0 and column[last].cost > k:
+                last -= 1
                 
-                # last can be -1 here, but will be incremented next.
-                # TODO if last is -1, can we stop searching?
-                if last < m:
-                    last += 1
-                elif stop_in_query:
-                    # Found a match. If requested, find best match in last row.
-                    # length of the aligned part of the reference
-                    cost = column[m].cost
-                    if cost > max_cost:
-                        continue
+            # last can be -1 here, but will be incremented next.
+            # TODO if last is -1, can we stop searching?
+            if last < m:
+                last += 1
+            elif stop_in_query:
+                # Found a match. If requested, find best match in last row.
+                # length of the aligned part of the reference
+                cost = column[m].cost
+                if cost > max_cost:
+                    continue
                     
-                    length = m + min(column[m].origin, 0)
-                    if length >= self._min_overlap and cost <= length * max_error_rate:
-                        matches = column[m].matches
+                length = m + min(column[m].origin, 0)
+                if length >= self._min_overlap and cost <= length * max_error_rate:
+                    matches = column[m].matches
                         
-                        match_array[num_matches].ref_stop = m
-                        match_array[num_matches].query_stop = j
-                        match_array[num_matches].cost = cost
-                        match_array[num_matches].origin = column[m].origin
-                        match_array[num_matches].matches = matches
+                    match_array[num_matches].ref_stop = m
+                    match_array[num_matches].query_stop = j
+                    match_array[num_matches].cost = cost
+                    match_array[num_matches].origin = column[m].origin
+                    match_array[num_matches].matches = matches
                         
-                        if cost == 0 and matches == m:
-                            # exact match, stop early
-                            exact_match = num_matches
-                            num_matches += 1
+                    if cost == 0 and matches == m:
+                        # exact match, stop early
+                        exact_match = num_matches
+                        num_matches += 1
+                        break
+                    else:
+                        num_matches += 1
+                        if num_matches >= max_matches:
                             break
-                        else:
-                            num_matches += 1
-                            if num_matches >= max_matches:
-                                break
-            else:
-                if max_n == n:
-                    first_i = 0 if stop_in_ref else m
-                    # search in last column # TODO last?
-                    for i in range(first_i, m+1):
-                        cost = column[i].cost
-                        if cost > max_cost:
-                            continue
-                        
-                        length = i + min(column[i].origin, 0)
-                        if length >= self._min_overlap and cost <= length * max_error_rate:
-                            # update best
-                            match_array[num_matches].ref_stop = i
-                            match_array[num_matches].query_stop = n
-                            match_array[num_matches].cost = cost
-                            match_array[num_matches].origin = column[i].origin
-                            match_array[num_matches].matches = column[i].matches
-                            num_matches += 1
-        
-        if num_matches == 0:
-            result = None
-        elif exact_match >= 0:
-            result = [self._create_match(match_array[exact_match])]
         else:
-            result = [self._create_match(match_array[i]) for i in range(num_matches)]
+            if max_n == n:
+                first_i = 0 if stop_in_ref else m
+                # search in last column # TODO last?
+                for i in range(first_i, m+1):
+                    cost = column[i].cost
+                    if cost > max_cost:
+                        continue
+                        
+                    length = i + min(column[i].origin, 0)
+                    if length >= self._min_overlap and cost <= length * max_error_rate:
+                        # update best
+                        match_array[num_matches].ref_stop = i
+                        match_array[num_matches].query_stop = n
+                        match_array[num_matches].cost = cost
+                        match_array[num_matches].origin = column[i].origin
+                        match_array[num_matches].matches = column[i].matches
+                        num_matches += 1
+                        if num_matches >= max_matches:
+                            break
         
-        return result
+        if exact_match > 0:
+            match_array[0] = match_array[exact_match]
+            return 1
+        elif exact_match == 0:
+            return 1
+        return num_matches
 
     def _create_match(self, _Match _match):
         cdef int start1, start2
@@ -770,6 +1666,170 @@ cdef class MultiAligner:
         assert _match.ref_stop - start1 > 0  # Do not return empty alignments.
         return (start1, _match.ref_stop, start2, _match.query_stop, _match.matches, _match.cost)
 
+    def __reduce__(self):
+        return (
+            MultiAligner, (self.max_error_rate, self.flags, self._min_overlap))
+
     def __dealloc__(self):
         PyMem_Free(self.column)
         PyMem_Free(self.match_array)
+
+cdef class OverlapAligner:
+    """
+    Find the overlaps of a suffix of the reference with a prefix of the
+    query, without indels. These are the matches found by a MultiAligner with
+    flags START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2, which is how the inserts of a
+    read pair are matched (the reference being the reverse complement of read
+    2, and the query read 1). Instead of computing a DP, the mismatches are
+    counted for every overlap length, eight characters at a time.
+
+    Matches are returned in order of increasing overlap length, in the same
+    format as by MultiAligner. If the query contains the whole reference
+    without errors, that is the only match. At most max_matches overlaps
+    within the error rate are considered.
+
+    Optionally, min_matches can be set to a table of the minimum number of
+    matches for each overlap length (for example, the numbers below which
+    the random match probability is too high). Overlaps with fewer matches
+    are then not returned, although they count towards max_matches; overlaps
+    longer than the table are not filtered.
+    """
+    cdef double max_error_rate
+    cdef int _min_overlap
+    cdef int max_matches
+    cdef int* results
+    cdef array _min_matches
+    cdef int _table_size
+
+    def __cinit__(
+            self, double max_error_rate, int min_overlap=1,
+            int max_matches=100):
+        self.max_error_rate = max_error_rate
+        self._min_overlap = max(min_overlap, 1)
+        self.max_matches = max_matches
+        self._min_matches = clone(int_array, 0, False)
+        self._table_size = 0
+        self.results = <int*>PyMem_Malloc(
+            max(max_matches, 1) * 6 * sizeof(int))
+        if not self.results:
+            raise MemoryError()
+
+    def __reduce__(self):
+        return (
+            OverlapAligner,
+            (self.max_error_rate, self._min_overlap, self.max_matches),
+            self.min_matches)
+
+    def __setstate__(self, state):
+        self.min_matches = state
+
+    property min_overlap:
+        def __get__(self):
+            return self._min_overlap
+
+    property min_matches:
+        def __get__(self):
+            return self._min_matches
+
+        def __set__(self, value):
+            self._min_matches = array('i', value)
+            self._table_size = len(self._min_matches)
+
+    def locate(self, str reference, str query):
+        """
+        locate(reference, query) -> list of (refstart, refstop, querystart, querystop, matches, errors)
+
+        Find the overlaps of a suffix of the reference with a prefix of the
+        query. Returns None if there are none.
+        """
+        cdef bytes reference_bytes = reference.encode('ascii')
+        cdef bytes query_bytes = query.encode('ascii')
+        cdef const unsigned char* s1 = reference_bytes
+        cdef const unsigned char* s2 = query_bytes
+        cdef int m = len(reference_bytes)
+        cdef int n = len(query_bytes)
+        cdef int i, num_matches
+        with nogil:
+            num_matches = self._locate(s1, m, s2, n)
+        if num_matches == 0:
+            return None
+        return [
+            tuple(self.results[6 * i + j] for j in range(6))
+            for i in range(num_matches)]
+
+    def locate_batch(self, references, queries):
+        """
+        locate_batch(references, queries) -> (array('i'), array('i'))
+
+        Find the overlaps of each reference with the corresponding query.
+        Returns the results in the same format as MultiAligner.locate_batch.
+        """
+        cdef bytes reference_buffer, query_buffer
+        cdef array reference_offsets, query_offsets
+        reference_buffer, reference_offsets = _pack_queries(references, None)
+        query_buffer, query_offsets = _pack_queries(queries, None)
+        cdef int num_queries = len(query_offsets) - 1
+        if len(reference_offsets) - 1 != num_queries:
+            raise ValueError(
+                "The numbers of references and queries must be the same")
+        cdef const unsigned char* s1 = reference_buffer
+        cdef const unsigned char* s2 = query_buffer
+        cdef int* ref_starts = reference_offsets.data.as_ints
+        cdef int* starts = query_offsets.data.as_ints
+        cdef int i, num_matches, total = 0
+
+        cdef array results = clone(int_array, 0, False)
+        cdef array match_offsets = clone(int_array, num_queries + 1, False)
+        match_offsets.data.as_ints[0] = 0
+        for i in range(num_queries):
+            with nogil:
+                num_matches = self._locate(
+                    s1 + ref_starts[i], ref_starts[i + 1] - ref_starts[i],
+                    s2 + starts[i], starts[i + 1] - starts[i])
+            resize_smart(results, 6 * (total + num_matches))
+            memcpy(
+                results.data.as_ints + 6 * total, self.results,
+                6 * num_matches * sizeof(int))
+            total += num_matches
+            match_offsets.data.as_ints[i + 1] = total
+        return results, match_offsets
+
+    cdef int _locate(
+            self, const unsigned char* s1, int m, const unsigned char* s2,
+            int n) noexcept nogil:
+        """
+        Find the overlaps of the reference s1 of length m with the query s2
+        of length n and store them in results. Returns the number of matches.
+        """
+        cdef int* result = self.results
+        cdef int* min_matches = self._min_matches.data.as_ints
+        cdef int table_size = self._table_size
+        cdef int length, matches
+        cdef int num_matches = 0
+        cdef int num_candidates = 0
+        for length in range(self._min_overlap, min(m, n) + 1):
+            if num_candidates >= self.max_matches:
+                break
+            matches = _count_matches(
+                s1 + m - length, s2, length,
+                <int>(length * self.max_error_rate), True)
+            if matches < 0:
+                continue
+            num_candidates += 1
+            if matches == m:
+                # exact match of the whole reference
+                num_matches = 0
+            elif length < table_size and matches < min_matches[length]:
+                continue
+            result = self.results + 6 * num_matches
+            result[0] = m - length
+            result[1] = m
+            result[2] = 0
+            result[3] = length
+            result[4] = matches
+            result[5] = length - matches
+            num_matches += 1
+        return num_matches
+
+    def __dealloc__(self):
+        PyMem_Free(self.results)
@@ -2,11 +2,14 @@
 """
 from collections import Sequence
 import copy
+from itertools import islice
+import logging
 import platform
 import sys
 from atropos import __version__, AtroposError
 from atropos.adapters import AdapterCache
-from atropos.io.seqio import open_reader, sra_reader
+from atropos.io.fqindex import open_index_reader
+from atropos.io.seqio import open_chunk_reader, open_reader, sra_reader
 from atropos.util import MergingDict, Const, Summarizable, Timing
 
 class Pipeline(object):
@@ -31,6 +34,13 @@ class Pipeline(object):
         finally:
             self.finish(command_runner.summary, **kwargs)
     
+    def copy(self):
+        """Returns a copy of the pipeline that can be run concurrently with
+        this one (e.g. in another thread). Must be called before the pipeline
+        is started.
+        """
+        return copy.deepcopy(self)
+    
     def start(self, **kwargs):
         """Start the pipeline.
         """
@@ -45,6 +55,9 @@ class Pipeline(object):
         """
         batch_meta, records = batch
         context = batch_meta.copy()
+        if context['size'] is None:
+            records = list(records)
+            context['size'] = len(records)
         
         if not context['source'] in self.record_counts:
             self.record_counts[context['source']] = 0
@@ -115,6 +128,16 @@ class SingleEndPipelineMixin(object):
     def handle_record(self, context, record):
         context['bp'][0] += len(record)
         return self.handle_reads(context, record)
+    
+    def unpack_records(self, context, records):
+        """Count the bases in a batch of records.
+        
+        Returns:
+            A tuple (reads, None).
+        """
+        reads = list(records)
+        context['bp'][0] += sum(len(read) for read in reads)
+        return (reads, None)
 
 class PairedEndPipelineMixin(object):
     """Mixin for pipelines that implements `handle_record` for paired-end data.
@@ -125,6 +148,23 @@ class PairedEndPipelineMixin(object):
         bps[0] += len(read1.sequence)
         bps[1] += len(read2.sequence)
         return self.handle_reads(context, read1, read2)
+    
+    def unpack_records(self, context, records):
+        """Count the bases in a batch of records and split them into the first
+        and second reads.
+        
+        Returns:
+            A tuple of lists (reads1, reads2).
+        """
+        reads1 = []
+        reads2 = []
+        bps = context['bp']
+        for read1, read2 in records:
+            bps[0] += len(read1.sequence)
+            bps[1] += len(read2.sequence)
+            reads1.append(read1)
+            reads2.append(read2)
+        return (reads1, reads2)
 
 class Summary(MergingDict):
     """Contains summary information.
@@ -171,6 +211,10 @@ class BaseCommandRunner(object):
     Args:
         options: Command-line options.
     """
+    reads_from_index = False
+    """Whether the command's parallel worker processes can read their batches
+    directly from indexed input files."""
+    
     def __init__(self, options, summary_class=Summary):
         self.options = options
         self.summary = summary_class()
@@ -179,7 +223,6 @@ class BaseCommandRunner(object):
         self.size = options.batch_size or 1000
         self.batches = 0
         self.done = False
-        self._empty_batch = [None] * self.size
         self._progress_options = None
         
         if options.sra_reader:
@@ -202,7 +245,15 @@ class BaseCommandRunner(object):
                 file1=input1, file2=input2, file_format=options.format, 
                 qualfile=qualfile, quality_base=options.quality_base, 
                 colorspace=options.colorspace, interleaved=interleaved, 
-                input_read=options.input_read, alphabet=options.alphabet)
+                input_read=options.input_read, alphabet=options.alphabet,
+                decompression_threads=options.decompression_threads,
+                use_mmap=options.mmap)
+        
+        if hasattr(reader, 'read_batch'):
+            read_batch = reader.read_batch
+        else:
+            records = iter(reader)
+            read_batch = lambda size: list(islice(records, size))
         
         # Wrap reader in subsampler
         if options.subsample:
@@ -210,24 +261,44 @@ class BaseCommandRunner(object):
             if options.subsample_seed:
                 random.seed(options.subsample_seed)
             
-            def subsample(reader, frac):
+            def subsample(read_batch, frac, size):
                 """Generator that yields a random subsample of records.
                 
                 Args:
-                    reader: The reader from which to sample.
+                    read_batch: Function that reads a batch of records.
                     frac: The fraction of records to yield.
+                    size: The number of records to read at a time.
                 """
-                for reads in reader:
-                    if random.random() < frac:
-                        yield reads
+                while True:
+                    batch = read_batch(size)
+                    for reads in batch:
+                        if random.random() < frac:
+                            yield reads
+                    if len(batch) < size:
+                        break
             
-            reader = subsample(reader, options.subsample)
+            records = subsample(read_batch, options.subsample, self.size)
+            read_batch = lambda size: list(islice(records, size))
+        
+        self.read_batch = read_batch
+        self.read_count = 0
         
-        self.iterable = enumerate(reader, 1)
+        # If the input files are indexed, the number of reads is known, and
+        # worker processes can read batches directly from the input files
+        self.index_reader = None
+        if (
+                self.reads_from_index and options.threads and
+                not options.subsample):
+            self.index_reader = open_index_reader(reader)
         
         if options.progress:
+            max_reads = self.max_reads
+            if self.index_reader:
+                max_reads = min(
+                    max_reads or self.index_reader.num_records,
+                    self.index_reader.num_records)
             self._progress_options = (
-                options.progress, self.size, self.max_reads,
+                options.progress, self.size, max_reads,
                 options.counter_magnitude)
         
         self.init_summary()
@@ -261,33 +332,28 @@ class BaseCommandRunner(object):
         if self.done:
             raise StopIteration()
         
+        max_size = self.size
+        if self.max_reads:
+            max_size = min(max_size, self.max_reads - self.read_count)
+        
         try:
-            read_index, record = next(self.iterable)
+            batch = self.read_batch(max_size)
         except:
             self.finish()
             raise
         
-        batch = copy.copy(self._empty_batch)
-        batch[0] = record
-        batch_index = 1
-        max_size = self.size
-        if self.max_reads:
-            max_size = min(max_size, self.max_reads - read_index + 1)
+        if not batch:
+            self.finish()
+            raise StopIteration()
         
-        while batch_index < max_size:
-            try:
-                read_index, record = next(self.iterable)
-                batch[batch_index] = record
-                batch_index += 1
-            except StopIteration:
-                self.finish()
-                break
-            except:
+        # The size of a batch of compressed blocks is not known until the
+        # batch is parsed
+        batch_size = batch.size if hasattr(batch, 'size') else len(batch)
+        if batch_size is not None:
+            self.read_count += batch_size
+            if batch_size < max_size or (
+                    self.max_reads and self.read_count >= self.max_reads):
                 self.finish()
-                raise
-        
-        if self.max_reads and read_index >= self.max_reads:
-            self.finish()
         
         self.batches += 1
         
@@ -297,12 +363,57 @@ class BaseCommandRunner(object):
             # be the index of the current file/pair from which records are
             # being read.
             source=0,
-            size=batch_index)
+            size=batch_size)
         
-        if batch_index == self.size:
-            return (batch_meta, batch)
-        else:
-            return (batch_meta, batch[0:batch_index])
+        return (batch_meta, batch)
+    
+    def use_index(self):
+        """Read batches using the index files of the input files, if
+        available. Each batch only contains the locations of its records,
+        which are read (and parsed) when the batch is iterated, e.g. in a
+        worker process. Must be called before any records are read.
+        
+        Returns:
+            True if the input files are indexed.
+        """
+        if self.index_reader is None:
+            return False
+        logging.getLogger().info(
+            "Reading batches directly from the input files using index")
+        self.read_batch = self.index_reader.read_batch
+        return True
+    
+    def use_raw_batches(self, mmap_only=False):
+        """Read batches of raw FASTQ data rather than parsed records. Records
+        are parsed when a batch is iterated, e.g. in a worker process. Must be
+        called before any records are read.
+        
+        Args:
+            mmap_only: Only use raw batches if the input files are
+                memory-mapped, in which case the batches only contain the
+                location of the records.
+        
+        Returns:
+            True if the input supports raw batches.
+        """
+        if self.options.subsample:
+            if not mmap_only:
+                logging.getLogger().warning(
+                    "Raw batches cannot be used with --subsample")
+            return False
+        # BGZF blocks can be sent to the workers undecompressed, but then the
+        # number of reads in each batch is not known in the main process
+        chunk_reader = open_chunk_reader(
+            self.reader,
+            bgzf_blocks=not (self.options.max_reads or self.options.progress),
+            mmap_only=mmap_only)
+        if chunk_reader is None:
+            if not mmap_only:
+                logging.getLogger().warning(
+                    "Raw batches can only be used with FASTQ input files")
+            return False
+        self.read_batch = chunk_reader.read_batch
+        return True
     
     def init_summary(self):
         """Initialize the summary dict with general information.
@@ -182,6 +182,20 @@ class BaseCommandParser(object):
             action='store_true', default=False,
             help="Enable colorspace mode: Also trim the color that is adjacent "
                  "to the found adapter. (no)")
+        group.add_argument(
+            "--decompression-threads",
+            type=positive(int, True), default=None, metavar="THREADS",
+            help="Number of threads to use for decompressing gzip input "
+                 "files (0 = use all available cores). Uses pigz or igzip if "
+                 "available, otherwise decompresses in a background thread. "
+                 "(single-threaded system gzip)")
+        group.add_argument(
+            "--mmap",
+            action="store_true", default=False,
+            help="Memory-map uncompressed FASTQ input files and parse reads "
+                 "directly from the map. In parallel mode, worker processes "
+                 "are only sent the location of each batch in the map. "
+                 "Ignored for compressed files, pipes and stdin. (no)")
         group.add_argument(
             "--max-reads",
             type=int_or_str, default=None, metavar="N",
@@ -522,6 +536,13 @@ def between(min_val=None, max_val=None, type_=int):
 probability = between(0, 1, float)
 """A float between 0-1 (inclusive)."""
 
+def compression_level(arg):
+    """A compression level between 1-9, or 'auto'.
+    """
+    if arg == 'auto':
+        return arg
+    return between(1, 9)(arg)
+
 def configure_threads(options, parser):
     """Determine the number of threads to use from the command-line options.
     Updates the value in options, and returns the number of threads.
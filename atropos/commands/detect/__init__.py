@@ -4,7 +4,7 @@ from collections import defaultdict
 import logging
 import math
 import re
-from atropos.align import Aligner, SEMIGLOBAL
+from atropos.align import HammingAligner, SEMIGLOBAL
 from atropos.commands.base import (
     BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
 from atropos.util import (
@@ -828,13 +828,12 @@ def align(seq1, seq2, min_overlap_frac=0.9):
     Returns:
         The matching portion of the sequence.
     """
-    aligner = Aligner(
+    aligner = HammingAligner(
         seq1, 0.0,
         SEMIGLOBAL,
         False, False)
     aligner.min_overlap = math.ceil(
         min(len(seq1), len(seq2)) * min_overlap_frac)
-    aligner.indel_cost = 100000
     match = aligner.locate(seq2)
     if match:
         return seq1[match[0]:match[1]]
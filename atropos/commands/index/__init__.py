@@ -0,0 +1,30 @@
+"""Index FASTQ files.
+"""
+from atropos.commands.base import BaseCommandRunner
+from atropos.io.fqindex import FastqIndex, get_index_path
+
+class CommandRunner(BaseCommandRunner):
+    name = 'index'
+    
+    def __call__(self):
+        if self.file_format != 'FASTQ':
+            raise ValueError("Only FASTQ files can be indexed")
+        
+        paths = [self.interleaved_input or self.input1]
+        if self.paired and not self.interleaved_input:
+            paths.append(self.input2)
+        
+        index_files = []
+        record_counts = []
+        for path in paths:
+            index = FastqIndex.build(path, self.interval)
+            index.save()
+            index_files.append(get_index_path(path))
+            record_counts.append(index.num_records)
+        
+        self.summary['index'] = dict(
+            interval=self.interval,
+            index_files=tuple(index_files),
+            record_counts=tuple(record_counts))
+        self.summary.update(mode='serial', threads=1)
+        return 0
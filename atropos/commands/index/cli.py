@@ -0,0 +1,43 @@
+"""Command-line interface for the index command.
+"""
+from atropos.commands.cli import BaseCommandParser, positive, writeable_file
+from atropos.io import STDOUT
+from atropos.io.fqindex import DEFAULT_INDEX_INTERVAL
+
+class CommandParser(BaseCommandParser):
+    name = 'index'
+    usage = """
+atropos index -se input.fastq
+atropos index -pe1 in1.fq -pe2 in2.fq
+"""
+    description = """
+Index FASTQ files. The index (a sidecar file with a '.fqi' extension) stores
+the locations of every Nth record, which allows worker processes to read their
+batches of reads directly from the input files when running other commands in
+parallel mode, and the total number of reads, which is used by the progress
+bar. Input files must be uncompressed or compressed using bgzip."""
+    
+    def add_command_options(self):
+        parser = self.parser
+        parser.set_defaults(report_formats=['txt'])
+        group = self.add_group("Index")
+        group.add_argument(
+            "-n",
+            "--interval",
+            type=positive(int), default=DEFAULT_INDEX_INTERVAL, metavar="N",
+            help="Index the location of every Nth record. ({})".format(
+                DEFAULT_INDEX_INTERVAL))
+        
+        group = self.add_group("Output")
+        group.add_argument(
+            "-o",
+            "--output",
+            type=writeable_file, default=STDOUT,
+            help="File in which to write the summary. (stdout)")
+    
+    def validate_command_options(self, options):
+        if options.input2 and not options.paired:
+            self.parser.error(
+                "Quality files cannot be indexed (-sq). To index two FASTQ "
+                "files, use -pe1 and -pe2.")
+        options.report_file = options.output
@@ -0,0 +1,26 @@
+"""Report generator for the index command.
+"""
+from atropos.commands.reports import BaseReportGenerator
+from atropos.io import open_output
+
+class ReportGenerator(BaseReportGenerator):
+    def add_derived_data(self, summary):
+        # The index command does not process any reads
+        pass
+    
+    def generate_text_report(self, fmt, summary, outfile, **kwargs):
+        if fmt == 'txt':
+            with open_output(outfile, context_wrapper=True) as out:
+                generate_reports(out, summary)
+        else:
+            super().generate_from_template(fmt, summary, outfile, **kwargs)
+
+def generate_reports(outstream, summary):
+    index = summary['index']
+    for name, index_file, count in zip(
+            summary['input']['input_names'], index['index_files'],
+            index['record_counts']):
+        print(
+            "Indexed {} records in {} (every {} records): {}".format(
+                count, name, index['interval'], index_file),
+            file=outstream)
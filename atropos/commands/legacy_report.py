@@ -579,6 +579,17 @@ def print_adapter_report(adapters, outfile, paired, total_records, max_width):
             
             _print()
             
+            if "seed_filter" in adapter:
+                seed_filter = adapter["seed_filter"]
+                checked = seed_filter["aligned"] + seed_filter["skipped"]
+                _print(
+                    "Seed prefilter ({} bp seeds): {} of {} reads aligned, {} "
+                    "skipped ({:.1%})".format(
+                        seed_filter["seed_length"], seed_filter["aligned"],
+                        checked, seed_filter["skipped"],
+                        seed_filter["skipped"] / max(checked, 1)))
+                _print()
+            
             if adapter["total"] == 0:
                 continue
             
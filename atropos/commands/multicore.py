@@ -1,17 +1,34 @@
 """Classes and methods to support parallelization of operations.
 """
 import inspect
+import io
 import logging
-from multiprocessing import Process, Value, Queue
+from multiprocessing import Array, Lock, Process, Queue, Semaphore, Value
 import os
+import pickle
+import queue
 from queue import Empty, Full
+import struct
+from threading import Thread
 import time
 from atropos import AtroposError
 from atropos.util import run_interruptible
+try:
+    from multiprocessing import shared_memory
+except ImportError: # Python < 3.8
+    shared_memory = None
 
 RETRY_INTERVAL = 5
 """Max time to wait between retrying operations."""
 
+SHM_SLOT_SIZE = 1024 * 1024
+"""Size (in bytes) of each slot in a SharedMemoryQueue."""
+SHM_SLOTS_PER_THREAD = 4
+"""Default number of SharedMemoryQueue slots per thread."""
+SHM_MIN_BUFFER_SIZE = 4096
+"""Minimum size of bytes objects that are copied directly into shared memory
+rather than being pickled."""
+
 # Control values
 CONTROL_ACTIVE = 0
 """Controlled process should run normally."""
@@ -133,6 +150,178 @@ class PendingQueue(object):
         """
         return len(self.queue) == 0
 
+class _SharedMemoryPickler(pickle.Pickler):
+    """Pickler that passes large bytes objects out-of-band, so they can be
+    copied directly into shared memory.
+    """
+    def reducer_override(self, obj):
+        if type(obj) is bytes and len(obj) >= SHM_MIN_BUFFER_SIZE:
+            return (bytes, (pickle.PickleBuffer(obj),))
+        return NotImplemented
+
+class SharedMemoryQueue(object):
+    """Queue backed by a fixed pool of shared memory slots. Implements the
+    subset of the :class:`multiprocessing.Queue` interface that is used by
+    `enqueue` and `dequeue`.
+    
+    Each item is written to a free slot, and the slot is then published to
+    consumers. Large bytes objects (e.g. raw FASTQ chunks or compressed
+    results) are copied into the slot without being pickled. Items that do not
+    fit in a slot are sent via a regular Queue instead. Semaphores signal the
+    number of free and filled slots.
+    
+    Args:
+        num_slots: Number of slots; this is the maximum queue size.
+        slot_size: Size of each slot, in bytes.
+    """
+    def __init__(self, num_slots, slot_size=SHM_SLOT_SIZE):
+        if shared_memory is None:
+            raise MulticoreError(
+                "Shared memory transport requires Python 3.8 or later")
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=num_slots * slot_size)
+        self.owner = os.getpid()
+        # Number of slots available to producers/consumers
+        self.free_count = Semaphore(num_slots)
+        self.ready_count = Semaphore(0)
+        # Stack of free slots and ring of filled slots, guarded by lock
+        self.lock = Lock()
+        self.free_slots = Array('l', range(num_slots), lock=False)
+        self.num_free = Value('l', num_slots, lock=False)
+        self.ready_slots = Array('l', num_slots, lock=False)
+        self.ready_head = Value('l', 0, lock=False)
+        self.num_ready = Value('l', 0, lock=False)
+        # Queue for items that are larger than a slot
+        self.overflow = Queue()
+    
+    def put(self, item, block=True, timeout=None):
+        """Add an item to the queue.
+        
+        Raises:
+            Full if no slot becomes free within `timeout` seconds.
+        """
+        buffers = []
+        data = io.BytesIO()
+        _SharedMemoryPickler(
+            data, protocol=5, buffer_callback=buffers.append).dump(item)
+        header = data.getbuffer()
+        buffers = [buf.raw() for buf in buffers]
+        lengths = [len(header)] + [len(buf) for buf in buffers]
+        prefix = struct.pack(
+            '<{}q'.format(len(lengths) + 1), len(buffers), *lengths)
+        overflow = len(prefix) + sum(lengths) > self.slot_size
+        
+        if not self.free_count.acquire(block, timeout):
+            raise Full()
+        with self.lock:
+            self.num_free.value -= 1
+            slot = self.free_slots[self.num_free.value]
+        
+        offset = slot * self.slot_size
+        if overflow:
+            logging.getLogger().debug(
+                "Item of size %d is larger than shared memory slot",
+                sum(lengths))
+            struct.pack_into('<q', self.shm.buf, offset, -1)
+            self.overflow.put(item)
+        else:
+            for part in [prefix, header] + buffers:
+                self.shm.buf[offset:offset+len(part)] = part
+                offset += len(part)
+        
+        with self.lock:
+            idx = (
+                (self.ready_head.value + self.num_ready.value) %
+                self.num_slots)
+            self.ready_slots[idx] = slot
+            self.num_ready.value += 1
+        self.ready_count.release()
+    
+    def get(self, block=True, timeout=None):
+        """Remove and return an item from the queue.
+        
+        Raises:
+            Empty if no item becomes available within `timeout` seconds.
+        """
+        if not self.ready_count.acquire(block, timeout):
+            raise Empty()
+        with self.lock:
+            slot = self.ready_slots[self.ready_head.value]
+            self.ready_head.value = (
+                (self.ready_head.value + 1) % self.num_slots)
+            self.num_ready.value -= 1
+        
+        offset = slot * self.slot_size
+        num_buffers = struct.unpack_from('<q', self.shm.buf, offset)[0]
+        if num_buffers < 0:
+            item = self.overflow.get()
+        else:
+            lengths = struct.unpack_from(
+                '<{}q'.format(num_buffers + 1), self.shm.buf, offset + 8)
+            offset += 8 * (num_buffers + 2)
+            parts = []
+            for length in lengths:
+                parts.append(self.shm.buf[offset:offset+length])
+                offset += length
+            try:
+                item = pickle.loads(parts[0], buffers=parts[1:])
+            finally:
+                for part in parts:
+                    part.release()
+        
+        with self.lock:
+            self.free_slots[self.num_free.value] = slot
+            self.num_free.value += 1
+        self.free_count.release()
+        return item
+    
+    def full(self):
+        """Whether all slots are in use.
+        """
+        return self.num_free.value == 0
+    
+    def empty(self):
+        """Whether there are no items in the queue.
+        """
+        return self.num_ready.value == 0
+    
+    def close(self):
+        """Release the shared memory. The process that created the queue also
+        destroys the shared memory block.
+        """
+        self.shm.close()
+        if os.getpid() == self.owner:
+            self.shm.unlink()
+
+def create_queue(transport, max_size, threads, worker_backend='process'):
+    """Create a queue for sending batches between processes.
+    
+    Args:
+        transport: 'shm' to create a SharedMemoryQueue, otherwise a
+            :class:`multiprocessing.Queue` is created.
+        max_size: Maximum queue size; <= 0 == infinite.
+        threads: Number of threads.
+        worker_backend: 'thread' to create a :class:`queue.Queue` for sending
+            batches between threads of the same process, regardless of
+            `transport`.
+    """
+    if worker_backend == 'thread':
+        return queue.Queue(max_size)
+    if transport == 'shm':
+        num_slots = threads * SHM_SLOTS_PER_THREAD
+        if max_size and 0 < max_size < num_slots:
+            num_slots = max_size
+        return SharedMemoryQueue(num_slots)
+    return Queue(max_size)
+
+def close_queue(queue):
+    """Release resources held by a queue created by `create_queue`.
+    """
+    if isinstance(queue, SharedMemoryQueue):
+        queue.close()
+
 class ParallelPipelineMixin(object):
     """Mixin that implements the `start`, `finish`, and `process_batch` methods
     of :class:`Pipeline`.
@@ -152,18 +341,22 @@ class ParallelPipelineMixin(object):
             worker.name, len(self.seen_batches),
             sum(self.record_counts.values()))
 
-class WorkerProcess(Process):
-    """Parent class for worker processes that execute Pipelines.
+class Worker(object):
+    """Mixin for workers that execute Pipelines. Must precede either
+    :class:`multiprocessing.Process` or :class:`threading.Thread` in the
+    base classes.
     
     Args:
-        index: A unique ID for the process.
+        index: A unique ID for the worker.
         input_queue: Queue with batches of records to process.
         pipeline: The pipeline to execute.
         summary_queue: Queue where summary information is written.
         timeout: Time to wait upon queue full/empty.
     """
+    worker_type = None
+    
     def __init__(self, index, input_queue, pipeline, summary_queue, timeout):
-        super().__init__(name="Worker process {}".format(index))
+        super().__init__(name="Worker {} {}".format(self.worker_type, index))
         self.index = index
         self.input_queue = input_queue
         self.pipeline = pipeline
@@ -205,7 +398,7 @@ class WorkerProcess(Process):
                     if batch is None:
                         break
                     logging.getLogger().debug(
-                        "%s processing batch %d of size %d",
+                        "%s processing batch %d of size %s",
                         self.name, batch[0]['index'], batch[0]['size'])
                     self.pipeline.process_batch(batch)
             finally:
@@ -220,6 +413,38 @@ class WorkerProcess(Process):
         logging.getLogger().debug("%s sending summary", self.name)
         enqueue_summary()
 
+class WorkerProcess(Worker, Process):
+    """Worker process that executes a Pipeline.
+    """
+    worker_type = 'process'
+
+class WorkerThread(Worker, Thread):
+    """Worker thread that executes a Pipeline. Batches are processed in the
+    threads of a single process, so they are not pickled, and only one copy
+    of the input data is held in memory. The alignment and quality-trimming
+    kernels release the GIL.
+    
+    Each thread runs its own copy of the pipeline, since the pipeline
+    accumulates statistics and the aligners have internal buffers.
+    """
+    worker_type = 'thread'
+    
+    def __init__(self, index, input_queue, pipeline, summary_queue, timeout):
+        super().__init__(
+            index, input_queue, pipeline.copy(), summary_queue, timeout)
+        # Do not keep the interpreter alive if the main thread exits with an
+        # error; threads cannot be terminated.
+        self.daemon = True
+    
+    def terminate(self):
+        """Threads cannot be terminated; this is a no-op for compatibility
+        with :class:`WorkerProcess`.
+        """
+        pass
+
+WORKER_CLASSES = dict(process=WorkerProcess, thread=WorkerThread)
+"""Worker classes for each worker backend."""
+
 class ParallelPipelineRunner(object):
     """Run a pipeline in parallel.
     
@@ -228,16 +453,36 @@ class ParallelPipelineRunner(object):
         pipeline: A :class:`Pipeline`.
         threads: Number of threads to use. If None, the value will be taken
             from command_runner.
+        worker_backend: Whether workers are processes ('process') or threads
+            of the main process ('thread').
     """
-    def __init__(self, command_runner, pipeline, threads=None):
+    def __init__(
+            self, command_runner, pipeline, threads=None,
+            worker_backend='process'):
         self.command_runner = command_runner
         self.pipeline = pipeline
         self.threads = threads or command_runner.threads
+        self.worker_backend = worker_backend
+        self.worker_class = WORKER_CLASSES[worker_backend]
         self.timeout = max(command_runner.process_timeout, RETRY_INTERVAL)
+        # If the input is indexed, worker processes read their batches from
+        # the input files; otherwise, optionally send raw FASTQ data (or, for
+        # memory-mapped files, the location of the data) to the worker
+        # processes, which parse it
+        if not command_runner.use_index():
+            if command_runner.transport in ('chunks', 'shm'):
+                command_runner.use_raw_batches()
+            elif command_runner.options.mmap:
+                command_runner.use_raw_batches(mmap_only=True)
         # Queue by which batches of reads are sent to worker processes
-        self.input_queue = Queue(command_runner.read_queue_size)
+        self.input_queue = create_queue(
+            command_runner.transport, command_runner.read_queue_size,
+            self.threads, worker_backend)
         # Queue for processes to send summary information back to main process
-        self.summary_queue = Queue(self.threads)
+        if worker_backend == 'thread':
+            self.summary_queue = queue.Queue(self.threads)
+        else:
+            self.summary_queue = Queue(self.threads)
         self.worker_processes = None
         self.num_batches = None
         self.seen_summaries = None
@@ -278,13 +523,15 @@ class ParallelPipelineRunner(object):
         logging.getLogger().debug("Exiting all processes")
         for process in self.worker_processes:
             kill(process, retcode, self.timeout)
+        close_queue(self.input_queue)
     
     def __call__(self):
         # Start worker processes, reserve a thread for the reader process,
         # which we will get back after it completes
         worker_args = (
             self.input_queue, self.pipeline, self.summary_queue, self.timeout)
-        self.worker_processes = launch_workers(self.threads - 1, worker_args)
+        self.worker_processes = launch_workers(
+            self.threads - 1, worker_args, worker_class=self.worker_class)
         
         self.num_batches = enqueue_all(
             self.command_runner.iterator(), self.input_queue, self.timeout,
@@ -303,7 +550,9 @@ class ParallelPipelineRunner(object):
         # Now that the reader process is done, it essentially
         # frees up another thread to use for a worker
         self.worker_processes.extend(
-            launch_workers(1, worker_args, offset=self.threads-1))
+            launch_workers(
+                1, worker_args, offset=self.threads-1,
+                worker_class=self.worker_class))
         
         # Wait for all summaries to be available on queue
         def summary_timeout_callback():
@@ -375,7 +624,8 @@ def launch_workers(num_workers, args=(), offset=0, worker_class=WorkerProcess):
     """Launch `n` workers. Each worker is initialized with an incremental
     index starting with `offset`, followed by `args`.
     """
-    logging.getLogger().info("Starting %d worker processes", num_workers)
+    logging.getLogger().info(
+        "Starting %d %s workers", num_workers, worker_class.worker_type)
     # create workers
     workers = [worker_class(i+offset, *args) for i in range(num_workers)]
     # start workers
@@ -45,6 +45,7 @@ class PairedEndQcPipeline(PairedEndPipelineMixin, QcPipeline):
 
 class CommandRunner(BaseCommandRunner):
     name = 'qc'
+    reads_from_index = True
     
     def __call__(self):
         if self.paired:
@@ -80,7 +81,7 @@ class CommandRunner(BaseCommandRunner):
         
         logging.getLogger().debug(
             "Starting atropos qc in parallel mode with threads=%d, timeout=%d",
-            self.threads, self.timeout)
+            self.threads, self.process_timeout)
         
         if self.threads < 2:
             raise ValueError("'threads' must be >= 2")
@@ -88,7 +89,7 @@ class CommandRunner(BaseCommandRunner):
         # Start worker processes, reserve a thread for the reader process,
         # which we will get back after it completes
         pipeline_class = type(
-            'QcPipelineImpl', (ParallelPipelineMixin, pipeline_class))
+            'QcPipelineImpl', (ParallelPipelineMixin, pipeline_class), {})
         pipeline = pipeline_class(**pipeline_args)
         runner = ParallelPipelineRunner(self, pipeline)
         return runner.run()
@@ -64,6 +64,16 @@ your raw data.
             type=int_or_str, default=None, metavar="SIZE",
             help="Size of queue for batches of reads to be processed. "
                  "(THREADS * 100)")
+        group.add_argument(
+            "--transport",
+            choices=("records", "chunks", "shm"), default="records",
+            help="How batches of reads are sent to worker processes. "
+                 "records = the main process parses reads and sends the "
+                 "records; chunks = the main process only cuts the input "
+                 "into chunks of raw FASTQ data, which the workers parse "
+                 "(only supported for FASTQ input); shm = like chunks, but "
+                 "batches (and results) are passed through shared memory "
+                 "rather than pipes (requires Python 3.8+). (records)")
     
     def validate_command_options(self, options):
         options.report_file = options.output
@@ -75,5 +85,15 @@ your raw data.
                     options.read_queue_size > 0 and
                     options.read_queue_size < threads):
                 self.parser.error("Read queue size must be >= than 'threads'")
+            if options.transport != "records":
+                if options.subsample:
+                    self.parser.error(
+                        "--transport {} and --subsample are mutually "
+                        "exclusive".format(options.transport))
+                if options.transport == "shm":
+                    from atropos.commands import multicore
+                    if multicore.shared_memory is None:
+                        self.parser.error(
+                            "--transport shm requires Python 3.8 or later")
         if options.batch_size is None:
             options.batch_size = 1000
@@ -1,10 +1,13 @@
 """Implementation of the 'trim' command.
 """
 from collections import Sequence, defaultdict
+import copy
+from itertools import repeat
 import logging
 import os
 import sys
 import textwrap
+from atropos import AtroposError
 from atropos.commands.base import (
     BaseCommandRunner, Summary, Pipeline, SingleEndPipelineMixin,
     PairedEndPipelineMixin)
@@ -12,7 +15,9 @@ from atropos.commands.stats import (
     SingleEndReadStatistics, PairedEndReadStatistics)
 from atropos.adapters import AdapterParser, BACK
 from atropos.io import STDOUT
-from atropos.util import RandomMatchProbability, Const, run_interruptible
+from atropos.io.seqio import format_records
+from atropos.util import (
+    RandomMatchProbability, Const, run_interruptible, truncate_string)
 from .modifiers import (
     AdapterCutter, DoubleEncoder, InsertAdapterCutter, LengthTagModifier,
     MergeOverlapping, MinCutter, NEndTrimmer, NextseqQualityTrimmer,
@@ -38,6 +43,10 @@ class TrimPipeline(Pipeline):
         self.record_handler = record_handler
         self.result_handler = result_handler
     
+    def copy(self):
+        return type(self)(
+            copy.deepcopy(self.record_handler), self.result_handler.copy())
+    
     def start(self, worker=None):
         self.result_handler.start(worker)
     
@@ -45,9 +54,37 @@ class TrimPipeline(Pipeline):
         context['results'] = defaultdict(lambda: [])
     
     def handle_records(self, context, records):
-        super().handle_records(context, records)
+        reads1, reads2 = self.unpack_records(context, records)
+        try:
+            self.record_handler.handle_records(context, reads1, reads2)
+        except Exception as err:
+            idx = self._find_failing_record(context, reads1, reads2)
+            if idx is None:
+                raise AtroposError(
+                    "An error occurred in batch {}".format(
+                    context['index'])) from err
+            raise AtroposError(
+                "An error occurred at record {} ({!r}) of batch {}".format(
+                idx, truncate_string(reads1[idx].name),
+                context['index'])) from err
         self.result_handler.write_result(context['index'], context['results'])
     
+    def _find_failing_record(self, context, reads1, reads2):
+        """Locate the record that caused a batch to fail by handling the
+        records one at a time. Only called once the batch has failed, so the
+        side-effects (e.g. on the statistics) do not matter.
+        
+        Returns:
+            The index of the first record that fails, or None.
+        """
+        for idx, read1 in enumerate(reads1):
+            try:
+                self.record_handler.handle_record(
+                    context, read1, reads2[idx] if reads2 else None)
+            except Exception:
+                return idx
+        return None
+    
     def handle_reads(self, context, read1, read2=None):
         return self.record_handler.handle_record(context, read1, read2)
     
@@ -72,6 +109,20 @@ class RecordHandler(object):
         self.formatters.format(context['results'], dest, *reads)
         return (dest, reads)
     
+    def handle_records(self, context, reads1, reads2=None):
+        """Handle a batch of reads/pairs. The modifiers are applied to the
+        whole batch, and then each read/pair is filtered and formatted.
+        
+        Returns:
+            A list of (dest, reads) tuples.
+        """
+        results = []
+        for reads in zip(*self.modifiers.modify_batch(reads1, reads2)):
+            dest = self.filters.filter(*reads)
+            self.formatters.format(context['results'], dest, *reads)
+            results.append((dest, reads))
+        return results
+    
     def summarize(self):
         """Returns a summary dict.
         """
@@ -118,6 +169,24 @@ class StatsRecordHandlerWrapper(object):
                 self.post[dest], context['source'], *reads, **self.post_kwargs)
         return (dest, reads)
     
+    def handle_records(self, context, reads1, reads2=None):
+        """Handle a batch of reads/pairs.
+        """
+        if self.pre is not None:
+            for read1, read2 in zip(reads1, reads2 or repeat(None)):
+                self.collect(
+                    self.pre, context['source'], read1, read2,
+                    **self.pre_kwargs)
+        results = self.record_handler.handle_records(context, reads1, reads2)
+        if self.post is not None:
+            for dest, reads in results:
+                if dest not in self.post:
+                    self.post[dest] = {}
+                self.collect(
+                    self.post[dest], context['source'], *reads,
+                    **self.post_kwargs)
+        return results
+    
     def collect(self, stats, source, read1, read2=None, **kwargs):
         """Collect stats on a pair of reads.
         
@@ -149,6 +218,12 @@ class StatsRecordHandlerWrapper(object):
 class ResultHandler(object):
     """Base class for result handlers.
     """
+    def copy(self):
+        """Returns a copy of the result handler for use by another worker
+        thread. Must be called before the handler is started.
+        """
+        return copy.deepcopy(self)
+    
     def start(self, worker=None):
         """Start the result handler.
         """
@@ -177,6 +252,11 @@ class ResultHandlerWrapper(ResultHandler):
     def __init__(self, handler):
         self.handler = handler
     
+    def copy(self):
+        handler_copy = copy.copy(self)
+        handler_copy.handler = self.handler.copy()
+        return handler_copy
+    
     def start(self, worker):
         self.handler.start(worker)
     
@@ -190,22 +270,28 @@ class WorkerResultHandler(ResultHandlerWrapper):
     """Wraps a ResultHandler and compresses results prior to writing.
     """
     def write_result(self, batch_num, result):
-        """Given a dict mapping files to lists of strings, join the strings and
-        compress them (if necessary) and then return the property formatted
-        result dict.
+        """Given a dict mapping files to lists of formatted records, format
+        the records into bytes and compress them (if necessary) and then
+        return the property formatted result dict.
         """
         self.handler.write_result(
             batch_num, dict(
                 self.prepare_file(*item)
                 for item in result.items()))
     
-    def prepare_file(self, path, strings):
+    def prepare_file(self, path, records):
         """Prepare data for writing.
         
+        Args:
+            path: The output file.
+            records: A list of formatted records (see
+                :func:`atropos.io.seqio.format_records`).
+        
         Returns:
-            Tuple (path, data).
+            Tuple (path, data), where data is a memoryview of the bytes to
+            write.
         """
-        return (path, "".join(strings))
+        return (path, memoryview(format_records(records)))
 
 class WriterResultHandler(ResultHandler):
     """ResultHandler that writes results to disk.
@@ -277,6 +363,7 @@ class TrimSummary(Summary):
 
 class CommandRunner(BaseCommandRunner):
     name = 'trim'
+    reads_from_index = True
     
     def __init__(self, options):
         super().__init__(options, TrimSummary)
@@ -552,7 +639,9 @@ class CommandRunner(BaseCommandRunner):
             mixin_class = PairedEndPipelineMixin
         else:
             mixin_class = SingleEndPipelineMixin
-        writers = Writers(force_create)
+        writers = Writers(
+            force_create, options.compression_threads, options.output_format,
+            options.bgzf_index, options.compression_level, options.zstd_level)
         record_handler = RecordHandler(modifiers, filters, formatters)
         if options.stats:
             record_handler = StatsRecordHandlerWrapper(
@@ -599,14 +688,16 @@ class CommandRunner(BaseCommandRunner):
         """Parallel implementation of run_atropos. Works as follows:
         
         1. Main thread creates N worker processes (where N is the number of
-        threads to be allocated) and (optionally) one writer process.
+        threads to be allocated) and (optionally) one writer process. With
+        the 'thread' worker backend, the workers are threads of the main
+        process instead, each with its own copy of the pipeline.
         2. Main thread loads batches of reads (or read pairs) from input file(s)
         and adds them to a queue (the input queue).
         3. Worker processes take batches from the input queue, process them as
         Atropos normally does, and either add the results to the result queue
         (if using a writer process) or write the results to disk. Each result is
-        a dict mapping output file names to strings, where each string is a
-        concatenation of reads (with appropriate line endings) to be written.
+        a dict mapping output file names to bytes, which are a concatenation of
+        reads (with appropriate line endings) to be written.
         A parameter also controls whether data compression is done by the
         workers or the writer.
         4. If using a writer process, it takes results from the result queue and
@@ -658,9 +749,8 @@ class CommandRunner(BaseCommandRunner):
         # We do all the multicore imports and class definitions within the
         # run_parallel method to avoid extra work if only running in serial
         # mode.
-        from multiprocessing import Queue
         from atropos.commands.multicore import (
-            ParallelPipelineMixin, RETRY_INTERVAL)
+            ParallelPipelineMixin, RETRY_INTERVAL, close_queue, create_queue)
         from atropos.commands.trim.multicore import (
             Done, Killed, ParallelTrimPipelineRunner, QueueResultHandler,
             CompressingWorkerResultHandler, OrderPreservingWriterResultHandler,
@@ -689,18 +779,21 @@ class CommandRunner(BaseCommandRunner):
         if compression == "writer" and threads > 2:
             threads -= 1
         
-        # Queue by which results are sent from the worker processes to the
-        # writer process
-        result_queue = Queue(self.result_queue_size)
+        result_queue = None
         writer_manager = None
         
         if self.writer_process:
+            # Queue by which results are sent from the worker processes to the
+            # writer process
+            result_queue = create_queue(
+                self.transport, self.result_queue_size, threads)
             if compression == "writer":
                 worker_result_handler = WorkerResultHandler(
                     QueueResultHandler(result_queue))
             else:
                 worker_result_handler = CompressingWorkerResultHandler(
-                    QueueResultHandler(result_queue))
+                    QueueResultHandler(result_queue), self.output_format,
+                    self.compression_level, self.zstd_level)
             writer_manager = WriterManager(
                 writers, compression, self.preserve_order, result_queue,
                 timeout)
@@ -713,5 +806,8 @@ class CommandRunner(BaseCommandRunner):
             (ParallelPipelineMixin, mixin_class, TrimPipeline), {})
         pipeline = pipeline_class(record_handler, worker_result_handler)
         runner = ParallelTrimPipelineRunner(
-            self, pipeline, threads, writer_manager)
-        return runner.run()
+            self, pipeline, threads, writer_manager, self.worker_backend)
+        try:
+            return runner.run()
+        finally:
+            close_queue(result_queue)
@@ -3,13 +3,33 @@
 """
 Quality trimming.
 """
+from cpython.mem cimport PyMem_Free, PyMem_Malloc
+from cpython.unicode cimport (
+    Py_UCS1, PyUnicode_1BYTE_DATA, PyUnicode_1BYTE_KIND, PyUnicode_KIND,
+    PyUnicode_DecodeLatin1)
+from libc.string cimport memcpy, memset
+from atropos.util import BASE_COMPLEMENTS
 
-def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int base=33):
+cdef inline const Py_UCS1* _char_data(str text) except NULL:
+    """
+    Return a pointer to the characters of a string that only contains
+    characters < 256 (which CPython stores with one byte per character), so
+    that they can be read without holding the GIL.
+    """
+    if PyUnicode_KIND(text) != PyUnicode_1BYTE_KIND:
+        raise ValueError("String contains non-ASCII characters")
+    return PyUnicode_1BYTE_DATA(text)
+
+def quality_trim_index(
+        str qualities, int cutoff_front, int cutoff_back, int base=33,
+        int offset=0, length=None):
     """
     Find the positions at which to trim low-quality ends from a nucleotide sequence.
     Return tuple (start, stop) that indicates the good-quality segment.
 
-    Qualities are assumed to be ASCII-encoded as chr(qual + base).
+    Qualities are assumed to be ASCII-encoded as chr(qual + base). If `length`
+    is given, only qualities[offset:offset+length] are considered (without
+    creating the substring), and the positions are relative to `offset`.
 
     The algorithm is the same as the one used by BWA within the function
     'bwa_trim_read':
@@ -19,34 +39,39 @@ def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int bas
     """
     cdef int s
     cdef int max_qual
-    cdef int stop = len(qualities)
-    cdef int start = 0
+    cdef int end = len(qualities) if length is None else offset + length
+    cdef int stop = end
+    cdef int start = offset
     cdef int i
+    cdef const Py_UCS1* quals = _char_data(qualities)
+    if offset < 0 or end > len(qualities):
+        raise IndexError("string index out of range")
+
+    with nogil:
+        # find trim position for 5' end
+        s = 0
+        max_qual = 0
+        for i in range(offset, end):
+            s += cutoff_front - (quals[i] - base)
+            if s < 0:
+                break
+            if s > max_qual:
+                max_qual = s
+                start = i + 1
 
-    # find trim position for 5' end
-    s = 0
-    max_qual = 0
-    for i in range(len(qualities)):
-        s += cutoff_front - (ord(qualities[i]) - base)
-        if s < 0:
-            break
-        if s > max_qual:
-            max_qual = s
-            start = i + 1
-
-    # same for 3' end
-    max_qual = 0
-    s = 0
-    for i in reversed(range(len(qualities))):
-        s += cutoff_back - (ord(qualities[i]) - base)
-        if s < 0:
-            break
-        if s > max_qual:
-            max_qual = s
-            stop = i
+        # same for 3' end
+        max_qual = 0
+        s = 0
+        for i in reversed(range(offset, end)):
+            s += cutoff_back - (quals[i] - base)
+            if s < 0:
+                break
+            if s > max_qual:
+                max_qual = s
+                stop = i
     if start >= stop:
-        start, stop = 0, 0
-    return (start, stop)
+        return (0, 0)
+    return (start - offset, stop - offset)
 
 
 def nextseq_trim_index(sequence, int cutoff, int base=33):
@@ -60,25 +85,382 @@ def nextseq_trim_index(sequence, int cutoff, int base=33):
     This routine works as the one above, but counts qualities belonging to 'G'
     bases as being equal to cutoff - 1.
     """
-    bases = sequence.sequence
-    qualities = sequence.qualities
+    cdef str bases, qualities
+    cdef const Py_UCS1* bases_data
+    cdef const Py_UCS1* quals
     cdef:
         int s = 0
         int max_qual = 0
-        int max_i = len(qualities)
+        int offset, end, max_i
         int i, q
+    
+    bases, qualities, offset, end = sequence.view()
+    bases_data = _char_data(bases)
+    quals = _char_data(qualities)
+    if offset < 0 or end > len(bases) or end > len(qualities):
+        raise IndexError("string index out of range")
+    max_i = end
+    with nogil:
+        for i in reversed(range(offset, end)):
+            q = quals[i] - base
+            if bases_data[i] == b'G':
+                q = cutoff - 1
+            s += cutoff - q
+            if s < 0:
+                break
+            if s > max_qual:
+                max_qual = s
+                max_i = i
+    return max_i - offset
+
+
+cdef enum:
+    STEP_CUT = 0
+    STEP_NEXTSEQ = 1
+    STEP_QUALITY = 2
+    STEP_N_END = 3
+
+cdef struct _Step:
+    int kind
+    int arg1
+    int arg2
+    int arg3
+
+cdef dict STEP_KINDS = dict(
+    cut=STEP_CUT, nextseq=STEP_NEXTSEQ, quality=STEP_QUALITY,
+    n_end=STEP_N_END)
+
+
+cdef class EndTrimmer:
+    """
+    Apply a chain of end-trimming steps to a read, computing the final
+    coordinates of the trimmed read without creating the intermediate reads.
+    Each step is one of:
+
+    - ('cut', front, back): remove `front` bases from the start and -`back`
+      bases (`back` <= 0) from the end (as UnconditionalCutter).
+    - ('nextseq', cutoff, base): NextSeq quality trimming of the 3' end (as
+      NextseqQualityTrimmer).
+    - ('quality', cutoff_front, cutoff_back, base): quality trimming (as
+      QualityTrimmer).
+    - ('n_end',): remove Ns from both ends (as NEndTrimmer).
+
+    The number of bases trimmed by each step is accumulated as the
+    modifiers would count them (see `pop_trimmed`).
+    """
+    cdef _Step* steps
+    cdef int num_steps
+    cdef long long* trimmed
+    cdef bint needs_qualities
+    cdef readonly tuple step_args
+
+    def __cinit__(self, steps):
+        cdef int i
+        self.step_args = tuple(tuple(step) for step in steps)
+        self.num_steps = len(self.step_args)
+        self.steps = <_Step*>PyMem_Malloc(max(self.num_steps, 1) * sizeof(_Step))
+        self.trimmed = <long long*>PyMem_Malloc(
+            max(self.num_steps, 1) * sizeof(long long))
+        if not (self.steps and self.trimmed):
+            raise MemoryError()
+        self.needs_qualities = False
+        for i, step in enumerate(self.step_args):
+            args = tuple(step[1:]) + (0,) * (4 - len(step))
+            self.steps[i].kind = STEP_KINDS[step[0]]
+            self.steps[i].arg1 = args[0]
+            self.steps[i].arg2 = args[1]
+            self.steps[i].arg3 = args[2]
+            self.trimmed[i] = 0
+            if self.steps[i].kind in (STEP_NEXTSEQ, STEP_QUALITY):
+                self.needs_qualities = True
 
-    s = 0
-    max_qual = 0
-    max_i = len(qualities)
-    for i in reversed(xrange(max_i)):
-        q = ord(qualities[i]) - base
-        if bases[i] == 'G':
-            q = cutoff - 1
-        s += cutoff - q
-        if s < 0:
-            break
-        if s > max_qual:
-            max_qual = s
-            max_i = i
-    return max_i
+    def __reduce__(self):
+        return (EndTrimmer, (self.step_args,))
+
+    def pop_trimmed(self):
+        """
+        Returns a list with the number of bases trimmed by each step since
+        the last call, and resets the counts.
+        """
+        cdef int i
+        result = []
+        for i in range(self.num_steps):
+            result.append(self.trimmed[i])
+            self.trimmed[i] = 0
+        return result
+
+    def trim(self, str sequence, str qualities, Py_ssize_t start, Py_ssize_t end):
+        """
+        Trim the read that is the [start:end] slice of sequence and qualities
+        (qualities may be None if no step uses them).
+
+        Returns:
+            Tuple (start, end, front, back): the slice of the trimmed read,
+            and the numbers of bases to add to the front and back clipped
+            counts of the read.
+        """
+        cdef const Py_UCS1* bases = _char_data(sequence)
+        cdef const Py_UCS1* quals = NULL
+        cdef long long front = 0, back = 0
+        if qualities is not None:
+            quals = _char_data(qualities)
+            if len(qualities) < end:
+                raise IndexError("string index out of range")
+        elif self.needs_qualities:
+            raise TypeError("Quality trimming requires qualities")
+        if start < 0 or end > len(sequence) or start > end:
+            raise IndexError("string index out of range")
+        with nogil:
+            self._trim(bases, quals, &start, &end, &front, &back)
+        return (start, end, front, back)
+
+    cdef void _trim(
+            self, const Py_UCS1* bases, const Py_UCS1* quals, Py_ssize_t* start_ptr,
+            Py_ssize_t* end_ptr, long long* front, long long* back) noexcept nogil:
+        cdef Py_ssize_t start = start_ptr[0], end = end_ptr[0]
+        cdef Py_ssize_t length, i, new_start, new_stop, begin, stop
+        cdef int s, max_qual, q, cutoff, base
+        cdef _Step* step
+        cdef int k
+        for k in range(self.num_steps):
+            step = &self.steps[k]
+            length = end - start
+            if length == 0:
+                continue
+            if step.kind == STEP_CUT:
+                # read[front:back] for back < 0, otherwise read[front:]
+                if step.arg1 == 0 and step.arg2 == 0:
+                    continue
+                new_start = min(<Py_ssize_t>step.arg1, length)
+                new_stop = length
+                if step.arg2 < 0:
+                    new_stop = max(length + step.arg2, 0)
+                end = start + max(new_start, new_stop)
+                start += new_start
+                front[0] += step.arg1
+                back[0] -= step.arg2
+                self.trimmed[k] += step.arg1 - step.arg2
+                continue
+            elif step.kind == STEP_NEXTSEQ:
+                cutoff = step.arg1
+                base = step.arg2
+                s = 0
+                max_qual = 0
+                stop = end
+                for i in range(end - 1, start - 1, -1):
+                    q = quals[i] - base
+                    if bases[i] == b'G':
+                        q = cutoff - 1
+                    s += cutoff - q
+                    if s < 0:
+                        break
+                    if s > max_qual:
+                        max_qual = s
+                        stop = i
+                begin = start
+            elif step.kind == STEP_QUALITY:
+                base = step.arg3
+                begin = start
+                stop = end
+                s = 0
+                max_qual = 0
+                for i in range(start, end):
+                    s += step.arg1 - (quals[i] - base)
+                    if s < 0:
+                        break
+                    if s > max_qual:
+                        max_qual = s
+                        begin = i + 1
+                s = 0
+                max_qual = 0
+                for i in range(end - 1, start - 1, -1):
+                    s += step.arg2 - (quals[i] - base)
+                    if s < 0:
+                        break
+                    if s > max_qual:
+                        max_qual = s
+                        stop = i
+                if begin >= stop:
+                    begin = stop = start
+            else:
+                # STEP_N_END
+                begin = start
+                while begin < end and bases[begin] == b'N':
+                    begin += 1
+                stop = end
+                while stop > start and bases[stop - 1] == b'N':
+                    stop -= 1
+            # read.subseq(begin, stop), relative to start
+            front[0] += begin - start
+            back[0] += end - stop
+            self.trimmed[k] += (begin - start) + (end - stop)
+            end = max(begin, stop)
+            start = begin
+        start_ptr[0] = start
+        end_ptr[0] = end
+
+    def __dealloc__(self):
+        PyMem_Free(self.steps)
+        PyMem_Free(self.trimmed)
+
+
+cdef Py_UCS1 COMPLEMENTS[256]
+memset(COMPLEMENTS, 0, sizeof(COMPLEMENTS))
+for _base, _comp in BASE_COMPLEMENTS.items():
+    COMPLEMENTS[ord(_base)] = ord(_comp)
+
+cdef inline Py_UCS1 _complement(Py_UCS1 base) except 0:
+    cdef Py_UCS1 comp = COMPLEMENTS[base]
+    if comp == 0:
+        raise KeyError(chr(base))
+    return comp
+
+cdef enum:
+    MISMATCH_N = 0
+    MISMATCH_CONSERVATIVE = 1
+    MISMATCH_LIBERAL = 2
+
+def correct_mismatches(
+        str seq1, str qual1, str seq2, str qual2, Py_ssize_t r1_start,
+        Py_ssize_t r1_end, Py_ssize_t r2_start, Py_ssize_t r2_end,
+        mismatch_action, int min_qual_difference=1):
+    """
+    Correct mismatches between the overlapping portions of read1 and the
+    reverse-complement of read2. Positions r1_start..r1_end of read1 are
+    compared with positions r2_end-1..r2_start of read2.
+
+    - If mismatch_action is 'N', mismatched bases are replaced with N in both
+      reads.
+    - Otherwise, an N is replaced with the base from the other read, and if
+      the qualities differ by at least min_qual_difference, the base with the
+      lower quality is replaced by the base with the higher quality.
+    - If mismatch_action is 'liberal', mismatches with (nearly) equal
+      qualities are corrected in favor of the read that has the higher mean
+      quality in the overlap, if it is higher by more than 1.
+
+    Qualities (which are copied along with the bases) may be None for both
+    reads.
+
+    Returns:
+        Tuple (seq1, qual1, seq2, qual2, changed1, changed2): the corrected
+        sequences and qualities, and the number of bases that were changed in
+        each read. The original strings are returned for a read that was not
+        changed.
+    """
+    cdef bint has_quals = qual1 is not None and qual2 is not None
+    cdef int action = MISMATCH_CONSERVATIVE
+    cdef Py_ssize_t len1 = len(seq1), len2 = len(seq2)
+    cdef Py_ssize_t size, i, j, k, num_equal = 0
+    cdef Py_ssize_t r1_changed = 0, r2_changed = 0
+    cdef Py_UCS1 base1, base2
+    cdef Py_UCS1* s1
+    cdef Py_UCS1* q1
+    cdef Py_UCS1* s2
+    cdef Py_UCS1* q2
+    cdef Py_ssize_t* equal
+    cdef long sum1 = 0, sum2 = 0
+    cdef double diff
+    
+    if mismatch_action == 'N':
+        action = MISMATCH_N
+    elif mismatch_action == 'liberal':
+        action = MISMATCH_LIBERAL
+    if not (
+            0 <= r1_start <= r1_end <= len1 and 0 <= r2_start <= r2_end <= len2
+            and (not has_quals or (len(qual1) == len1 and len(qual2) == len2))):
+        raise IndexError("string index out of range")
+    size = min(r1_end - r1_start, r2_end - r2_start)
+    
+    # Working copies of the strings: seq1, qual1, seq2, qual2
+    s1 = <Py_UCS1*>PyMem_Malloc(2 * (len1 + len2) + 1)
+    equal = <Py_ssize_t*>PyMem_Malloc(max(size, 1) * sizeof(Py_ssize_t))
+    if not (s1 and equal):
+        PyMem_Free(s1)
+        PyMem_Free(equal)
+        raise MemoryError()
+    q1 = s1 + len1
+    s2 = q1 + len1
+    q2 = s2 + len2
+    
+    try:
+        memcpy(s1, _char_data(seq1), len1)
+        memcpy(s2, _char_data(seq2), len2)
+        if has_quals:
+            memcpy(q1, _char_data(qual1), len1)
+            memcpy(q2, _char_data(qual2), len2)
+        
+        for k in range(size):
+            i = r1_start + k
+            j = r2_end - 1 - k
+            base1 = s1[i]
+            base2 = _complement(s2[j])
+            if base1 == base2:
+                continue
+            if action == MISMATCH_N:
+                s1[i] = b'N'
+                s2[j] = b'N'
+                r1_changed += 1
+                r2_changed += 1
+            elif base1 == b'N':
+                s1[i] = base2
+                if has_quals:
+                    q1[i] = q2[j]
+                r1_changed += 1
+            elif base2 == b'N':
+                s2[j] = _complement(base1)
+                if has_quals:
+                    q2[j] = q1[i]
+                r2_changed += 1
+            elif has_quals:
+                if q1[i] - q2[j] >= min_qual_difference:
+                    s2[j] = _complement(base1)
+                    q2[j] = q1[i]
+                    r2_changed += 1
+                elif q1[i] - q2[j] <= -min_qual_difference:
+                    s1[i] = base2
+                    q1[i] = q2[j]
+                    r1_changed += 1
+                elif action == MISMATCH_LIBERAL:
+                    equal[num_equal] = k
+                    num_equal += 1
+        
+        if num_equal:
+            for i in range(r1_start, r1_end):
+                sum1 += q1[i]
+            for j in range(r2_start, r2_end):
+                sum2 += q2[j]
+            # Only make the corrections if one read is significantly better
+            # than the other.
+            diff = (
+                (<double>sum1) / (r1_end - r1_start) -
+                (<double>sum2) / (r2_end - r2_start))
+            if diff > 1:
+                # read1 is better than read2
+                for k in range(num_equal):
+                    i = r1_start + equal[k]
+                    j = r2_end - 1 - equal[k]
+                    s2[j] = _complement(s1[i])
+                    q2[j] = q1[i]
+                    r2_changed += 1
+            elif diff < -1:
+                # read2 is better than read1
+                for k in range(num_equal):
+                    i = r1_start + equal[k]
+                    j = r2_end - 1 - equal[k]
+                    s1[i] = _complement(s2[j])
+                    q1[i] = q2[j]
+                    r1_changed += 1
+        
+        if r1_changed:
+            seq1 = PyUnicode_DecodeLatin1(<char*>s1, len1, NULL)
+            if has_quals:
+                qual1 = PyUnicode_DecodeLatin1(<char*>q1, len1, NULL)
+        if r2_changed:
+            seq2 = PyUnicode_DecodeLatin1(<char*>s2, len2, NULL)
+            if has_quals:
+                qual2 = PyUnicode_DecodeLatin1(<char*>q2, len2, NULL)
+    finally:
+        PyMem_Free(s1)
+        PyMem_Free(equal)
+    
+    return (seq1, qual1, seq2, qual2, r1_changed, r2_changed)
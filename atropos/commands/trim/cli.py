@@ -3,9 +3,9 @@
 import logging
 import sys
 from atropos.commands.cli import (
-    BaseCommandParser, configure_threads, parse_stat_args, readable_file,
-    readwriteable_file, writeable_file, positive, probability, CharList,
-    Delimited, int_or_str)
+    BaseCommandParser, compression_level, configure_threads, parse_stat_args,
+    readable_file, readwriteable_file, writeable_file, positive, between,
+    probability, CharList, Delimited, int_or_str)
 from atropos.io import STDOUT, STDERR
 
 class CommandParser(BaseCommandParser):
@@ -27,9 +27,9 @@ sequences can be given (use further -a options), but only the best-matching
 adapter will be removed.
 
 Input may also be in FASTA, SAM, or BAM format. Compressed input and output is
-supported and auto-detected from the file name (.gz, .xz, .bz2). Use the file
-name '-' for standard input/output. Without the -o option, output is sent to
-standard output.
+supported and auto-detected from the file name (.gz, .xz, .bz2, .zst). Use the
+file name '-' for standard input/output. Without the -o option, output is sent
+to standard output.
 """
     
     def add_command_options(self):
@@ -383,6 +383,44 @@ standard output.
             type=writeable_file, default=None, metavar="FILE",
             help="Write reads that have been merged to this file. (merged "
                  "reads are discarded)")
+        group.add_argument(
+            "--compression-threads",
+            type=positive(int, True), default=None, metavar="THREADS",
+            help="Number of threads to use for compressing gzip or "
+                 "Zstandard output files (0 = use all available cores). For "
+                 "gzip, uses pigz if available, otherwise compresses blocks of "
+                 "output using a pool of zlib threads; for Zstandard, sets "
+                 "the number of zstd worker threads. Only applies when output "
+                 "is compressed by the main process or the writer process "
+                 "(see --compression). (single-threaded compression)")
+        group.add_argument(
+            "--compression-level",
+            type=compression_level, default=None, metavar="LEVEL",
+            help="Compression level (1-9) for compressed output files, "
+                 "wherever they are compressed (see --compression). 'auto' = "
+                 "adjust the level while trimming, based on the measured "
+                 "time spent compressing relative to the time spent "
+                 "trimming, so that compression does not become the "
+                 "bottleneck. With writer compression, 'auto' only applies "
+                 "to gzip output. (6 for gzip, otherwise the default of the "
+                 "format)")
+        group.add_argument(
+            "--zstd-level",
+            type=between(1, 22), default=None, metavar="LEVEL",
+            help="Compression level for Zstandard (.zst) output files (1-22). "
+                 "(--compression-level, or 3)")
+        group.add_argument(
+            "--output-format",
+            choices=("gzip", "bgzf"), default="gzip",
+            help="Format of gzip-compressed (.gz) output files. bgzf = "
+                 "blocked gzip (as written by bgzip), which is a valid gzip "
+                 "file that can also be decompressed in parallel and "
+                 "accessed randomly by tools that support it. (gzip)")
+        group.add_argument(
+            "--bgzf-index",
+            action="store_true", default=False,
+            help="Write a bgzip-compatible index (.gzi) for each BGZF output "
+                 "file. Requires '--output-format bgzf'. (no)")
         group.add_argument(
             "--report-file",
             type=writeable_file, default="-", metavar="FILE",
@@ -577,6 +615,26 @@ standard output.
             type=int_or_str, default=None, metavar="SIZE",
             help="Size of queue for batches of results to be written. "
                  "(THREADS * 100)")
+        group.add_argument(
+            "--transport",
+            choices=("records", "chunks", "shm"), default="records",
+            help="How batches of reads are sent to worker processes. "
+                 "records = the main process parses reads and sends the "
+                 "records; chunks = the main process only cuts the input "
+                 "into chunks of raw FASTQ data, which the workers parse "
+                 "(only supported for FASTQ input); shm = like chunks, but "
+                 "batches (and results) are passed through shared memory "
+                 "rather than pipes (requires Python 3.8+). (records)")
+        group.add_argument(
+            "--worker-backend",
+            choices=("process", "thread"), default="process",
+            help="Whether reads are processed by worker processes or by "
+                 "worker threads of the main process. Threads do not need "
+                 "to pickle batches or duplicate memory, and the alignment "
+                 "and quality-trimming code releases the GIL; threads scale "
+                 "best on a free-threaded Python build. With threads, "
+                 "'--transport shm' only affects how results are sent to "
+                 "the writer process. (process)")
         group.add_argument(
             "--compression",
             choices=("worker", "writer"), default=None,
@@ -758,6 +816,9 @@ standard output.
                 "Only one of the --discard-trimmed, --discard-untrimmed "
                 "and --untrimmed-output options can be used at the same time.")
         
+        if options.bgzf_index and options.output_format != 'bgzf':
+            parser.error("--bgzf-index requires '--output-format bgzf'")
+        
         if options.output is not None and '{name}' in options.output:
             if options.discard_trimmed:
                 parser.error(
@@ -889,6 +950,17 @@ standard output.
                     "Combination of batch size %d and total queue size %d "
                     "may lead to excessive memory usage",
                     options.batch_size, max_queue_size)
+            
+            if options.transport != "records":
+                if options.subsample:
+                    parser.error(
+                        "--transport {} and --subsample are mutually "
+                        "exclusive".format(options.transport))
+                if options.transport == "shm":
+                    from atropos.commands import multicore
+                    if multicore.shared_memory is None:
+                        parser.error(
+                            "--transport shm requires Python 3.8 or later")
         
         if options.batch_size is None:
             options.batch_size = 1000
@@ -6,13 +6,17 @@ need to be stored, and as a class with a __call__ method if there are parameters
 """
 from collections import OrderedDict
 import copy
+from itertools import zip_longest
 import re
 from atropos import AtroposError
+from atropos.adapters import AdapterIndex
 from atropos.align import (
     Aligner, InsertAligner, SEMIGLOBAL, START_WITHIN_SEQ1, STOP_WITHIN_SEQ2)
 from atropos.util import (
-    BASE_COMPLEMENTS, reverse_complement, mean, quals2ints)
-from .qualtrim import quality_trim_index, nextseq_trim_index
+    reverse_complement, mean, quals2ints)
+from atropos.io.seqio import Sequence
+from .qualtrim import (
+    EndTrimmer, correct_mismatches, quality_trim_index, nextseq_trim_index)
 
 # Base classes
 
@@ -31,6 +35,17 @@ class Modifier(object):
         """
         return getattr(self, 'display_str', self.name)
     
+    def process_batch(self, reads):
+        """Modify a batch of reads.
+        
+        Args:
+            reads: A list of reads.
+        
+        Returns:
+            A list of the modified reads.
+        """
+        return [self(read) for read in reads]
+    
     def summarize(self):
         """Returns a summary of the modifier's activity as a dict.
         """
@@ -41,6 +56,18 @@ class ReadPairModifier(Modifier):
     """
     def __call__(self, read1, read2):
         raise NotImplementedError()
+    
+    def process_batch(self, reads1, reads2):
+        """Modify a batch of read pairs.
+        
+        Args:
+            reads1, reads2: Lists of the first and second reads of the pairs.
+        
+        Returns:
+            A tuple of lists of the modified reads (reads1, reads2).
+        """
+        pairs = [self(read1, read2) for read1, read2 in zip(reads1, reads2)]
+        return ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
 
 class Trimmer(Modifier):
     """Base class of modifiers that trim bases from reads.
@@ -103,6 +130,13 @@ class AdapterCutter(Modifier):
         self.times = times
         self.action = action
         self.with_adapters = 0
+        # With multiple adapters, only those that share a seed with a read
+        # (or may overlap its ends) are aligned to it.
+        self.index = None
+        if len(self.adapters) > 1 and any(
+                getattr(adapter, 'seed_filter', None) is not None
+                for adapter in self.adapters):
+            self.index = AdapterIndex(self.adapters)
 
     def _best_match(self, read):
         """Find the best matching adapter in the given read.
@@ -111,7 +145,11 @@ class AdapterCutter(Modifier):
             Either a Match instance or None if there are no matches.
         """
         best = None
-        for adapter in self.adapters:
+        if self.index is None:
+            adapters = self.adapters
+        else:
+            adapters = self.index.candidates(read.sequence.upper())
+        for adapter in adapters:
             match = adapter.match_to(read)
             if match is None:
                 continue
@@ -120,6 +158,33 @@ class AdapterCutter(Modifier):
             if best is None or match.matches > best.matches:
                 best = match
         return best
+    
+    def _best_matches(self, reads):
+        """Find the best matching adapter in each of a list of reads. Each
+        adapter is matched to all of the reads (that it may match) at once.
+        
+        Returns:
+            A list with a Match instance or None for each read.
+        """
+        if self.index is None:
+            read_indexes = [range(len(reads))] * len(self.adapters)
+        else:
+            read_indexes = [[] for _ in self.adapters]
+            for i, read in enumerate(reads):
+                for j in self.index.candidate_indexes(read.sequence.upper()):
+                    read_indexes[j].append(i)
+        best = [None] * len(reads)
+        # Adapters are matched in the same order as in _best_match, so ties
+        # are resolved the same way.
+        for adapter, indexes in zip(self.adapters, read_indexes):
+            if not indexes:
+                continue
+            matches = adapter.match_to_batch([reads[i] for i in indexes])
+            for i, match in zip(indexes, matches):
+                if match is not None and (
+                        best[i] is None or match.matches > best[i].matches):
+                    best[i] = match
+        return best
 
     def __call__(self, read):
         """Determine the adapter that best matches the given read.
@@ -148,6 +213,44 @@ class AdapterCutter(Modifier):
             matches.append(match)
             trimmed_read = match.adapter.trimmed(match)
         
+        return self._apply_matches(read, trimmed_read, matches)
+    
+    def process_batch(self, reads):
+        """Cut adapters from a batch of reads. Each round of adapter search
+        matches each adapter to all of the reads at once.
+        """
+        trimmed_reads = list(reads)
+        read_matches = [[] for _ in reads]
+        pending = [i for i, read in enumerate(reads) if len(read) > 0]
+        for _ in range(self.times):
+            if not pending:
+                break
+            best = self._best_matches([trimmed_reads[i] for i in pending])
+            pending_next = []
+            for i, match in zip(pending, best):
+                if match is None:
+                    continue
+                read_matches[i].append(match)
+                trimmed_reads[i] = match.adapter.trimmed(match)
+                pending_next.append(i)
+            pending = pending_next
+        return [
+            self._apply_matches(read, trimmed_read, matches)
+            if len(read) > 0 else read
+            for read, trimmed_read, matches in zip(
+                reads, trimmed_reads, read_matches)]
+    
+    def _apply_matches(self, read, trimmed_read, matches):
+        """Apply the action to a read from which adapters have been trimmed.
+        
+        Args:
+            read: The original read.
+            trimmed_read: The read with the adapter matches trimmed.
+            matches: The adapter matches.
+        
+        Returns:
+            The modified read.
+        """
         if not matches:
             trimmed_read.match = None
             trimmed_read.match_info = None
@@ -212,7 +315,6 @@ class ErrorCorrectorMixin(object):
     def __init__(self, mismatch_action=None, min_qual_difference=1):
         self.mismatch_action = mismatch_action
         self.r1r2_min_qual_difference = min_qual_difference
-        self.r2r1_min_qual_difference = -1 * min_qual_difference
         self.corrected_pairs = 0
         self.corrected_bp = [0, 0]
     
@@ -232,122 +334,43 @@ class ErrorCorrectorMixin(object):
         if read1.corrected > 0 or read2.corrected > 0:
             return
         
-        # read2 reverse-complement is the reference, read1 is the query
-        r1_seq = list(read1.sequence)
-        r2_seq = list(read2.sequence)
-        len1 = len(r1_seq)
-        len2 = len(r2_seq)
-
         has_quals = read1.qualities and read2.qualities
-        if has_quals:
-            r1_qual = list(read1.qualities)
-            r2_qual = list(read2.qualities)
-        elif self.mismatch_action in ('liberal', 'conservative'):
+        if not has_quals and self.mismatch_action in (
+                'liberal', 'conservative'):
             raise ValueError(
                 "Cannot perform quality-based error correction on reads "
                 "lacking quality information")
-
-        if truncate_seqs:
-            if len1 > len2:
-                r1_seq = r1_seq[:len2]
-                if has_quals:
-                    r1_qual = r1_qual[:len2]
-            elif len2 > len1:
-                r2_seq = r2_seq[:len1]
-                if has_quals:
-                    r2_qual = r2_qual[:len1]
-                len2 = len1
-
-        r1_start = insert_match[2]
-        r1_end = insert_match[3]
-        r1_changed = 0
-        r2_start = len2 - insert_match[1]
-        r2_end = len2 - insert_match[0]
-        r2_changed = 0
-        quals_equal = []
-        
-        for i, j in zip(
-                range(r1_start, r1_end), range(r2_end - 1, r2_start - 1, -1)):
-            base1 = r1_seq[i]
-            base2 = BASE_COMPLEMENTS[r2_seq[j]]
-            if base1 == base2:
-                continue
-            if self.mismatch_action == 'N':
-                r1_seq[i] = 'N'
-                r2_seq[j] = 'N'
-                r1_changed += 1
-                r2_changed += 1
-            elif base1 == 'N':
-                r1_seq[i] = base2
-                if has_quals:
-                    r1_qual[i] = r2_qual[j]
-                r1_changed += 1
-            elif base2 == 'N':
-                r2_seq[j] = BASE_COMPLEMENTS[base1]
-                if has_quals:
-                    r2_qual[j] = r1_qual[i]
-                r2_changed += 1
-            elif has_quals:
-                diff = ord(r1_qual[i]) - ord(r2_qual[j])
-                if diff >= self.r1r2_min_qual_difference:
-                    r2_seq[j] = BASE_COMPLEMENTS[base1]
-                    r2_qual[j] = r1_qual[i]
-                    r2_changed += 1
-                elif diff <= self.r2r1_min_qual_difference:
-                    r1_seq[i] = base2
-                    r1_qual[i] = r2_qual[j]
-                    r1_changed += 1
-                elif self.mismatch_action == 'liberal':
-                    quals_equal.append((i, j, base1, base2))
         
-        if quals_equal:
-            mean_qual1 = mean([ord(b) for b in r1_qual[r1_start:r1_end]])
-            mean_qual2 = mean([ord(b) for b in r2_qual[r2_start:r2_end]])
-            # Only make the corrections if one read is significantly better
-            # than the other.
-            # TODO: this method of determining whether one read is better
-            # than the other is crude - come up with something better.
-            diff = mean_qual1 - mean_qual2
-            if diff > 1:
-                # read1 is better than read2
-                for i, j, base1, base2 in quals_equal:
-                    r2_seq[j] = BASE_COMPLEMENTS[base1]
-                    r2_qual[j] = r1_qual[i]
-                    r2_changed += 1
-            elif diff < -1:
-                # read2 is better than read1
-                for i, j, base1, base2 in quals_equal:
-                    r1_seq[i] = base2
-                    r1_qual[i] = r2_qual[j]
-                    r1_changed += 1
+        # read2 reverse-complement is the reference, read1 is the query
+        len2 = len(read2)
+        if truncate_seqs:
+            len2 = min(len(read1), len2)
+        seq1, qual1, seq2, qual2, r1_changed, r2_changed = correct_mismatches(
+            read1.sequence, read1.qualities if has_quals else None,
+            read2.sequence, read2.qualities if has_quals else None,
+            insert_match[2], insert_match[3], len2 - insert_match[1],
+            len2 - insert_match[0], self.mismatch_action,
+            self.r1r2_min_qual_difference)
         
         if r1_changed or r2_changed:
             self.corrected_pairs += 1
-
-            def update_read(read, seq, qual, seq_len, read_num, num_changed):
+            
+            def update_read(read, seq, qual, read_num, num_changed):
                 self.corrected_bp[read_num] += num_changed
                 read.corrected = num_changed
-                new_seq = ''.join(seq)
-                partial = truncate_seqs and len(read.sequence) > seq_len
-                if partial:
-                    read.sequence = new_seq + read.sequence[seq_len:]
-                else:
-                    read.sequence = new_seq
+                read.sequence = seq
                 if has_quals:
-                    new_qual = ''.join(qual)
-                    if partial:
-                        read.qualities = new_qual + read.qualities[seq_len:]
-                    else:
-                        read.qualities = new_qual
-
+                    read.qualities = qual
+            
             if r1_changed:
-                update_read(
-                    read1, r1_seq, r1_qual if has_quals else None, len1, 0,
-                    r1_changed)
+                if truncate_seqs and len(seq1) > len2:
+                    # A corrected read1 is truncated to the length of read2
+                    seq1 = seq1[:len2]
+                    if has_quals:
+                        qual1 = qual1[:len2]
+                update_read(read1, seq1, qual1, 0, r1_changed)
             if r2_changed:
-                update_read(
-                    read2, r2_seq, r2_qual if has_quals else None, len2, 1,
-                    r2_changed)
+                update_read(read2, seq2, qual2, 1, r2_changed)
     
     def summarize(self):
         """Returns a summary dict.
@@ -393,25 +416,64 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
             return (read1, read2)
         
         match = self.aligner.match_insert(read1.sequence, read2.sequence)
+        if match:
+            adapter_match1, adapter_match2 = match[1:]
+        else:
+            adapter_match1 = self.adapter1.match_to(read1)
+            adapter_match2 = self.adapter2.match_to(read2)
+        return self._cut(read1, read2, match, adapter_match1, adapter_match2)
+    
+    def process_batch(self, reads1, reads2):
+        """Cut adapters from a batch of read pairs. The inserts of all pairs
+        are matched at once, and then each adapter is matched to all of the
+        reads without an insert match at once.
+        """
+        reads1 = list(reads1)
+        reads2 = list(reads2)
+        pairs = [
+            i for i, (read1, read2) in enumerate(zip(reads1, reads2))
+            if len(read1) >= self.min_insert_len and
+            len(read2) >= self.min_insert_len]
+        insert_matches = self.aligner.match_insert_batch(
+            [reads1[i].sequence for i in pairs],
+            [reads2[i].sequence for i in pairs])
+        unmatched = [
+            i for i, match in zip(pairs, insert_matches) if not match]
+        adapter_matches1 = dict(zip(unmatched, self.adapter1.match_to_batch(
+            [reads1[i] for i in unmatched])))
+        adapter_matches2 = dict(zip(unmatched, self.adapter2.match_to_batch(
+            [reads2[i] for i in unmatched])))
+        for i, match in zip(pairs, insert_matches):
+            if match:
+                adapter_match1, adapter_match2 = match[1:]
+            else:
+                adapter_match1 = adapter_matches1[i]
+                adapter_match2 = adapter_matches2[i]
+            reads1[i], reads2[i] = self._cut(
+                reads1[i], reads2[i], match, adapter_match1, adapter_match2)
+        return (reads1, reads2)
+    
+    def _cut(self, read1, read2, match, adapter_match1, adapter_match2):
+        """Correct errors and trim adapters given the insert match (if any)
+        and the adapter matches.
+        """
+        read_lengths = [len(r) for r in (read1, read2)]
         read1.insert_overlap = read2.insert_overlap = (match is not None)
         insert_match = None
         correct_errors = False
         
         if match:
-            insert_match, adapter_match1, adapter_match2 = match
+            insert_match = match[0]
             correct_errors = self.mismatch_action and insert_match[5] > 0
-        else:
-            adapter_match1 = self.adapter1.match_to(read1)
-            adapter_match2 = self.adapter2.match_to(read2)
+        elif (
+                self.mismatch_action and adapter_match1 and
+                adapter_match2 and
+                adapter_match1.rstart == adapter_match2.rstart):
             # If the adapter matches are complementary, perform error correction
-            if (
-                    self.mismatch_action and adapter_match1 and
-                    adapter_match2 and
-                    adapter_match1.rstart == adapter_match2.rstart):
-                insert_match = (
-                    read_lengths[1] - adapter_match1.rstart,
-                    read_lengths[1], 0, adapter_match1.rstart)
-                correct_errors = True
+            insert_match = (
+                read_lengths[1] - adapter_match1.rstart,
+                read_lengths[1], 0, adapter_match1.rstart)
+            correct_errors = True
         
         # If exactly one of the two alignments failed and symmetric is True,
         # duplicate the good alignment
@@ -758,8 +820,10 @@ class QualityTrimmer(Trimmer):
     def __call__(self, read):
         if len(read) == 0:
             return read
+        _, qualities, offset, end = read.view()
         start, stop = quality_trim_index(
-            read.qualities, self.cutoff_front, self.cutoff_back, self.base)
+            qualities, self.cutoff_front, self.cutoff_back, self.base,
+            offset, end - offset)
         return self.subseq(read, start, stop)
 
 class NEndTrimmer(Trimmer):
@@ -769,19 +833,118 @@ class NEndTrimmer(Trimmer):
     
     def __init__(self):
         super(NEndTrimmer, self).__init__()
-        self.start_trim = re.compile(r'^N+')
+        self.start_trim = re.compile(r'N+')
         self.end_trim = re.compile(r'N+$')
     
     def __call__(self, read):
         if len(read) == 0:
             return read
-        sequence = read.sequence
-        start_cut = self.start_trim.match(sequence)
-        end_cut = self.end_trim.search(sequence)
-        start_cut = start_cut.end() if start_cut else 0
-        end_cut = end_cut.start() if end_cut else len(read)
+        sequence, _, offset, end = read.view()
+        start_cut = self.start_trim.match(sequence, offset, end)
+        end_cut = self.end_trim.search(sequence, offset, end)
+        start_cut = start_cut.end() - offset if start_cut else 0
+        end_cut = end_cut.start() - offset if end_cut else len(read)
         return self.subseq(read, start_cut, end_cut)
 
+def _end_trimmer_step(trimmer):
+    """Returns the :class:`EndTrimmer` step that is equivalent to a trimmer.
+    """
+    trimmer_type = type(trimmer)
+    if trimmer_type is UnconditionalCutter:
+        return ('cut', trimmer.front_length, trimmer.back_length)
+    elif trimmer_type is NextseqQualityTrimmer:
+        return ('nextseq', trimmer.cutoff, trimmer.base)
+    elif trimmer_type is QualityTrimmer:
+        return (
+            'quality', trimmer.cutoff_front, trimmer.cutoff_back, trimmer.base)
+    elif trimmer_type is NEndTrimmer:
+        return ('n_end',)
+    else:
+        raise ValueError("Cannot fuse modifier {}".format(trimmer.name))
+
+class FusedTrimmer(Modifier):
+    """Applies a chain of end-trimming modifiers (UnconditionalCutter,
+    NextseqQualityTrimmer, QualityTrimmer and NEndTrimmer) to a read in a
+    single pass, without creating the intermediate reads. The clipped counts
+    of the reads and the trimmed counts of the modifiers are updated as if the
+    modifiers had been applied one at a time.
+    
+    Args:
+        trimmers: The modifiers, in the order in which they are applied.
+    """
+    def __init__(self, trimmers):
+        self.trimmers = list(trimmers)
+        self.end_trimmer = EndTrimmer(
+            [_end_trimmer_step(trimmer) for trimmer in self.trimmers])
+    
+    @property
+    def name(self):
+        return "+".join(trimmer.name for trimmer in self.trimmers)
+    
+    @staticmethod
+    def can_fuse(modifier):
+        """Whether a modifier can be part of a FusedTrimmer.
+        """
+        return EndTrimmer is not None and type(modifier) in (
+            UnconditionalCutter, NextseqQualityTrimmer, QualityTrimmer,
+            NEndTrimmer)
+    
+    def __call__(self, read):
+        read = self._trim(read)
+        self._update_trimmed_bases()
+        return read
+    
+    def process_batch(self, reads):
+        reads = [self._trim(read) for read in reads]
+        self._update_trimmed_bases()
+        return reads
+    
+    def _trim(self, read):
+        if type(read) is not Sequence:
+            for trimmer in self.trimmers:
+                read = trimmer(read)
+            return read
+        sequence, qualities, start, end = read.view()
+        new_start, new_end, front, back = self.end_trimmer.trim(
+            sequence, qualities, start, end)
+        if not (front or back):
+            return read
+        new_read = read[new_start - start:new_end - start]
+        offset = 2 if read.match else 0
+        new_read.clipped[offset] += front
+        new_read.clipped[offset+1] += back
+        return new_read
+    
+    def _update_trimmed_bases(self):
+        for trimmer, trimmed in zip(
+                self.trimmers, self.end_trimmer.pop_trimmed()):
+            trimmer.trimmed_bases += trimmed
+
+def fuse_trimmers(modifiers):
+    """Replace each run of two or more consecutive modifiers that can be fused
+    with a :class:`FusedTrimmer`.
+    
+    Args:
+        modifiers: A list of modifiers that are applied to a read, in order.
+    
+    Returns:
+        A new list of modifiers.
+    """
+    fused = []
+    run = []
+    for mod in modifiers + [None]:
+        if mod is not None and FusedTrimmer.can_fuse(mod):
+            run.append(mod)
+            continue
+        if len(run) > 1:
+            fused.append(FusedTrimmer(run))
+        else:
+            fused.extend(run)
+        run = []
+        if mod is not None:
+            fused.append(mod)
+    return fused
+
 class RRBSTrimmer(MinCutter):
     """Sequences that are adapter-trimmed are further trimmed 2 bp on the 3'
     end to remove potential methylation-biased bases from the end-repair
@@ -935,6 +1098,7 @@ class Modifiers(object):
     def __init__(self):
         self.modifiers = []
         self.modifier_indexes = {}
+        self._plan = None
     
     def add_modifier(self, mod_class, read=1|2, **kwargs):
         """Add a modifier of the specified type for one or both reads.
@@ -960,6 +1124,7 @@ class Modifiers(object):
     def _add_modifiers(self, mod_class, mods):
         idx = len(self.modifiers)
         self.modifiers.append(mods)
+        self._plan = None
         if mod_class in self.modifier_indexes:
             self.modifier_indexes[mod_class].append(idx)
         else:
@@ -996,6 +1161,30 @@ class Modifiers(object):
                 read_mods.append(mod[read-1])
         return read_mods
     
+    def _get_plan(self):
+        """Returns the modifiers in the order in which they are applied, with
+        runs of end-trimming modifiers replaced by FusedTrimmers (see
+        `fuse_trimmers`). The per-read modifiers between two ReadPairModifiers
+        are independent for read 1 and read 2, so they are fused separately.
+        """
+        if self._plan is None:
+            plan = []
+            chains = ([], [])
+            for mods in self.modifiers + [None]:
+                if mods is None or isinstance(mods, ReadPairModifier):
+                    plan.extend(
+                        list(pair) for pair in zip_longest(
+                            *(fuse_trimmers(chain) for chain in chains)))
+                    chains = ([], [])
+                    if mods is not None:
+                        plan.append(mods)
+                else:
+                    for chain, mod in zip(chains, mods):
+                        if mod is not None:
+                            chain.append(mod)
+            self._plan = plan
+        return self._plan
+    
     def get_adapters(self):
         """Returns the adapters from the AdapterCutter or InsertAdapterCutter
         modifier, if any.
@@ -1027,6 +1216,18 @@ class Modifiers(object):
         """
         raise NotImplementedError()
     
+    def modify_batch(self, reads1, reads2=None):
+        """Apply registered modifiers to a batch of reads/pairs. Each modifier
+        is applied to the whole batch before the next one.
+        
+        Args:
+            reads1, reads2: Lists of the reads to modify.
+        
+        Returns:
+            A tuple of lists of modified reads (reads1, reads2).
+        """
+        raise NotImplementedError()
+    
     def summarize(self):
         """Returns a summary dict.
         """
@@ -1045,10 +1246,15 @@ class SingleEndModifiers(Modifiers):
             return self.add_modifier(mod_class, **read1_args)
     
     def modify(self, read1, read2=None):
-        for mods in self.modifiers:
+        for mods in self._get_plan():
             read1 = mods[0](read1)
         return (read1,)
     
+    def modify_batch(self, reads1, reads2=None):
+        for mods in self._get_plan():
+            reads1 = mods[0].process_batch(reads1)
+        return (reads1,)
+    
     def summarize(self):
         summary = {}
         for mods in self.modifiers:
@@ -1093,7 +1299,7 @@ class PairedEndModifiers(Modifiers):
             return self._add_modifiers(mod_class, mods)
     
     def modify(self, read1, read2=None):
-        for mods in self.modifiers:
+        for mods in self._get_plan():
             if isinstance(mods, ReadPairModifier):
                 read1, read2 = mods(read1, read2)
             else:
@@ -1103,6 +1309,17 @@ class PairedEndModifiers(Modifiers):
                     read2 = mods[1](read2)
         return (read1, read2)
     
+    def modify_batch(self, reads1, reads2=None):
+        for mods in self._get_plan():
+            if isinstance(mods, ReadPairModifier):
+                reads1, reads2 = mods.process_batch(reads1, reads2)
+            else:
+                if mods[0] is not None:
+                    reads1 = mods[0].process_batch(reads1)
+                if mods[1] is not None:
+                    reads2 = mods[1].process_batch(reads2)
+        return (reads1, reads2)
+    
     def summarize(self):
         summary = {}
         for mods in self.modifiers:
@@ -1,3 +1,4 @@
+import gzip
 import logging
 from multiprocessing import Process
 import os
@@ -6,7 +7,9 @@ from atropos.commands.trim import (
 from atropos.commands.multicore import (
     Control, PendingQueue, ParallelPipelineRunner, MulticoreError, 
     wait_on_process, enqueue, dequeue, kill, CONTROL_ACTIVE, CONTROL_ERROR)
-from atropos.io.compression import get_compressor
+from atropos.io.compression import (
+    DEFAULT_COMPRESSION_LEVEL, AutoCompressionLevel, compress_bgzf,
+    compress_data, get_compressor)
 
 class Done(MulticoreError):
     """Raised when process exits normally.
@@ -22,8 +25,9 @@ class ParallelTrimPipelineRunner(ParallelPipelineRunner):
     """ParallelPipelineRunner for a TrimPipeline.
     """
     def __init__(
-            self, command_runner, pipeline, threads, writer_manager=None):
-        super().__init__(command_runner, pipeline, threads)
+            self, command_runner, pipeline, threads, writer_manager=None,
+            worker_backend='process'):
+        super().__init__(command_runner, pipeline, threads, worker_backend)
         self.writer_manager = writer_manager
     
     def ensure_alive(self):
@@ -54,12 +58,20 @@ class QueueResultHandler(ResultHandler):
         self.message = None
         self.timeout = None
     
+    def copy(self):
+        # The queue is shared by all workers
+        return QueueResultHandler(self.queue)
+    
     def start(self, worker):
         self.message = "{} waiting to queue result {{}}".format(
             worker.name)
         self.timeout = worker.timeout
     
     def write_result(self, batch_num, result):
+        # Memoryviews cannot be pickled, so the underlying buffers are queued
+        result = dict(
+            (path, data.obj if isinstance(data, memoryview) else data)
+            for path, data in result.items())
         enqueue(
             self.queue,
             (batch_num, result),
@@ -68,22 +80,55 @@ class QueueResultHandler(ResultHandler):
 
 class CompressingWorkerResultHandler(WorkerResultHandler):
     """Wraps a ResultHandler and compresses results prior to writing.
+    
+    Args:
+        handler: The wrapped ResultHandler.
+        output_format: Format of gzip output files: 'gzip' or 'bgzf'. In
+            'bgzf' format, each batch is compressed into BGZF blocks, and the
+            EOF marker is written by the :class:`Writers`.
+        compression_level: The compression level, None to use the default
+            level of each format, or 'auto' to adjust the level so that
+            compressing a batch does not take longer than trimming it (see
+            :class:`atropos.io.compression.AutoCompressionLevel`).
+        zstd_level: Compression level for Zstandard output files. Defaults to
+            `compression_level`.
     """
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(
+            self, handler, output_format='gzip', compression_level=None,
+            zstd_level=None):
+        super().__init__(handler)
+        self.output_format = output_format
+        self.compression_level = compression_level
+        self.zstd_level = zstd_level
         self.file_compressors = None
+        self.auto_level = None
     
     def start(self, worker):
         super().start(worker)
         self.file_compressors = {}
+        if self.compression_level == 'auto':
+            self.auto_level = AutoCompressionLevel()
     
-    def prepare_file(self, path, strings):
+    def write_result(self, batch_num, result):
+        if self.auto_level is None:
+            super().write_result(batch_num, result)
+            return
+        # The time between batches is the time spent trimming.
+        self.auto_level.start()
+        result = dict(self.prepare_file(*item) for item in result.items())
+        self.auto_level.stop()
+        self.handler.write_result(batch_num, result)
+    
+    def prepare_file(self, path, records):
+        path, data = super().prepare_file(path, records)
         compressor = self.get_compressor(path)
         if compressor:
-            return ((path, 'wb'), compressor.compress(b''.join(
-                s.encode() for s in strings)))
-        else:
-            return ((path, 'wt'), "".join(strings))
+            level = self.get_compression_level(path)
+            if compressor is gzip and self.output_format == 'bgzf':
+                data = compress_bgzf(data, level or DEFAULT_COMPRESSION_LEVEL)
+            else:
+                data = compress_data(data, compressor, level)
+        return ((path, 'wb'), data)
     
     def get_compressor(self, filename):
         """Returns the file compressor based on the file extension.
@@ -91,6 +136,15 @@ class CompressingWorkerResultHandler(WorkerResultHandler):
         if filename not in self.file_compressors:
             self.file_compressors[filename] = get_compressor(filename)
         return self.file_compressors[filename]
+    
+    def get_compression_level(self, filename):
+        """Returns the current compression level for a file.
+        """
+        if filename.endswith('.zst') and self.zstd_level is not None:
+            return self.zstd_level
+        if self.auto_level is not None:
+            return self.auto_level.level
+        return self.compression_level
 
 class OrderPreservingWriterResultHandler(WriterResultHandler):
     """Writer thread that is less time/memory efficient, but is
@@ -139,7 +193,7 @@ class ResultProcess(Process):
     """Thread that accepts results from the worker threads and process
     them using a ResultHandler. Each batch is expected to be
     (batch_num, path, records), where path is the destination file and
-    records is a string. Not guaranteed to preserve the original order
+    records is a bytes-like object. Not guaranteed to preserve the original order
     of sequence records.
     
     Args:
@@ -3,19 +3,28 @@
 """
 # Import cythonized functions, defaulting to pure python implementations.
 try:
-    from ._qualtrim import quality_trim_index, nextseq_trim_index
+    from ._qualtrim import (
+        EndTrimmer, correct_mismatches, quality_trim_index,
+        nextseq_trim_index)
 
 except:
     import logging
-    from atropos.util import qual2int
+    from atropos.util import BASE_COMPLEMENTS, mean, qual2int
     
     logging.getLogger().debug("Import failed for cythonized qualtrim functions")
     
-    def quality_trim_index(qualities, cutoff_front, cutoff_back, base=33):
+    # Modifiers are applied one at a time without the fused kernel.
+    EndTrimmer = None
+    
+    def quality_trim_index(
+            qualities, cutoff_front, cutoff_back, base=33, offset=0,
+            length=None):
         """Find the position at which to trim a low-quality end from a
         nucleotide sequence.
         
-        Qualities are assumed to be ASCII-encoded as chr(qual + base).
+        Qualities are assumed to be ASCII-encoded as chr(qual + base). If
+        `length` is given, only qualities[offset:offset+length] are
+        considered, and the positions are relative to `offset`.
         
         The algorithm is the same as the one used by BWA within the function
         'bwa_trim_read':
@@ -23,13 +32,14 @@ except:
         - Compute partial sums from all indices to the end of the sequence.
         - Trim sequence at the index at which the sum is minimal.
         """
-        start = 0
-        stop = max_i = len(qualities)
+        end = len(qualities) if length is None else offset + length
+        start = offset
+        stop = end
         
         # find trim position for 5' end
         score = 0
         max_qual = 0
-        for idx in range(max_i):
+        for idx in range(offset, end):
             qual = qual2int(qualities[idx], base)
             score += cutoff_front - (qual - base)
             if score < 0:
@@ -41,7 +51,7 @@ except:
         # same for 3' end
         max_qual = 0
         score = 0
-        for idx in reversed(range(max_i)):
+        for idx in reversed(range(offset, end)):
             qual = qual2int(qualities[idx], base)
             score += cutoff_back - (qual - base)
             if score < 0:
@@ -51,9 +61,9 @@ except:
                 stop = idx
         
         if start >= stop:
-            start, stop = 0, 0
+            return (0, 0)
         
-        return (start, stop)
+        return (start - offset, stop - offset)
     
     def nextseq_trim_index(sequence, cutoff, base=33):
         """Variant of the above quality trimming routine that works on NextSeq
@@ -65,12 +75,11 @@ except:
         This routine works as the one above, but counts qualities belonging to
         'G' bases as being equal to cutoff - 1.
         """
-        bases = sequence.sequence
-        qualities = sequence.qualities
+        bases, qualities, offset, end = sequence.view()
         score = 0
         max_qual = 0
-        max_i = len(qualities)
-        for idx in reversed(range(max_i)):
+        max_i = end
+        for idx in reversed(range(offset, end)):
             qual = qual2int(qualities[idx], base)
             if bases[idx] == 'G':
                 qual = cutoff - 1
@@ -80,4 +89,89 @@ except:
             if score > max_qual:
                 max_qual = score
                 max_i = idx
-        return max_i
+        return max_i - offset
+    
+    def correct_mismatches(
+            seq1, qual1, seq2, qual2, r1_start, r1_end, r2_start, r2_end,
+            mismatch_action, min_qual_difference=1):
+        """Correct mismatches between the overlapping portions of read1 and
+        the reverse-complement of read2. Positions r1_start..r1_end of read1
+        are compared with positions r2_end-1..r2_start of read2.
+        
+        Returns:
+            Tuple (seq1, qual1, seq2, qual2, changed1, changed2): the
+            corrected sequences and qualities, and the number of bases that
+            were changed in each read.
+        """
+        has_quals = qual1 is not None and qual2 is not None
+        r1_seq = list(seq1)
+        r2_seq = list(seq2)
+        if has_quals:
+            r1_qual = list(qual1)
+            r2_qual = list(qual2)
+        r1_changed = 0
+        r2_changed = 0
+        quals_equal = []
+        
+        for i, j in zip(
+                range(r1_start, r1_end), range(r2_end - 1, r2_start - 1, -1)):
+            base1 = r1_seq[i]
+            base2 = BASE_COMPLEMENTS[r2_seq[j]]
+            if base1 == base2:
+                continue
+            if mismatch_action == 'N':
+                r1_seq[i] = 'N'
+                r2_seq[j] = 'N'
+                r1_changed += 1
+                r2_changed += 1
+            elif base1 == 'N':
+                r1_seq[i] = base2
+                if has_quals:
+                    r1_qual[i] = r2_qual[j]
+                r1_changed += 1
+            elif base2 == 'N':
+                r2_seq[j] = BASE_COMPLEMENTS[base1]
+                if has_quals:
+                    r2_qual[j] = r1_qual[i]
+                r2_changed += 1
+            elif has_quals:
+                diff = ord(r1_qual[i]) - ord(r2_qual[j])
+                if diff >= min_qual_difference:
+                    r2_seq[j] = BASE_COMPLEMENTS[base1]
+                    r2_qual[j] = r1_qual[i]
+                    r2_changed += 1
+                elif diff <= -min_qual_difference:
+                    r1_seq[i] = base2
+                    r1_qual[i] = r2_qual[j]
+                    r1_changed += 1
+                elif mismatch_action == 'liberal':
+                    quals_equal.append((i, j, base1, base2))
+        
+        if quals_equal:
+            mean_qual1 = mean([ord(b) for b in r1_qual[r1_start:r1_end]])
+            mean_qual2 = mean([ord(b) for b in r2_qual[r2_start:r2_end]])
+            # Only make the corrections if one read is significantly better
+            # than the other.
+            diff = mean_qual1 - mean_qual2
+            if diff > 1:
+                # read1 is better than read2
+                for i, j, base1, base2 in quals_equal:
+                    r2_seq[j] = BASE_COMPLEMENTS[base1]
+                    r2_qual[j] = r1_qual[i]
+                    r2_changed += 1
+            elif diff < -1:
+                # read2 is better than read1
+                for i, j, base1, base2 in quals_equal:
+                    r1_seq[i] = base2
+                    r1_qual[i] = r2_qual[j]
+                    r1_changed += 1
+        
+        if r1_changed:
+            seq1 = ''.join(r1_seq)
+            if has_quals:
+                qual1 = ''.join(r1_qual)
+        if r2_changed:
+            seq2 = ''.join(r2_seq)
+            if has_quals:
+                qual2 = ''.join(r2_qual)
+        return (seq1, qual1, seq2, qual2, r1_changed, r2_changed)
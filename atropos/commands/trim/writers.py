@@ -1,8 +1,11 @@
 """Classes for formatting and writing trimmed reads to output.
 """
+import gzip
 import sys
 from atropos.io import STDOUT, xopen, open_output
-from atropos.io.compression import splitext_compressed
+from atropos.io.compression import (
+    DEFAULT_COMPRESSION_LEVEL, AutoCompressionLevel, BgzfWriter,
+    get_compressor, splitext_compressed)
 from atropos.io.seqio import create_seq_formatter
 from .filters import NoFilter
 
@@ -11,10 +14,30 @@ class Writers(object):
     
     Args:
         force_create: Whether empty output files should be created.
+        compression_threads: Number of threads to use for compressing gzip
+            output files (see :func:`atropos.io.xopen`).
+        output_format: Format of gzip output files: 'gzip' or 'bgzf'.
+        bgzf_index: Whether to write an index for each BGZF output file.
+        compression_level: The compression level, None to use the default
+            level of each format, or 'auto' to adjust the level of gzip
+            output so that compression does not become the bottleneck (see
+            :class:`atropos.io.compression.AutoCompressionLevel`; other
+            formats use their default level).
+        zstd_level: Compression level for Zstandard output files. Defaults to
+            `compression_level`.
     """
-    def __init__(self, force_create=[]):
+    def __init__(
+            self, force_create=[], compression_threads=None,
+            output_format='gzip', bgzf_index=False, compression_level=None,
+            zstd_level=None):
         self.writers = {}
         self.force_create = force_create
+        self.compression_threads = compression_threads
+        self.output_format = output_format
+        self.bgzf_index = bgzf_index
+        self.compression_level = compression_level
+        self.zstd_level = zstd_level
+        self.auto_level = None
         self.suffix = None
     
     def get_writer(self, file_desc, compressed=False):
@@ -40,20 +63,45 @@ class Writers(object):
             else:
                 real_path = path
             # TODO: test whether O_NONBLOCK allows non-blocking write to NFS
-            if compressed:
+            if (
+                    self.output_format == 'bgzf' and
+                    get_compressor(real_path) is gzip):
+                self.writers[path] = BgzfWriter(
+                    real_path, threads=self.compression_threads,
+                    level=(
+                        self.get_compression_level(real_path) or
+                        DEFAULT_COMPRESSION_LEVEL),
+                    index=self.bgzf_index, compressed=compressed)
+            elif compressed:
                 self.writers[path] = open_output(real_path, mode)
             else:
-                self.writers[path] = xopen(real_path, "w")
+                self.writers[path] = xopen(
+                    real_path, "wb",
+                    compression_threads=self.compression_threads,
+                    compression_level=self.get_compression_level(real_path))
         
         return self.writers[path]
     
+    def get_compression_level(self, path):
+        """Returns the compression level for an output file: an int, None (the
+        default level), or an :class:`AutoCompressionLevel` that is shared by
+        all output files.
+        """
+        if path.endswith('.zst') and self.zstd_level is not None:
+            return self.zstd_level
+        if self.compression_level == 'auto':
+            if self.auto_level is None:
+                self.auto_level = AutoCompressionLevel()
+            return self.auto_level
+        return self.compression_level
+    
     def write_result(self, result, compressed=False):
         """Write results to output.
         
         Args:
             result: Dict with keys being file descriptors and values being data
-                (either bytes or strings). Strings are expected to already have
-                appropriate line-endings.
+                (bytes-like objects, e.g. memoryviews, or strings). Records are
+                expected to already have appropriate line-endings.
             compressed: Whether data has already been compressed.
         """
         for file_desc, data in result.items():
@@ -66,9 +114,11 @@ class Writers(object):
         Args:
             file_desc: File descriptor. If `compressed==True`, this is a tuple
                 (path, mode), otherwise it's only a path.
-            data: The data to write.
+            data: The data to write (a bytes-like object or a string).
             compressed: Whether data has already been compressed.
         """
+        if isinstance(data, str):
+            data = data.encode()
         self.get_writer(file_desc, compressed).write(data)
     
     def close(self):
@@ -76,10 +126,20 @@ class Writers(object):
         """
         for path in self.force_create:
             if path not in self.writers and path != STDOUT:
-                with open_output(path, "w"):
-                    pass
+                if (
+                        self.output_format == 'bgzf' and
+                        get_compressor(path) is gzip):
+                    # An empty BGZF file still needs the EOF block
+                    BgzfWriter(path, index=self.bgzf_index).close()
+                else:
+                    with open_output(path, "w"):
+                        pass
+        std_files = (sys.stdout, sys.stderr) + tuple(
+            getattr(std, 'buffer', None) for std in (sys.stdout, sys.stderr))
         for writer in self.writers.values():
-            if writer not in (sys.stdout, sys.stderr):
+            if writer in std_files:
+                writer.flush()
+            else:
                 writer.close()
 
 class Formatters(object):
@@ -126,14 +126,19 @@ def open_output(filename, mode='w', context_wrapper=False):
     
     return fileobj
 
-def xopen(filename, mode='r', use_system=True):
+def xopen(
+        filename, mode='r', use_system=True, decompression_threads=None,
+        compression_threads=None, compression_level=None):
     """Replacement for the "open" function that can also open files that have
-    been compressed with gzip, bzip2 or xz. If the filename is '-', standard
-    output (mode 'w') or input (mode 'r') is returned. If the filename ends
-    with .gz, the file is opened with a pipe to the gzip program. If that
-    does not work, then gzip.open() is used (the gzip module is slower than
-    the pipe to the gzip program). If the filename ends with .bz2, it's
-    opened as a bz2.BZ2File. Otherwise, the regular open() is used.
+    been compressed with gzip, bzip2, xz or zstd. If the filename is '-',
+    standard output (mode 'w') or input (mode 'r') is returned. If the
+    filename ends with .gz, the file is opened with a pipe to the gzip
+    program. If that does not work, then gzip.open() is used (the gzip module
+    is slower than the pipe to the gzip program). If the filename ends with
+    .bz2, it's opened as a bz2.BZ2File. If the filename ends with .zst, the
+    file is opened with a pipe to the zstd program, or using the zstandard
+    package if the program is not available. Otherwise, the regular open() is
+    used.
     
     Args:
         filename: The file to open.
@@ -142,6 +147,15 @@ def xopen(filename, mode='r', use_system=True):
             Append mode ('a') is unavailable with BZ2 compression and will raise
             an error.
         use_system: Whether to use the system compression/decompression program.
+        decompression_threads: Number of threads to use for decompressing
+            gzip files (see :func:`atropos.io.compression.open_gzip_file`).
+        compression_threads: Number of threads to use for compressing gzip
+            files (see :func:`atropos.io.compression.open_gzip_file`) or
+            zstd files.
+        compression_level: Compression level for output files, or an
+            :class:`atropos.io.compression.AutoCompressionLevel` (see the file
+            openers in :mod:`atropos.io.compression`). If None, the default
+            level of the format is used.
     
     Returns:
         The opened file.
@@ -169,6 +183,14 @@ def xopen(filename, mode='r', use_system=True):
     
     file_opener = get_file_opener(filename)
     if file_opener:
-        return file_opener(filename, mode, use_system=use_system)
+        kwargs = {}
+        if compression_level is not None and 'r' not in mode:
+            kwargs['level'] = compression_level
+        return file_opener(
+            filename, mode, use_system=use_system,
+            threads=(
+                decompression_threads if 'r' in mode
+                else compression_threads),
+            **kwargs)
     else:
         return open(filename, mode)
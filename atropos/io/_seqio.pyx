@@ -1,10 +1,22 @@
 # kate: syntax Python;
 # cython: profile=False, emit_code_comments=False
 import copy
+import io
+from cpython.bytearray cimport (
+    PyByteArray_AS_STRING, PyByteArray_FromStringAndSize)
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from cpython.slice cimport PySlice_GetIndicesEx
+from cpython.unicode cimport (
+    PyUnicode_1BYTE_DATA, PyUnicode_DecodeUTF8, PyUnicode_GET_LENGTH)
+from libc.string cimport memchr, memcmp, memcpy
 from atropos.io import xopen
-from atropos.io.seqio import FormatError, SequenceReader
+from atropos.io.seqio import (
+    FormatError, MmapRegion, SequenceReader, can_mmap)
 from atropos.util import reverse_complement, truncate_string
 
+cdef extern from "Python.h":
+    bint PyUnicode_IS_ASCII(object text)
+
 cdef class Sequence(object):
     """
     A record in a FASTQ file. Also used for FASTA (then the qualities attribute
@@ -13,12 +25,29 @@ cdef class Sequence(object):
 
     If an adapter has been matched to the sequence, the 'match' attribute is
     set to the corresponding Match instance.
+    
+    Records created by the chunked FASTQ parser keep a copy of the bytes of
+    their name, which is only decoded when it is accessed, and remember
+    whether the original record can be reproduced exactly (see `raw_record`)
+    as long as none of its fields have been modified.
+    
+    Slicing a record does not copy the sequence and qualities; the new record
+    is a view (start and end offsets) of the strings of the original record.
+    The substrings are only created when the sequence or qualities of the
+    new record are accessed (see also `view`).
+    
+    A name2 of None means that name2 is the same as the name.
     """
     cdef:
-        public str name
-        public str sequence
-        public str qualities
-        public str name2
+        str _name
+        str _name2
+        str _sequence
+        str _qualities
+        bint _is_view
+        Py_ssize_t _start
+        Py_ssize_t _end
+        bytes _name_bytes
+        bint _unchanged
         public int original_length
         public object match
         public object match_info
@@ -48,10 +77,10 @@ cdef class Sequence(object):
         if alphabet:
             sequence = alphabet.resolve_string(sequence)
         
-        self.name = name
-        self.sequence = sequence
-        self.qualities = qualities
-        self.name2 = name2
+        self._name = name
+        self._sequence = sequence
+        self._qualities = qualities
+        self._name2 = name2
         self.original_length = original_length or len(sequence)
         self.match = match
         self.match_info = match_info
@@ -60,6 +89,98 @@ cdef class Sequence(object):
         self.merged = merged
         self.corrected = corrected
     
+    property name:
+        def __get__(self):
+            if self._name is None and self._name_bytes is not None:
+                self._name = self._name_bytes.decode()
+                self._name_bytes = None
+            return self._name
+        
+        def __set__(self, str value):
+            if self._name2 is None:
+                # name2 keeps the original name
+                self._name2 = self.name
+            self._name = value
+            self._unchanged = False
+    
+    property name2:
+        def __get__(self):
+            if self._name2 is None:
+                return self.name
+            return self._name2
+        
+        def __set__(self, str value):
+            self._name2 = value
+            self._unchanged = False
+    
+    property sequence:
+        def __get__(self):
+            if self._is_view:
+                self._materialize()
+            return self._sequence
+        
+        def __set__(self, str value):
+            if self._is_view:
+                self._materialize()
+            self._sequence = value
+            self._unchanged = False
+    
+    property qualities:
+        def __get__(self):
+            if self._is_view:
+                self._materialize()
+            return self._qualities
+        
+        def __set__(self, str value):
+            if self._is_view:
+                self._materialize()
+            self._qualities = value
+            self._unchanged = False
+    
+    cdef void _materialize(self):
+        """Replace the sequence and qualities with the substrings they view.
+        """
+        self._sequence = self._sequence[self._start:self._end]
+        if self._qualities is not None:
+            self._qualities = self._qualities[self._start:self._end]
+        self._is_view = False
+    
+    def view(self):
+        """Returns the sequence and qualities without creating substrings.
+        
+        Returns:
+            Tuple (sequence, qualities, start, end), where sequence and
+            qualities are strings (qualities may be None) of which the
+            sequence and qualities of this record are the [start:end] slice.
+        """
+        if self._is_view:
+            return (self._sequence, self._qualities, self._start, self._end)
+        return (self._sequence, self._qualities, 0, len(self._sequence))
+    
+    def raw_record(self):
+        """Returns the original FASTQ record (bytes) if the record was parsed
+        by the chunked parser and has not been modified since, otherwise None.
+        """
+        cdef bytes name
+        if not self._unchanged:
+            return None
+        if self._name is None:
+            name = self._name_bytes
+        else:
+            name = self._name.encode()
+        return b''.join((
+            b'@', name, b'\n', self._sequence.encode(), b'\n+',
+            name if self._name2 is None else b'', b'\n',
+            self._qualities.encode(), b'\n'))
+    
+    cdef void _copy_name(self, Sequence other):
+        """Share the (possibly not yet decoded) name of another record.
+        """
+        self._name = other._name
+        self._name2 = other._name2
+        if other._name is None:
+            self._name_bytes = other._name_bytes
+    
     def subseq(self, begin=0, end=None):
         if end is None:
             new_read = self[begin:]
@@ -122,11 +243,37 @@ cdef class Sequence(object):
     
     def __getitem__(self, key):
         """slicing"""
-        return self.__class__(
-            self.name,
+        cdef Sequence new_read
+        cdef Py_ssize_t start, stop, step, slicelength
+        if (
+                type(self) is Sequence and isinstance(key, slice) and
+                key.step is None):
+            # Trimming only adjusts the offsets of the view
+            PySlice_GetIndicesEx(
+                key, len(self), &start, &stop, &step, &slicelength)
+            new_read = Sequence.__new__(Sequence)
+            new_read._copy_name(self)
+            new_read._sequence = self._sequence
+            new_read._qualities = self._qualities
+            new_read._is_view = True
+            if self._is_view:
+                start += self._start
+                stop += self._start
+            new_read._start = start
+            new_read._end = max(start, stop)
+            new_read.original_length = self.original_length
+            new_read.match = self.match
+            new_read.match_info = self.match_info
+            new_read.clipped = list(self.clipped)
+            new_read.insert_overlap = self.insert_overlap
+            new_read.merged = self.merged
+            new_read.corrected = self.corrected
+            return new_read
+        new_read = self.__class__(
+            self._name,
             self.sequence[key],
             self.qualities[key] if self.qualities is not None else None,
-            self.name2,
+            self._name2,
             self.original_length,
             self.match,
             self.match_info,
@@ -135,6 +282,8 @@ cdef class Sequence(object):
             self.merged,
             self.corrected
         )
+        new_read._copy_name(self)
+        return new_read
 
     def __repr__(self):
         qstr = ''
@@ -144,7 +293,9 @@ cdef class Sequence(object):
             truncate_string(self.name), truncate_string(self.sequence), qstr)
 
     def __len__(self):
-        return len(self.sequence)
+        if self._is_view:
+            return self._end - self._start
+        return len(self._sequence)
 
     def __richcmp__(self, other, int op):
         if 2 <= op <= 3:
@@ -159,29 +310,434 @@ cdef class Sequence(object):
             raise NotImplementedError()
 
     def __reduce__(self):
+        cdef bytes name
+        if self._unchanged or (
+                self._name is None and self._name_bytes is not None and
+                not self._name2):
+            # Keep the name undecoded and the record unchanged
+            if self._name is None:
+                name = self._name_bytes
+            else:
+                name = self._name.encode()
+            return (_restore_sequence, (
+                name, self.sequence, self.qualities, self._name2 is None,
+                self._unchanged))
         return (Sequence, (self.name, self.sequence, self.qualities, self.name2))
 
+def _restore_sequence(
+        bytes name, str sequence, str qualities, bint has_name2,
+        bint unchanged):
+    """Unpickle a Sequence whose name has not been decoded.
+    """
+    return _new_sequence(name, sequence, qualities, has_name2, unchanged)
+
+cdef class _RecordWriter:
+    """Writes formatted records and FASTQ-formatted Sequences to a buffer. In
+    sizing mode, only the number of bytes that would be written is counted.
+    """
+    cdef char* _out
+    cdef bint _sizing
+    cdef Py_ssize_t size
+    
+    def __cinit__(self):
+        self._sizing = True
+        self.size = 0
+    
+    cdef void start(self, char* out):
+        self._out = out
+        self._sizing = False
+        self.size = 0
+    
+    cdef inline void _add(self, const char* data, Py_ssize_t length):
+        if not self._sizing:
+            memcpy(self._out + self.size, data, length)
+        self.size += length
+    
+    cdef int _add_str(self, str text, Py_ssize_t start, Py_ssize_t end) except -1:
+        cdef bytes data
+        if PyUnicode_IS_ASCII(text):
+            self._add(<const char*>PyUnicode_1BYTE_DATA(text) + start, end - start)
+        else:
+            data = text[start:end].encode()
+            self._add(data, len(data))
+        return 0
+    
+    cdef int _add_name(self, Sequence read) except -1:
+        if read._name is None:
+            # The name has not been decoded
+            self._add(read._name_bytes, len(read._name_bytes))
+        else:
+            self._add_str(read._name, 0, len(read._name))
+        return 0
+    
+    cdef int _add_fastq(self, Sequence read) except -1:
+        cdef Py_ssize_t start = 0, end = len(read._sequence)
+        if read._qualities is None:
+            raise TypeError(
+                "Cannot write read {!r} without qualities as FASTQ".format(
+                    read.name))
+        if read._is_view:
+            start = read._start
+            end = read._end
+        self._add(b'@', 1)
+        self._add_name(read)
+        self._add(b'\n', 1)
+        self._add_str(read._sequence, start, end)
+        self._add(b'\n+', 2)
+        if read._name2 is None:
+            self._add_name(read)
+        else:
+            self._add_str(read._name2, 0, len(read._name2))
+        self._add(b'\n', 1)
+        self._add_str(read._qualities, start, end)
+        self._add(b'\n', 1)
+        return 0
+    
+    cdef int write_items(self, list items) except -1:
+        for item in items:
+            if isinstance(item, str):
+                self._add_str(item, 0, PyUnicode_GET_LENGTH(item))
+            else:
+                self._add_fastq(<Sequence?>item)
+        return 0
+
+def format_records(list items):
+    """Format a batch of records for output.
+    
+    Args:
+        items: A list of strings (already formatted records) and Sequences,
+            which are formatted as FASTQ.
+    
+    Returns:
+        A bytearray with the UTF-8 encoded records. The sequences and
+        qualities of trimmed reads are copied directly from the strings they
+        view, and names that have not been decoded are copied as bytes.
+    """
+    cdef _RecordWriter writer = _RecordWriter()
+    cdef bytearray result
+    writer.write_items(items)
+    result = PyByteArray_FromStringAndSize(NULL, writer.size)
+    writer.start(PyByteArray_AS_STRING(result))
+    writer.write_items(items)
+    return result
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+"""Number of bytes read at a time by the chunked FASTQ parser."""
+
+cdef inline Py_ssize_t _line_end(
+        const char* buf, Py_ssize_t pos, Py_ssize_t size, bint eof):
+    """Returns the position of the newline that terminates the line starting
+    at `pos`. At EOF, the final line does not need to be newline-terminated.
+    Returns -1 if no complete line is available.
+    """
+    cdef const char* ptr
+    if pos >= size:
+        return -1
+    ptr = <const char*>memchr(buf + pos, b'\n', size - pos)
+    if ptr != NULL:
+        return ptr - buf
+    elif eof:
+        return size
+    else:
+        return -1
+
+cdef inline Py_ssize_t _strip_cr(
+        const char* buf, Py_ssize_t start, Py_ssize_t end):
+    """Returns `end`, excluding a trailing carriage return (DOS line break).
+    """
+    if end > start and buf[end-1] == b'\r':
+        return end - 1
+    return end
+
+cdef inline str _decode(const char* buf, Py_ssize_t start, Py_ssize_t end):
+    return PyUnicode_DecodeUTF8(buf + start, end - start, NULL)
+
+cdef str _line_prefix(
+        const char* buf, Py_ssize_t start, Py_ssize_t end, Py_ssize_t size):
+    """Returns (at most) the first 10 characters of a line, for use in error
+    messages. `end` is exclusive of the line break, which is included (as it
+    is by the line-based parser) if present.
+    """
+    if end < size:
+        end += 1
+    return PyUnicode_DecodeUTF8(
+        buf + start, min(end - start, 10), 'replace')
+
+cdef Sequence _new_sequence(
+        bytes name, str sequence, str qualities, bint has_name2,
+        bint canonical):
+    """Creates a Sequence without the overhead of calling the constructor.
+    The name is decoded when it is first accessed. The caller is responsible
+    for validating the arguments.
+    
+    Args:
+        name: The (undecoded) name.
+        sequence, qualities: The decoded sequence and qualities.
+        has_name2: Whether the '+' line repeats the name.
+        canonical: Whether the record can be reproduced exactly from its
+            fields (e.g. it does not have DOS line breaks).
+    """
+    cdef Sequence seq = Sequence.__new__(Sequence)
+    seq._name_bytes = name
+    seq._sequence = sequence
+    seq._qualities = qualities
+    seq._name2 = None if has_name2 else ''
+    seq._unchanged = canonical
+    seq.original_length = len(sequence)
+    seq.clipped = [0,0,0,0]
+    return seq
+
+cdef class FastqParser:
+    """Parses FASTQ records from blocks of bytes read from a binary file, or
+    directly from a region of a memory-mapped file.
+    
+    Args:
+        fileobj: A binary file-like object or a :class:`MmapRegion`.
+        buffer_size: Number of bytes to read at a time.
+        sequence_class: The class of the records to create.
+        alphabet: Alphabet passed to `sequence_class`.
+    """
+    cdef object _read
+    cdef object _sequence_class
+    cdef object _alphabet
+    cdef Py_ssize_t _buffer_size
+    cdef bint _fast
+    cdef bint _eof
+    cdef bytes _data
+    cdef object _source
+    cdef const unsigned char[::1] _view
+    cdef const char* _buf
+    cdef Py_ssize_t _pos
+    cdef Py_ssize_t _size
+    
+    def __init__(
+            self, fileobj, buffer_size=DEFAULT_BUFFER_SIZE,
+            sequence_class=Sequence, alphabet=None):
+        self._buffer_size = buffer_size
+        self._sequence_class = sequence_class
+        self._alphabet = alphabet
+        self._fast = sequence_class is Sequence and alphabet is None
+        self._data = b''
+        self._buf = self._data
+        if isinstance(fileobj, MmapRegion):
+            # The whole region is available, so there is nothing to read
+            self._read = None
+            self._source = fileobj.buffer
+            self._view = self._source
+            self._buf = <const char*>&self._view[0]
+            self._eof = True
+            self._pos = fileobj.offset
+            self._size = fileobj.end
+        else:
+            self._read = fileobj.read
+            self._eof = False
+            self._pos = 0
+            self._size = 0
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        record = self._next_record()
+        if record is None:
+            raise StopIteration()
+        return record
+    
+    cpdef list read_batch(self, Py_ssize_t size):
+        """Parse up to `size` records.
+        
+        Returns:
+            A list of records. The list is shorter than `size` only when the
+            end of the file is reached.
+        """
+        cdef list batch = []
+        cdef Py_ssize_t i
+        for i in range(size):
+            record = self._next_record()
+            if record is None:
+                break
+            batch.append(record)
+        return batch
+    
+    cdef bint _fill(self) except -1:
+        """Append the next block from the file to any unparsed data.
+        
+        Returns:
+            False if there is no more data in the file.
+        """
+        block = self._read(self._buffer_size)
+        if not block:
+            self._eof = True
+            self._data = self._data[self._pos:]
+        elif self._pos < self._size:
+            self._data = self._data[self._pos:] + block
+        else:
+            self._data = block
+        self._buf = self._data
+        self._pos = 0
+        self._size = len(self._data)
+        return not self._eof
+    
+    cdef object _next_record(self):
+        """Returns the next record, or None at the end of the file.
+        """
+        cdef object record
+        while True:
+            if self._pos < self._size:
+                record = self._parse_record()
+                if record is not None:
+                    return record
+            if self._eof:
+                return None
+            self._fill()
+    
+    cdef object _parse_record(self):
+        """Parse the record starting at the current position. Returns None if
+        the buffer does not contain a complete record.
+        """
+        cdef const char* buf = self._buf
+        cdef Py_ssize_t size = self._size
+        cdef bint eof = self._eof
+        cdef Py_ssize_t pos = self._pos
+        cdef Py_ssize_t start, end
+        cdef Py_ssize_t name_start, name_end, seq_start, seq_end
+        cdef Py_ssize_t plus_start, plus_end, qual_start, qual_end
+        cdef bint canonical
+        cdef str name, sequence, qualities, name2
+        
+        # name line
+        end = _line_end(buf, pos, size, eof)
+        if end < 0:
+            return None
+        if buf[pos] != b'@':
+            raise FormatError(
+                "Line 1 in FASTQ file is expected to start with '@', "
+                "but found {0!r}".format(_line_prefix(buf, pos, end, size)))
+        name_start = pos + 1
+        name_end = _strip_cr(buf, pos, end)
+        # Whether the record can be written out unchanged, i.e. it does not
+        # have DOS line breaks and is newline-terminated
+        canonical = name_end == end
+        
+        # sequence line
+        seq_start = end + 1
+        end = _line_end(buf, seq_start, size, eof)
+        if end < 0:
+            if eof:
+                raise FormatError("FASTQ file ended prematurely")
+            return None
+        seq_end = _strip_cr(buf, seq_start, end)
+        canonical = canonical and seq_end == end
+        
+        # '+' line
+        start = end + 1
+        end = _line_end(buf, start, size, eof)
+        if end < 0:
+            if eof:
+                raise FormatError("FASTQ file ended prematurely")
+            return None
+        plus_start = start + 1
+        plus_end = _strip_cr(buf, start, end)
+        canonical = canonical and plus_end == end
+        if plus_end == start or buf[start] != b'+':
+            raise FormatError(
+                "Line 3 in FASTQ file is expected to start with "
+                "'+', but found {0!r}".format(
+                    _decode(buf, start, min(plus_end, start + 10))))
+        
+        # quality line
+        qual_start = end + 1
+        end = _line_end(buf, qual_start, size, eof)
+        if end < 0:
+            if eof:
+                raise FormatError("FASTQ file ended prematurely")
+            return None
+        qual_end = _strip_cr(buf, qual_start, end)
+        canonical = canonical and qual_end == end and end < size
+        self._pos = end + 1
+        
+        if plus_end > plus_start and (
+                plus_end - plus_start != name_end - name_start or
+                memcmp(
+                    buf + plus_start, buf + name_start,
+                    plus_end - plus_start) != 0):
+            raise FormatError(
+                "At line 3: Sequence descriptions in the FASTQ "
+                "file don't match ({0!r} != {1!r}).\n"
+                "The second sequence description must be either "
+                "empty or equal to the first description.".format(
+                    _decode(buf, name_start, name_end),
+                    _decode(buf, plus_start, plus_end)))
+        sequence = _decode(buf, seq_start, seq_end)
+        qualities = _decode(buf, qual_start, qual_end)
+        
+        if self._fast and seq_end - seq_start == qual_end - qual_start:
+            return _new_sequence(
+                PyBytes_FromStringAndSize(
+                    buf + name_start, name_end - name_start),
+                sequence, qualities, plus_end > plus_start, canonical)
+        
+        name = _decode(buf, name_start, name_end)
+        name2 = name if plus_end > plus_start else ''
+        try:
+            return self._sequence_class(
+                name, sequence, qualities, name2=name2,
+                alphabet=self._alphabet)
+        except Exception as err:
+            raise FormatError(
+                "Error creating sequence record at line 4") from err
+
 class FastqReader(SequenceReader):
     """Reader for FASTQ files. Does not support multi-line FASTQ files.
+    
+    When reading from a path or a binary file-like object, the input is read
+    in blocks of `buffer_size` bytes and records are parsed directly from the
+    buffer. Text file-like objects are parsed line-by-line. If `use_mmap` is
+    True and the file is uncompressed, the file is memory-mapped and records
+    are parsed directly from the map. A :class:`MmapRegion` can also be read.
     """
     file_format = "FASTQ"
     delivers_qualities = True
     
     def __init__(
             self, filename, quality_base=33, sequence_class=Sequence,
-            alphabet=None):
+            alphabet=None, buffer_size=DEFAULT_BUFFER_SIZE,
+            decompression_threads=None, use_mmap=False):
         """
         file is a filename or a file-like object.
         If file is a filename, then .gz files are supported.
         """
+        close_on_exit = False
+        if use_mmap and can_mmap(filename):
+            filename = MmapRegion(filename)
+            close_on_exit = True
+        self.buffer_size = buffer_size
+        self.chunked = isinstance(filename, MmapRegion) or (
+            bool(buffer_size) and (
+                isinstance(filename, str) or
+                isinstance(filename, (io.RawIOBase, io.BufferedIOBase))))
         super().__init__(
-            filename, quality_base=quality_base, alphabet=alphabet)
+            filename, mode='rb' if self.chunked else 'r',
+            quality_base=quality_base, alphabet=alphabet,
+            decompression_threads=decompression_threads)
+        if close_on_exit:
+            self._close_on_exit = True
         self.sequence_class = sequence_class
     
     def __iter__(self):
         """
         Yield Sequence objects
         """
+        if self.chunked:
+            return FastqParser(
+                self._file, self.buffer_size, self.sequence_class,
+                self.alphabet)
+        else:
+            return self._iter_lines()
+    
+    def _iter_lines(self):
+        """Yield Sequence objects parsed line-by-line from a text file.
+        """
         cdef int i = 0
         cdef int strip
         cdef str line, name, qualities, sequence, name2
@@ -241,3 +797,124 @@ class FastqReader(SequenceReader):
             i = (i + 1) % 4
         if i != 0:
             raise FormatError("FASTQ file ended prematurely")
+
+cdef class FastqChunker:
+    """Cuts a binary FASTQ file into chunks of raw data that contain a fixed
+    number of records. Records are not parsed or validated; chunks are only
+    aligned on record boundaries by counting lines.
+    
+    Args:
+        fileobj: A binary file-like object.
+        buffer_size: Number of bytes to read at a time.
+    """
+    cdef object _read
+    cdef Py_ssize_t _buffer_size
+    cdef bint _eof
+    cdef bytes _data
+    cdef Py_ssize_t _pos
+    cdef Py_ssize_t _size
+    
+    def __init__(self, fileobj, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._read = fileobj.read
+        self._buffer_size = buffer_size
+        self._eof = False
+        self._data = b''
+        self._pos = 0
+        self._size = 0
+    
+    cpdef tuple read_chunk(
+            self, Py_ssize_t num_records, Py_ssize_t lines_per_record=4):
+        """Read the next `num_records` records.
+        
+        Args:
+            num_records: Maximum number of records to read.
+            lines_per_record: Number of lines in each record (e.g. 8 for
+                interleaved read pairs).
+        
+        Returns:
+            Tuple (chunk, size), where chunk is a bytes object and size is the
+            number of records in the chunk. At the end of the file, the final
+            chunk may contain fewer (or incomplete) records.
+        """
+        cdef const char* buf
+        cdef const char* ptr
+        cdef Py_ssize_t lines = num_records * lines_per_record
+        cdef Py_ssize_t found = 0
+        cdef Py_ssize_t scan = self._pos
+        cdef bytes chunk
+        
+        while found < lines:
+            buf = self._data
+            while found < lines and scan < self._size:
+                ptr = <const char*>memchr(buf + scan, b'\n', self._size - scan)
+                if ptr == NULL:
+                    scan = self._size
+                    break
+                scan = (ptr - buf) + 1
+                found += 1
+            if found == lines:
+                break
+            if self._eof:
+                if scan > self._pos and buf[scan-1] != b'\n':
+                    # Final line is not newline-terminated
+                    found += 1
+                break
+            
+            # Need more data: keep unconsumed data and read the next block
+            scan -= self._pos
+            block = self._read(self._buffer_size)
+            if not block:
+                self._eof = True
+                self._data = self._data[self._pos:]
+            elif self._pos < self._size:
+                self._data = self._data[self._pos:] + block
+            else:
+                self._data = block
+            self._pos = 0
+            self._size = len(self._data)
+        
+        if scan == self._pos:
+            return (b'', 0)
+        chunk = self._data[self._pos:scan]
+        self._pos = scan
+        return (chunk, (found + lines_per_record - 1) // lines_per_record)
+
+def find_records(
+        buffer, Py_ssize_t start, Py_ssize_t end, Py_ssize_t num_records,
+        Py_ssize_t lines_per_record=4):
+    """Find the end of the next `num_records` records in a buffer (e.g. a
+    memory-mapped file). Like :class:`FastqChunker`, records are only located
+    by counting lines.
+    
+    Args:
+        buffer: An object that supports the buffer protocol.
+        start: The start of the first record.
+        end: The end of the data in `buffer`.
+        num_records: Maximum number of records to find.
+        lines_per_record: Number of lines in each record.
+    
+    Returns:
+        Tuple (pos, size), where pos is the end of the last record and size is
+        the number of records. At the end of the data, the final record may be
+        incomplete.
+    """
+    cdef const unsigned char[::1] view
+    cdef const char* buf
+    cdef const char* ptr
+    cdef Py_ssize_t lines = num_records * lines_per_record
+    cdef Py_ssize_t found = 0
+    cdef Py_ssize_t scan = start
+    if start >= end or lines <= 0:
+        return (start, 0)
+    view = buffer
+    buf = <const char*>&view[0]
+    while found < lines and scan < end:
+        ptr = <const char*>memchr(buf + scan, b'\n', end - scan)
+        if ptr == NULL:
+            # Final line is not newline-terminated
+            scan = end
+            found += 1
+            break
+        scan = (ptr - buf) + 1
+        found += 1
+    return (scan, (found + lines_per_record - 1) // lines_per_record)
@@ -1,37 +1,200 @@
 """File compression/decompression functions.
 """
 import bz2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import gzip
 import io
+from itertools import islice
 import lzma
+from multiprocessing import cpu_count
 import os
+import queue
+import struct
 from subprocess import Popen, PIPE
+import threading
+import time
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_COMPRESSION_LEVEL = 6
+"""Default gzip compression level (the default of the gzip program). Used
+wherever atropos compresses gzip data itself, rather than the default level
+of the gzip library (9), which is much slower for little gain in compression
+ratio."""
+
+ZSTD_DEFAULT_LEVEL = 3
+"""Default Zstandard compression level (the default of the zstd program)."""
+
+class AutoCompressionLevel(object):
+    """Adjusts the compression level so that compression does not become the
+    bottleneck. The time spent compressing (between calls to `start` and
+    `stop`) is compared to the rest of the elapsed time, which is the time
+    spent producing the data to compress (e.g. trimming reads, or waiting for
+    results from the workers). At most once every `interval` seconds, the
+    level is decreased if compressing took longer than producing the data, or
+    increased if it took less than half as long.
+    
+    Args:
+        level: The initial compression level.
+        min_level, max_level: The range of levels to choose from.
+        interval: Minimum number of seconds between adjustments.
+    """
+    def __init__(
+            self, level=DEFAULT_COMPRESSION_LEVEL, min_level=1, max_level=9,
+            interval=1.0):
+        self.level = level
+        self.min_level = min_level
+        self.max_level = max_level
+        self.interval = interval
+        self._period_start = None
+        self._compress_start = None
+        self._compress_time = 0.0
+    
+    def start(self):
+        """Called before compressing data.
+        """
+        now = time.perf_counter()
+        if self._period_start is None:
+            self._period_start = now
+        self._compress_start = now
+    
+    def stop(self):
+        """Called after compressing data. Adjusts the level if necessary.
+        """
+        now = time.perf_counter()
+        self._compress_time += now - self._compress_start
+        elapsed = now - self._period_start
+        if elapsed < self.interval:
+            return
+        produce_time = elapsed - self._compress_time
+        if self._compress_time > produce_time:
+            self.level = max(self.level - 1, self.min_level)
+        elif 2 * self._compress_time < produce_time:
+            self.level = min(self.level + 1, self.max_level)
+        self._period_start = now
+        self._compress_time = 0.0
+
+class ZstdCompressor(object):
+    """Zstandard compression, with the same `compress` interface as the python
+    compression libraries. Uses the zstandard package if it is installed,
+    otherwise the zstd program.
+    
+    Args:
+        level: The compression level (1-22).
+        threads: Number of worker threads to use for compression.
+    """
+    def __init__(self, level=ZSTD_DEFAULT_LEVEL, threads=None):
+        self.level = level
+        self.threads = threads
+    
+    def compress(self, data, level=None):
+        """Compress data into a Zstandard frame.
+        
+        Args:
+            data: The data to compress.
+            level: The compression level; defaults to `self.level`.
+        """
+        if level is None:
+            level = self.level
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(
+                level=level, threads=self.threads or 0).compress(data)
+        program = get_program_path('zstd')
+        if program is None:
+            raise IOError(
+                "Zstandard compression requires the zstd program or the "
+                "zstandard python package")
+        process = Popen(
+            [program] + zstd_args(level, self.threads),
+            stdin=PIPE, stdout=PIPE)
+        cdata = process.communicate(data)[0]
+        if process.returncode != 0:
+            raise IOError(
+                "zstd process terminated with exit code {0}".format(
+                    process.returncode))
+        return cdata
+
+def zstd_args(level=None, threads=None):
+    """Returns the arguments to the zstd program for compressing to stdout at
+    a given compression level using a given number of threads.
+    """
+    args = ['-q', '-c']
+    if level is not None:
+        if level > 19:
+            args.append('--ultra')
+        args.append('-{}'.format(level))
+    if threads:
+        args.append('-T{}'.format(threads))
+    return args
 
 COMPRESSORS = {
     ".gz"  : gzip,
     ".bz2" : bz2,
-    ".xz"  : lzma
+    ".xz"  : lzma,
+    ".zst" : ZstdCompressor()
 }
-"""Mapping of file extension to python compression library."""
+"""Mapping of file extension to python compression library (or an object
+with the same `compress` interface)."""
+
+def compress_data(data, compressor, level=None):
+    """Compress data using one of the libraries in `COMPRESSORS`.
+    
+    Args:
+        data: The data to compress.
+        compressor: The compression library.
+        level: The compression level. If None, the default level of the
+            library is used, except for gzip, for which
+            `DEFAULT_COMPRESSION_LEVEL` is used.
+    """
+    if compressor is gzip and level is None:
+        level = DEFAULT_COMPRESSION_LEVEL
+    if level is None:
+        return compressor.compress(data)
+    if compressor is lzma:
+        return lzma.compress(data, preset=level)
+    return compressor.compress(data, level)
+
+GZIP_DECOMPRESSORS = ('pigz', 'igzip', 'gzip')
+"""Programs that can be used to decompress gzip files, in order of
+preference."""
 
 class GzipWriter:
-    """Wrapper for a process that uses the system gzip program to compress
-    bytes.
+    """Wrapper for a process that uses a system program (gzip, pigz or zstd)
+    to compress bytes.
     
     Args:
         path: The path of the output file.
         mode: The file open mode.
+        program: The compression program.
+        threads: Number of threads to use, for programs that support
+            multi-threaded compression (pigz, zstd).
+        level: The compression level. If None, the default level of the
+            program is used.
     """
-    def __init__(self, path, mode='w'):
+    def __init__(
+            self, path, mode='w', program='gzip', threads=None, level=None):
         self.name = path
+        self.program = program
         self.outfile = open(path, mode)
         self.devnull = open(os.devnull, 'w')
         self.closed = False
+        args = [get_program_path(program)]
+        if program == 'zstd':
+            args.extend(zstd_args(level, threads))
+        else:
+            if program == 'pigz' and threads:
+                args.extend(('-p', str(threads)))
+            if level is not None:
+                args.append('-{}'.format(level))
         try:
             # Setting close_fds to True is necessary due to
             # http://bugs.python.org/issue12786
             self.process = Popen(
-                [get_program_path('gzip')], stdin=PIPE, stdout=self.outfile,
+                args, stdin=PIPE, stdout=self.outfile,
                 stderr=self.devnull, close_fds=True)
         except IOError:
             self.outfile.close()
@@ -61,8 +224,8 @@ class GzipWriter:
         self.devnull.close()
         if retcode != 0:
             raise IOError(
-                "Output gzip process terminated with exit code {0}".format(
-                    retcode))
+                "Output {0} process terminated with exit code {1}".format(
+                    self.program, retcode))
     
     def __enter__(self):
         return self
@@ -71,15 +234,25 @@ class GzipWriter:
         self.close()
 
 class GzipReader:
-    """Wrapper for a process that uses the system gzip program to decompress
-    bytes.
+    """Wrapper for a process that uses a system program (gzip or a compatible
+    program such as pigz or igzip, or zstd) to decompress bytes.
     
     Args:
         path: The path of the input file.
+        program: The decompression program.
+        threads: Number of threads to use, for programs that support
+            multi-threaded decompression (pigz).
     """
-    def __init__(self, path):
+    def __init__(self, path, program='gzip', threads=None):
         self.name = path
-        self.process = Popen([get_program_path('gzip'), '-cd', path], stdout=PIPE)
+        self.program = program
+        args = [get_program_path(program), '-cd']
+        if program == 'pigz' and threads:
+            args.extend(('-p', str(threads)))
+        elif program == 'zstd':
+            args.append('-q')
+        args.append(path)
+        self.process = Popen(args, stdout=PIPE)
         self.closed = False
     
     def readable(self):
@@ -100,9 +273,12 @@ class GzipReader:
         self.closed = True
         retcode = self.process.poll()
         if retcode is None:
-            # still running
+            # still running; the exit code of a terminated process is not an
+            # error
             self.process.terminate()
-        self._raise_if_error()
+            self.process.wait()
+        else:
+            self._raise_if_error()
     
     def __iter__(self):
         for line in self.process.stdout:
@@ -117,12 +293,13 @@ class GzipReader:
         retcode = self.process.poll()
         if retcode is not None and retcode != 0:
             raise EOFError(
-                "gzip process returned non-zero exit code {0}. Is the "
-                "input file truncated or corrupt?".format(retcode))
+                "{0} process returned non-zero exit code {1}. Is the "
+                "input file truncated or corrupt?".format(
+                    self.program, retcode))
     
     def read(self, *args):
         data = self.process.stdout.read(*args)
-        if len(args) == 0 or args[0] <= 0:
+        if len(args) == 0 or args[0] <= 0 or not data:
             # wait for process to terminate until we check the exit code
             self.process.wait()
         self._raise_if_error()
@@ -134,6 +311,501 @@ class GzipReader:
     def __exit__(self, *exc_info):
         self.close()
 
+class ThreadedGzipReader:
+    """Decompresses a gzip file using zlib in a background thread. Used when
+    no system decompression program is available. zlib releases the GIL while
+    decompressing, so decompression runs concurrently with parsing.
+    
+    Args:
+        path: The path of the input file.
+        block_size: Number of compressed bytes to read at a time.
+        queue_size: Maximum number of decompressed blocks to buffer.
+    """
+    def __init__(self, path, block_size=1024 * 1024, queue_size=8):
+        self.name = path
+        self.block_size = block_size
+        self.closed = False
+        self._file = open(path, 'rb')
+        self._queue = queue.Queue(queue_size)
+        self._buffer = bytearray()
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="Decompressor {}".format(path),
+            daemon=True)
+        self._thread.start()
+    
+    def readable(self):
+        return True
+    
+    def writable(self):
+        return False
+    
+    def seekable(self):
+        return False
+    
+    def flush(self):
+        pass
+    
+    def _put(self, item):
+        """Add an item to the queue, waiting until there is space or the
+        reader is closed.
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def _run(self):
+        """Thread target: decompress the file, then queue None to signal
+        end-of-file, or an EOFError if the file could not be decompressed.
+        """
+        try:
+            if self._decompress():
+                self._put(None)
+        except (zlib.error, OSError, EOFError) as err:
+            self._put(EOFError(
+                "Error decompressing {0}: {1}. Is the input file truncated "
+                "or corrupt?".format(self.name, err)))
+    
+    def _decompress(self):
+        """Decompress the file and queue decompressed blocks. A gzip file may
+        have multiple members, each of which is decompressed with a new
+        decompressor.
+        
+        Returns:
+            False if the reader was closed before the end of the file.
+        """
+        decompressor = zlib.decompressobj(31)
+        started = False
+        while not self._stop.is_set():
+            data = self._file.read(self.block_size)
+            if not data:
+                break
+            while data:
+                started = True
+                block = decompressor.decompress(data)
+                if block and not self._put(block):
+                    return False
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                    started = False
+                else:
+                    data = None
+        if started and not decompressor.eof:
+            raise zlib.error("compressed file ended prematurely")
+        return True
+    
+    def _fill(self):
+        """Add the next decompressed block to the buffer.
+        
+        Raises:
+            EOFError if the file could not be decompressed.
+        """
+        item = self._queue.get()
+        if item is None:
+            self._eof = True
+        elif isinstance(item, Exception):
+            self._eof = True
+            raise item
+        else:
+            self._buffer.extend(item)
+    
+    def _consume(self, size):
+        """Remove and return the first `size` bytes from the buffer.
+        """
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._eof:
+                self._fill()
+            size = len(self._buffer)
+        else:
+            while not self._eof and len(self._buffer) < size:
+                self._fill()
+        return self._consume(size)
+    
+    def readline(self):
+        start = 0
+        while True:
+            idx = self._buffer.find(b'\n', start)
+            if idx >= 0:
+                return self._consume(idx + 1)
+            if self._eof:
+                return self._consume(len(self._buffer))
+            start = len(self._buffer)
+            self._fill()
+    
+    def __iter__(self):
+        return iter(self.readline, b'')
+    
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+        self._thread.join()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+class BgzfReader(ThreadedGzipReader):
+    """Decompresses a BGZF file, in which the data is split into independently
+    compressed gzip blocks (of at most 64 KB), using a pool of threads. The
+    decompressed data is returned in order.
+    
+    Args:
+        path: The path of the input file.
+        threads: Number of decompression threads.
+        blocks_per_task: Number of blocks decompressed by a thread at a time.
+        queue_size: Maximum number of decompressed groups of blocks to buffer.
+    """
+    def __init__(self, path, threads, blocks_per_task=16, queue_size=8):
+        self.threads = threads
+        self.blocks_per_task = blocks_per_task
+        super().__init__(path, queue_size=queue_size)
+    
+    def _decompress(self):
+        """Read groups of blocks and decompress them in the thread pool. At
+        most `threads` + 1 groups are in flight at a time.
+        """
+        blocks = iter_bgzf_blocks(self._file)
+        pending = deque()
+        with ThreadPoolExecutor(self.threads) as pool:
+            while not self._stop.is_set():
+                group = list(islice(blocks, self.blocks_per_task))
+                if group:
+                    pending.append(pool.submit(decompress_bgzf_blocks, group))
+                while pending and (not group or len(pending) > self.threads):
+                    data = pending.popleft().result()
+                    if data and not self._put(data):
+                        return False
+                if not group:
+                    return True
+        return False
+
+class ThreadedGzipWriter:
+    """Compresses data using a pool of threads. Used when pigz is not
+    available. The data is split into blocks, each of which is compressed
+    (using zlib, which releases the GIL) as a separate gzip member; the
+    members are written in order, and their concatenation is a valid gzip
+    file.
+    
+    Args:
+        path: The path of the output file.
+        threads: Number of compression threads. If <= 1, blocks are
+            compressed in the calling thread.
+        block_size: Number of uncompressed bytes in each gzip member.
+        level: The compression level, or an :class:`AutoCompressionLevel`,
+            in which case the level of each block is chosen according to the
+            time spent in `write` (i.e. waiting for blocks to be compressed)
+            relative to the time between writes.
+    """
+    def __init__(
+            self, path, threads, block_size=1024 * 1024,
+            level=DEFAULT_COMPRESSION_LEVEL):
+        self.name = path
+        self.threads = threads
+        self.block_size = block_size
+        self.level = level
+        if isinstance(level, AutoCompressionLevel):
+            self.auto_level = level
+        else:
+            self.auto_level = None
+        self.closed = False
+        self._file = open(path, 'wb')
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 else None
+    
+    def readable(self):
+        return False
+    
+    def writable(self):
+        return True
+    
+    def seekable(self):
+        return False
+    
+    def _compress(self, data, level):
+        """Compress a block.
+        """
+        return compress_gzip_member(data, level)
+    
+    def _write_compressed(self, data):
+        """Write a compressed block to the file.
+        """
+        self._file.write(data)
+    
+    def _submit(self, data):
+        """Compress a block in the thread pool. At most `threads` + 1 blocks
+        are in flight at a time.
+        """
+        level = self.auto_level.level if self.auto_level else self.level
+        if self._pool is None:
+            self._write_compressed(self._compress(data, level))
+            return
+        self._pending.append(self._pool.submit(self._compress, data, level))
+        while len(self._pending) > self.threads:
+            self._write_compressed(self._pending.popleft().result())
+    
+    def write(self, data):
+        if self.auto_level is None:
+            return self._write(data)
+        self.auto_level.start()
+        try:
+            return self._write(data)
+        finally:
+            self.auto_level.stop()
+    
+    def _write(self, data):
+        """Add data to the buffer, and compress any full blocks.
+        """
+        view = memoryview(data).cast('B')
+        size = len(view)
+        pos = 0
+        if self._buffer:
+            pos = min(self.block_size - len(self._buffer), size)
+            self._buffer.extend(view[:pos])
+            if len(self._buffer) < self.block_size:
+                return size
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while size - pos >= self.block_size:
+            self._submit(bytes(view[pos:pos + self.block_size]))
+            pos += self.block_size
+        self._buffer.extend(view[pos:])
+        return size
+    
+    def flush(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_compressed(self._pending.popleft().result())
+        self._file.flush()
+    
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+class BgzfWriter(ThreadedGzipWriter):
+    """Writes a BGZF file: data is compressed in blocks of at most
+    `BGZF_BLOCK_DATA_SIZE` bytes (using a pool of threads if `threads` > 1),
+    and the EOF marker block is written when the file is closed.
+    
+    Args:
+        path: The path of the output file.
+        threads: Number of compression threads.
+        level: The compression level, or an :class:`AutoCompressionLevel`.
+        index: Whether to also write a bgzip-compatible index (the path of
+            the file + '.gzi').
+        compressed: Whether the data passed to `write` is already compressed
+            into BGZF blocks (e.g. by :func:`compress_bgzf`), in which case it
+            is written as-is.
+    """
+    def __init__(
+            self, path, threads=None, level=DEFAULT_COMPRESSION_LEVEL,
+            index=False, compressed=False):
+        super().__init__(path, threads or 1, BGZF_BLOCK_DATA_SIZE, level)
+        self.compressed = compressed
+        self.index = [] if index else None
+        self._offset = 0
+        self._uoffset = 0
+    
+    def _compress(self, data, level):
+        return compress_bgzf_block(data, level)
+    
+    def _write_compressed(self, data):
+        self._file.write(data)
+        if self.index is None:
+            return
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            # The index has an entry for the start of every block except the
+            # first.
+            if self._offset:
+                self.index.append((self._offset, self._uoffset))
+            xlen = struct.unpack_from('<H', view, pos + 10)[0]
+            block_size = _bgzf_block_size(view[pos + 12:pos + 12 + xlen])
+            if block_size is None:
+                raise ValueError("Missing BGZF block size")
+            self._offset += block_size
+            self._uoffset += struct.unpack_from(
+                '<I', view, pos + block_size - 4)[0]
+            pos += block_size
+    
+    def write(self, data):
+        if self.compressed:
+            self._write_compressed(data)
+            return len(data)
+        return super().write(data)
+    
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self._file.write(BGZF_EOF)
+            if self.index is not None:
+                write_bgzf_index(self.name + BGZF_INDEX_EXTENSION, self.index)
+        finally:
+            super().close()
+
+def compress_gzip_member(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """Compress data into a single gzip member. Releases the GIL while
+    compressing.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+"""The first four bytes of a BGZF block (gzip magic, deflate compression
+method, and FEXTRA flag)."""
+
+BGZF_BLOCK_DATA_SIZE = 65280
+"""Maximum number of uncompressed bytes in a BGZF block. This is the value
+used by bgzip, which guarantees that the compressed block fits in 64 KB."""
+
+def _bgzf_block_size(extra):
+    """Returns the total size of a BGZF block from the BC subfield of the
+    gzip extra field, or None if there is no BC subfield.
+    """
+    pos = 0
+    while pos + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[pos+2:pos+4])[0]
+        if extra[pos:pos+2] == b'BC' and slen == 2:
+            return struct.unpack('<H', extra[pos+4:pos+6])[0] + 1
+        pos += 4 + slen
+    return None
+
+def is_bgzf(path):
+    """Whether a file is BGZF-compressed, i.e. whether it starts with a gzip
+    header having a BC extra subfield.
+    """
+    with open(path, 'rb') as fileobj:
+        header = fileobj.read(12)
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            return False
+        xlen = struct.unpack('<H', header[10:12])[0]
+        return _bgzf_block_size(fileobj.read(xlen)) is not None
+
+def read_bgzf_block(fileobj):
+    """Read the next block from a BGZF file.
+    
+    Args:
+        fileobj: A binary file-like object.
+    
+    Returns:
+        The compressed block (bytes), or b'' at the end of the file.
+    
+    Raises:
+        EOFError if the file is truncated or does not contain BGZF blocks.
+    """
+    header = fileobj.read(12)
+    if not header:
+        return b''
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise EOFError("Invalid BGZF block header")
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = fileobj.read(xlen)
+    block_size = _bgzf_block_size(extra)
+    if block_size is None:
+        raise EOFError("Missing BGZF block size")
+    data = fileobj.read(block_size - 12 - xlen)
+    if len(data) < block_size - 12 - xlen:
+        raise EOFError("Truncated BGZF block")
+    return b''.join((header, extra, data))
+
+def iter_bgzf_blocks(fileobj):
+    """Iterate over the compressed blocks in a BGZF file.
+    """
+    return iter(lambda: read_bgzf_block(fileobj), b'')
+
+def bgzf_uncompressed_size(block):
+    """Returns the uncompressed size of a BGZF block (from the ISIZE field).
+    """
+    return struct.unpack('<I', block[-4:])[0]
+
+def decompress_bgzf_blocks(blocks):
+    """Decompress a sequence of BGZF blocks and concatenate the results.
+    Releases the GIL while decompressing.
+    """
+    return b''.join(zlib.decompress(block, 31) for block in blocks)
+
+def compress_bgzf_block(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """Compress data into a single BGZF block.
+    
+    Args:
+        data: At most `BGZF_BLOCK_DATA_SIZE` bytes.
+        level: The compression level.
+    """
+    if len(data) > BGZF_BLOCK_DATA_SIZE:
+        raise ValueError("Too much data for a BGZF block")
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    # ID1, ID2, CM, FLG, MTIME, XFL, OS, XLEN, SI1, SI2, SLEN, BSIZE
+    header = struct.pack(
+        '<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2,
+        len(cdata) + 25)
+    trailer = struct.pack('<2I', zlib.crc32(data), len(data))
+    return b''.join((header, cdata, trailer))
+
+BGZF_EOF = compress_bgzf_block(b'')
+"""The empty block that marks the end of a BGZF file."""
+
+def compress_bgzf(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """Compress data into a sequence of BGZF blocks (without the EOF marker
+    block). Used for compressing batches of output in worker processes; the
+    EOF marker is written when the file is closed (see :class:`BgzfWriter`).
+    """
+    view = memoryview(data).cast('B')
+    return b''.join(
+        compress_bgzf_block(view[i:i + BGZF_BLOCK_DATA_SIZE], level)
+        for i in range(0, len(view), BGZF_BLOCK_DATA_SIZE))
+
+BGZF_INDEX_EXTENSION = '.gzi'
+"""Extension appended to the name of a BGZF file to get its index."""
+
+def write_bgzf_index(path, entries):
+    """Write a BGZF index in the format used by bgzip: the number of entries,
+    followed by the compressed and uncompressed offsets of each block except
+    the first (all little-endian unsigned 64-bit integers).
+    
+    Args:
+        path: The index file.
+        entries: List of (compressed offset, uncompressed offset) tuples.
+    """
+    with open(path, 'wb') as out:
+        out.write(struct.pack('<Q', len(entries)))
+        for entry in entries:
+            out.write(struct.pack('<QQ', *entry))
+
 def can_use_system_compression():
     """Whether the system gzip program is available.
     """
@@ -147,27 +819,100 @@ def get_compressor(filename):
         return COMPRESSORS[ext]
     return None
 
-def open_gzip_file(filename, mode, use_system=True):
+def get_gzip_compressor(threads=None):
+    """Select the system program to use for compressing gzip files.
+    
+    Args:
+        threads: Number of compression threads. If > 1, only pigz is
+            considered (so that the file can instead be compressed by a pool
+            of threads if pigz is not available). Otherwise, gzip is used.
+    
+    Returns:
+        The program name, or None if no program is available.
+    """
+    program = 'pigz' if threads and threads > 1 else 'gzip'
+    if get_program_path(program) is not None:
+        return program
+    return None
+
+def get_gzip_decompressor(threads=None):
+    """Select the system program to use for decompressing gzip files.
+    
+    Args:
+        threads: Number of decompression threads. If None, only the gzip
+            program is considered. Otherwise, pigz (if `threads` > 1) and
+            igzip are preferred to gzip.
+    
+    Returns:
+        The program name, or None if no program is available.
+    """
+    if threads is None:
+        programs = ('gzip',)
+    elif threads > 1:
+        programs = GZIP_DECOMPRESSORS
+    else:
+        programs = GZIP_DECOMPRESSORS[1:]
+    for program in programs:
+        if get_program_path(program) is not None:
+            return program
+    return None
+
+def open_gzip_file(
+        filename, mode, use_system=True, threads=None, level=None):
     """Open a gzip file, preferring the system gzip program if `use_system`
     is True, falling back to the gzip python library.
     
     Args:
         mode: The file open mode.
         use_system: Whether to try to use the system gzip program.
+        threads: Number of threads to use for decompression or compression
+            (0 = use all available). If None, the system gzip program is
+            used. Otherwise, for reading, the fastest available program (pigz,
+            igzip, gzip) is used, and if none are available (or `use_system`
+            is False) the file is decompressed using zlib in a background
+            thread. BGZF files are decompressed using a pool of `threads`
+            threads. For writing with `threads` > 1, pigz is used if it is
+            available (and `use_system` is True), otherwise the file is
+            compressed using a pool of `threads` zlib threads.
+        level: The compression level (defaults to
+            `DEFAULT_COMPRESSION_LEVEL`), or an :class:`AutoCompressionLevel`,
+            in which case the file is always compressed using zlib (see
+            :class:`ThreadedGzipWriter`), since the level of a system program
+            cannot be adjusted.
     """
-    if use_system:
+    if threads is not None and threads <= 0:
+        threads = cpu_count()
+    gzfile = None
+    if 'r' in mode and threads and threads > 1 and is_bgzf(filename):
+        gzfile = BgzfReader(filename, threads)
+    elif 'w' in mode and isinstance(level, AutoCompressionLevel):
+        gzfile = ThreadedGzipWriter(filename, threads or 1, level=level)
+    elif use_system:
         try:
             if 'r' in mode:
-                gzfile = GzipReader(filename)
+                program = get_gzip_decompressor(threads)
+                if program is not None:
+                    gzfile = GzipReader(filename, program, threads)
             else:
-                gzfile = GzipWriter(filename)
-            if 't' in mode:
-                gzfile = io.TextIOWrapper(gzfile)
-            return gzfile
+                program = get_gzip_compressor(threads)
+                if program is not None:
+                    gzfile = GzipWriter(
+                        filename, program=program, threads=threads,
+                        level=level)
         except:
             pass
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVEL
+    if gzfile is None and 'r' in mode and threads is not None:
+        gzfile = ThreadedGzipReader(filename)
+    elif gzfile is None and 'w' in mode and threads and threads > 1:
+        gzfile = ThreadedGzipWriter(filename, threads, level=level)
+    if gzfile is not None:
+        if 't' in mode:
+            gzfile = io.TextIOWrapper(gzfile)
+        return gzfile
     
-    gzfile = gzip.open(filename, mode)
+    gzfile = gzip.open(filename, mode, compresslevel=level)
     if 'b' in mode:
         if 'r' in mode:
             gzfile = io.BufferedReader(gzfile)
@@ -175,23 +920,82 @@ def open_gzip_file(filename, mode, use_system=True):
             gzfile = io.BufferedWriter(gzfile)
     return gzfile
 
-def open_bzip_file(filename, mode, **kwargs):
+def open_bzip_file(filename, mode, level=None, **kwargs):
     """Open a bzip file.
+    
+    Args:
+        level: The compression level. If None (or an
+            :class:`AutoCompressionLevel`), the default level (9) is used.
     """
+    if level is None or isinstance(level, AutoCompressionLevel):
+        level = 9
     if 't' in mode:
-        return io.TextIOWrapper(bz2.BZ2File(filename, mode[0]))
+        return io.TextIOWrapper(
+            bz2.BZ2File(filename, mode[0], compresslevel=level))
     else:
-        return bz2.BZ2File(filename, mode)
+        return bz2.BZ2File(filename, mode, compresslevel=level)
 
-def open_lzma_file(filename, mode, **kwargs):
+def open_lzma_file(filename, mode, level=None, **kwargs):
     """Open a LZMA (xz) file.
+    
+    Args:
+        level: The compression preset. If None (or an
+            :class:`AutoCompressionLevel`), the default preset (6) is used.
     """
-    return lzma.open(filename, mode)
+    if 'r' in mode or isinstance(level, AutoCompressionLevel):
+        level = None
+    return lzma.open(filename, mode, preset=level)
+
+def open_zstd_file(
+        filename, mode, use_system=True, threads=None, level=None):
+    """Open a Zstandard file, preferring the system zstd program if
+    `use_system` is True, falling back to the zstandard python package.
+    
+    Args:
+        mode: The file open mode.
+        use_system: Whether to try to use the system zstd program.
+        threads: Number of worker threads to use for compression (0 = use all
+            available).
+        level: The compression level. If None (or an
+            :class:`AutoCompressionLevel`), `ZSTD_DEFAULT_LEVEL` is used.
+    
+    Raises:
+        IOError if neither the zstd program nor the zstandard package is
+        available.
+    """
+    if threads is not None and threads <= 0:
+        threads = cpu_count()
+    if level is None or isinstance(level, AutoCompressionLevel):
+        level = ZSTD_DEFAULT_LEVEL
+    if (use_system or zstandard is None) and get_program_path('zstd'):
+        if 'r' in mode:
+            zfile = GzipReader(filename, 'zstd')
+        else:
+            zfile = GzipWriter(
+                filename, 'a' if 'a' in mode else 'w', program='zstd',
+                threads=threads, level=level)
+        if 't' in mode:
+            zfile = io.TextIOWrapper(zfile)
+        return zfile
+    if zstandard is None:
+        raise IOError(
+            "Reading or writing Zstandard files requires the zstd program or "
+            "the zstandard python package")
+    if 'r' in mode:
+        zfile = io.BufferedReader(zstandard.open(filename, 'rb'))
+    else:
+        zfile = zstandard.open(
+            filename, mode[0] + 'b', cctx=zstandard.ZstdCompressor(
+                level=level, threads=threads or 0))
+    if 't' in mode:
+        zfile = io.TextIOWrapper(zfile)
+    return zfile
 
 FILE_OPENERS = {
     ".gz"  : open_gzip_file,
     ".bz2" : open_bzip_file,
     ".xz"  : open_lzma_file,
+    ".zst" : open_zstd_file,
 }
 """Mapping of file extensions to file opener functions."""
 
@@ -236,6 +1040,8 @@ def get_program_path(program):
             exe_file = os.path.join(path, program)
             if is_exe(exe_file):
                 break
+        else:
+            exe_file = None
     
     PROGRAM_CACHE[program] = exe_file
     return exe_file
@@ -0,0 +1,398 @@
+"""Sidecar index files for FASTQ files.
+
+An index (stored next to the FASTQ file with a '.fqi' extension) records the
+offset of every Nth record. For uncompressed files these are byte offsets;
+for BGZF-compressed files they are virtual offsets (the offset of the
+compressed block shifted left by 16 bits, plus the offset within the
+uncompressed block). Using an index, any range of records can be read
+without reading the preceding records, which allows worker processes to read
+their own batches directly from the input files. The index also stores the
+total number of records.
+"""
+from array import array
+from bisect import bisect_right
+import gzip
+from io import BytesIO
+import logging
+import os
+import struct
+import sys
+from atropos.io.compression import (
+    bgzf_uncompressed_size, decompress_bgzf_blocks, is_bgzf, read_bgzf_block)
+from atropos.io.seqio import (
+    DEFAULT_BUFFER_SIZE, ColorspaceFastqReader, FastqChunker, FastqReader,
+    FormatError, InterleavedSequenceReader, PairedSequenceReader, RawBatch)
+
+INDEX_EXTENSION = '.fqi'
+"""Extension appended to the name of an indexed file."""
+
+DEFAULT_INDEX_INTERVAL = 1000
+"""Default number of records between indexed offsets."""
+
+INDEX_MAGIC = b'FQI\x01'
+INDEX_HEADER = struct.Struct('<4s?3xQQQqQ')
+"""Index file header: magic, whether the file is BGZF-compressed, interval,
+number of records, size and modification time (ns) of the indexed file, and
+number of offsets. The header is followed by the offsets (little-endian
+unsigned 64-bit integers)."""
+
+def get_index_path(path):
+    """Returns the path of the index file for `path`.
+    """
+    return path + INDEX_EXTENSION
+
+class FastqIndex(object):
+    """Index of the record offsets in a FASTQ file.
+    
+    Args:
+        path: The indexed file.
+        interval: Number of records between offsets.
+        num_records: Total number of records in the file.
+        offsets: The offset of every `interval`th record, starting with the
+            first, followed by the offset of the end of the last record.
+        bgzf: Whether the file is BGZF-compressed, in which case the offsets
+            are virtual offsets.
+        file_size, file_mtime: Size and modification time (ns) of the file
+            when it was indexed.
+    """
+    def __init__(
+            self, path, interval, num_records, offsets, bgzf=False,
+            file_size=None, file_mtime=None):
+        self.path = path
+        self.interval = interval
+        self.num_records = num_records
+        self.offsets = offsets
+        self.bgzf = bgzf
+        if file_size is None or file_mtime is None:
+            stat = os.stat(path)
+            file_size, file_mtime = stat.st_size, stat.st_mtime_ns
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+    
+    @classmethod
+    def build(
+            cls, path, interval=DEFAULT_INDEX_INTERVAL,
+            buffer_size=DEFAULT_BUFFER_SIZE):
+        """Index a FASTQ file.
+        
+        Args:
+            path: Path to an uncompressed or BGZF-compressed FASTQ file.
+            interval: Number of records between offsets.
+            buffer_size: Number of bytes to read at a time.
+        
+        Returns:
+            A FastqIndex.
+        
+        Raises:
+            ValueError if the file is compressed but not BGZF-compressed.
+        """
+        stat = os.stat(path)
+        bgzf = is_bgzf(path)
+        if bgzf:
+            fileobj = gzip.open(path, 'rb')
+        elif path.endswith(('.gz', '.bz2', '.xz', '.zst')):
+            raise ValueError(
+                "Compressed files must be BGZF-compressed (e.g. using bgzip) "
+                "to be indexed: {}".format(path))
+        else:
+            fileobj = open(path, 'rb')
+        
+        offsets = array('Q')
+        num_records = 0
+        pos = 0
+        with fileobj:
+            chunker = FastqChunker(fileobj, buffer_size)
+            while True:
+                chunk, size = chunker.read_chunk(interval)
+                if size == 0:
+                    break
+                offsets.append(pos)
+                pos += len(chunk)
+                num_records += size
+        offsets.append(pos)
+        
+        if bgzf:
+            offsets = _to_virtual_offsets(path, offsets)
+        
+        return cls(
+            path, interval, num_records, offsets, bgzf, stat.st_size,
+            stat.st_mtime_ns)
+    
+    @classmethod
+    def load(cls, path, index_path=None):
+        """Load the index of a file.
+        
+        Args:
+            path: The indexed file.
+            index_path: The index file. Defaults to `path` + '.fqi'.
+        
+        Raises:
+            FormatError if `index_path` is not an index file.
+        """
+        if index_path is None:
+            index_path = get_index_path(path)
+        with open(index_path, 'rb') as inp:
+            header = inp.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size or not header.startswith(
+                    INDEX_MAGIC):
+                raise FormatError(
+                    "{} is not a FASTQ index file".format(index_path))
+            (_, bgzf, interval, num_records, file_size, file_mtime,
+             num_offsets) = INDEX_HEADER.unpack(header)
+            offsets = array('Q')
+            offsets.frombytes(inp.read(num_offsets * offsets.itemsize))
+        if len(offsets) != num_offsets:
+            raise FormatError("Index file {} is truncated".format(index_path))
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        return cls(
+            path, interval, num_records, offsets, bgzf, file_size, file_mtime)
+    
+    def save(self, index_path=None):
+        """Write the index to a file.
+        
+        Args:
+            index_path: The index file. Defaults to `path` + '.fqi'.
+        """
+        if index_path is None:
+            index_path = get_index_path(self.path)
+        offsets = self.offsets
+        if sys.byteorder == 'big':
+            offsets = array('Q', offsets)
+            offsets.byteswap()
+        with open(index_path, 'wb') as out:
+            out.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, self.bgzf, self.interval, self.num_records,
+                self.file_size, self.file_mtime, len(offsets)))
+            out.write(offsets.tobytes())
+    
+    def is_current(self):
+        """Whether the indexed file is unchanged since it was indexed.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (
+            stat.st_size == self.file_size and
+            stat.st_mtime_ns == self.file_mtime)
+    
+    def get_range(self, start, count):
+        """Locate a range of records.
+        
+        Args:
+            start: Index of the first record.
+            count: Number of records.
+        
+        Returns:
+            A tuple of arguments to `read_index_range`: (path, bgzf, start
+            offset, end offset, number of records to skip from the start
+            offset, `count`).
+        """
+        if start < 0 or count < 0 or start + count > self.num_records:
+            raise IndexError(
+                "Records {}-{} are out of range".format(start, start + count))
+        first = start // self.interval
+        last = min(
+            -(-(start + count) // self.interval), len(self.offsets) - 1)
+        return (
+            self.path, self.bgzf, self.offsets[first], self.offsets[last],
+            start - first * self.interval, count)
+    
+    def read_records(self, start, count):
+        """Read a range of raw records.
+        
+        Returns:
+            The records (bytes).
+        """
+        return read_index_range(*self.get_range(start, count))
+
+def _to_virtual_offsets(path, offsets):
+    """Convert offsets in the uncompressed data of a BGZF file to virtual
+    offsets.
+    """
+    block_offsets = []
+    block_starts = []
+    pos = upos = 0
+    with open(path, 'rb') as inp:
+        while True:
+            block = read_bgzf_block(inp)
+            if not block:
+                break
+            size = bgzf_uncompressed_size(block)
+            if size > 0:
+                block_offsets.append(pos)
+                block_starts.append(upos)
+            pos += len(block)
+            upos += size
+    # The end of the data is at the start of the (empty) EOF block
+    block_offsets.append(pos)
+    block_starts.append(upos)
+    virtual_offsets = array('Q')
+    for offset in offsets:
+        idx = bisect_right(block_starts, offset) - 1
+        virtual_offsets.append(
+            (block_offsets[idx] << 16) | (offset - block_starts[idx]))
+    return virtual_offsets
+
+def read_index_range(path, bgzf, start, end, skip, count):
+    """Read a range of records located using an index.
+    
+    Args:
+        path: The indexed file.
+        bgzf: Whether `start` and `end` are BGZF virtual offsets.
+        start, end: Offsets of the region that contains the records.
+        skip: Number of records to skip from the start of the region.
+        count: Number of records to read.
+    
+    Returns:
+        The raw records (bytes).
+    """
+    with open(path, 'rb') as inp:
+        if bgzf:
+            inp.seek(start >> 16)
+            end_block = end >> 16
+            blocks = []
+            pos = start >> 16
+            upos = 0
+            end_pos = None
+            while pos <= end_block:
+                if pos == end_block:
+                    end_pos = upos
+                    if not end & 0xFFFF:
+                        break
+                block = read_bgzf_block(inp)
+                if not block:
+                    raise FormatError(
+                        "Unexpected end of file {} at offset {}; the index "
+                        "may be out of date".format(path, pos))
+                blocks.append(block)
+                pos += len(block)
+                upos += bgzf_uncompressed_size(block)
+            if end_pos is None:
+                # A block boundary did not fall at the end offset
+                raise FormatError(
+                    "Offset {} is not at the start of a block in {}; the "
+                    "index may be out of date".format(end_block, path))
+            data = decompress_bgzf_blocks(blocks)
+            data = data[start & 0xFFFF:end_pos + (end & 0xFFFF)]
+        else:
+            inp.seek(start)
+            data = inp.read(end - start)
+    chunker = FastqChunker(BytesIO(data), max(len(data), 1))
+    if skip:
+        chunker.read_chunk(skip)
+    chunk, size = chunker.read_chunk(count)
+    if size != count:
+        raise FormatError(
+            "Expected {} records at offset {} of {} but found {}; the index "
+            "may be out of date".format(count, start, path, size))
+    return chunk
+
+class IndexedBatch(object):
+    """A batch of records that is read from the input file(s) when it is
+    iterated, which allows worker processes to read their batches directly.
+    
+    Args:
+        ranges: For each input file, a tuple of arguments to
+            `read_index_range`.
+        size: The number of records (or read pairs) in the batch.
+        reader_args: Keyword arguments to `open_reader`.
+    """
+    def __init__(self, ranges, size, reader_args):
+        self.ranges = ranges
+        self.size = size
+        self.reader_args = reader_args
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+        chunks = tuple(read_index_range(*rng) for rng in self.ranges)
+        return iter(RawBatch(chunks, self.size, self.reader_args))
+
+class IndexedChunkReader(object):
+    """Reads batches of records using the indexes of the input files. Only the
+    locations of the records are read; the records themselves are read when
+    the batch is iterated.
+    
+    Args:
+        indexes: One or two FastqIndexes.
+        interleaved: Whether `indexes` is the index of a single interleaved
+            file.
+        reader_args: Keyword arguments to `open_reader`, used to parse the
+            batches.
+    """
+    def __init__(self, indexes, interleaved=False, **reader_args):
+        num_records = set(index.num_records for index in indexes)
+        if len(num_records) > 1:
+            raise FormatError(
+                "Reads are improperly paired. The input files have different "
+                "numbers of records.")
+        if interleaved and num_records and min(num_records) % 2:
+            raise FormatError(
+                "Interleaved input file has an odd number of records.")
+        self.indexes = indexes
+        self.records_per_item = 2 if interleaved else 1
+        self.num_records = num_records.pop() // self.records_per_item
+        self.reader_args = dict(reader_args, interleaved=interleaved)
+        self.read_count = 0
+    
+    def read_batch(self, size):
+        """Locate the next `size` records.
+        
+        Returns:
+            An :class:`IndexedBatch`, or an empty list if there are no more
+            records.
+        """
+        size = min(size, self.num_records - self.read_count)
+        if size <= 0:
+            return []
+        ranges = tuple(
+            index.get_range(
+                self.read_count * self.records_per_item,
+                size * self.records_per_item)
+            for index in self.indexes)
+        self.read_count += size
+        return IndexedBatch(ranges, size, self.reader_args)
+
+def open_index_reader(reader):
+    """Create an :class:`IndexedChunkReader` for the files underlying a
+    reader, if all of the files have a current index.
+    
+    Args:
+        reader: A reader returned by `open_reader`.
+    
+    Returns:
+        An IndexedChunkReader, or None if any of the files is not indexed, or
+        if an index is out of date or invalid.
+    """
+    interleaved = False
+    if isinstance(reader, PairedSequenceReader):
+        readers = (reader.reader1, reader.reader2)
+    elif isinstance(reader, InterleavedSequenceReader):
+        readers = (reader.reader,)
+        interleaved = True
+    else:
+        readers = (reader,)
+    indexes = []
+    try:
+        for rdr in readers:
+            if not (
+                    type(rdr) in (FastqReader, ColorspaceFastqReader) and
+                    isinstance(rdr.name, str) and
+                    os.path.exists(get_index_path(rdr.name))):
+                return None
+            index = FastqIndex.load(rdr.name)
+            if not index.is_current():
+                return None
+            indexes.append(index)
+        return IndexedChunkReader(
+            indexes, interleaved=interleaved,
+            quality_base=readers[0].quality_base,
+            colorspace=readers[0].colorspace,
+            alphabet=readers[0].alphabet)
+    except FormatError as err:
+        logging.getLogger().warning(
+            "Ignoring index of input file(s): %s", err)
+        return None
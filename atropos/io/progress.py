@@ -38,7 +38,7 @@ class ProgressMessageReader(object):
     def __next__(self):
         value = next(self.iterable)
         if value:
-            self.ctr += value[0]
+            self.ctr += value[0]["size"]
             if self.ctr % self.interval < self.batch_size:
                 duration = Timestamp() - self.start
                 ctr = self.ctr
@@ -5,10 +5,18 @@ TODO
 - Sequence.name should be Sequence.description or so (reserve .name for the part
   before the first space)
 """
+from collections import deque
+import gzip
+from io import BytesIO
+from itertools import islice
+import mmap
+import os
 import sys
 from atropos import AtroposError
 from atropos.io import STDOUT, xopen
-from atropos.io.compression import splitext_compressed
+from atropos.io.compression import (
+    bgzf_uncompressed_size, decompress_bgzf_blocks, get_file_opener, is_bgzf,
+    read_bgzf_block, splitext_compressed)
 from atropos.util import Summarizable, truncate_string, ALPHABETS
 
 READ1 = 1
@@ -36,7 +44,49 @@ class SequenceReaderBase(Summarizable): # pylint: disable=no-member
     - quality_base: int
     - colorspace: bool
     - interleaved: bool
+    
+    Records can be read one at a time by iterating over the reader, or in
+    batches using `read_batch` or `iter_batches`.
     """
+    _read_batch = None
+    
+    def read_batch(self, size):
+        """Read the next `size` records. All calls to `read_batch` share a
+        single iterator over the reader, so it should not be combined with
+        iterating over the reader directly.
+        
+        Args:
+            size: The maximum number of records to read.
+        
+        Returns:
+            A list of records. The list is shorter than `size` only if the end
+            of the input has been reached.
+        """
+        if self._read_batch is None:
+            itr = iter(self)
+            if hasattr(itr, 'read_batch'):
+                # The iterator supports reading batches natively.
+                self._read_batch = itr.read_batch
+            else:
+                self._read_batch = lambda size: list(islice(itr, size))
+        return self._read_batch(size)
+    
+    def iter_batches(self, size):
+        """Iterate over batches of records.
+        
+        Args:
+            size: The number of records in each batch.
+        
+        Yields:
+            Lists of `size` records; the final list may be shorter.
+        """
+        while True:
+            batch = self.read_batch(size)
+            if batch:
+                yield batch
+            if len(batch) < size:
+                break
+    
     def summarize(self):
         return dict(
             input_names=self.input_names,
@@ -53,11 +103,13 @@ class SequenceReader(SequenceReaderBase):
     
     Args:
         file is a path or a file-like object. In both cases, the file may
-            be compressed (.gz, .bz2, .xz).
+            be compressed (.gz, .bz2, .xz, .zst).
         mode: The file open mode.
         quality_base: The minimum quality value.
         alphabet: The alphabet to use to validate sequences. If None, no
             validation is done.
+        decompression_threads: Number of threads to use for decompressing
+            gzip files.
     """
     delivers_qualities = False
     has_qualfile = False
@@ -66,12 +118,15 @@ class SequenceReader(SequenceReaderBase):
     input_read = SINGLE
     _close_on_exit = False
     
-    def __init__(self, path, mode='r', quality_base=None, alphabet=None):
+    def __init__(
+            self, path, mode='r', quality_base=None, alphabet=None,
+            decompression_threads=None):
         self.quality_base = quality_base
         self.alphabet = alphabet
         if isinstance(path, str):
             self.name = path
-            self._file = xopen(path, mode)
+            self._file = xopen(
+                path, mode, decompression_threads=decompression_threads)
             self._close_on_exit = True
         else:
             if hasattr(path, 'name'):
@@ -100,8 +155,90 @@ class SequenceReader(SequenceReaderBase):
     def __exit__(self, *args):
         self.close()
 
+_MAPPED_FILES = {}
+"""Memory maps of input files, keyed by path. Each value is a tuple (mmap, size,
+modification time). Forked worker processes inherit the maps of the parent
+process."""
+
+def can_mmap(path):
+    """Whether `path` can be memory-mapped, i.e. whether it is a non-empty,
+    uncompressed regular file. Pipes, standard input and compressed files
+    cannot be memory-mapped.
+    """
+    return (
+        isinstance(path, str) and path != STDOUT and
+        get_file_opener(path) is None and os.path.isfile(path) and
+        os.path.getsize(path) > 0)
+
+def map_file(path):
+    """Returns a read-only memory map of `path`. Maps are shared by all
+    regions of a file in the same process, and are re-created if the file has
+    changed.
+    """
+    stat = os.stat(path)
+    if path in _MAPPED_FILES:
+        mapped, size, mtime = _MAPPED_FILES[path]
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            return mapped
+    with open(path, 'rb') as fileobj:
+        mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    _MAPPED_FILES[path] = (mapped, stat.st_size, stat.st_mtime_ns)
+    return mapped
+
+def unmap_file(path):
+    """Remove the memory map of `path`. The file is unmapped once all readers
+    that are parsing records from the map are released.
+    """
+    _MAPPED_FILES.pop(path, None)
+
+class MmapRegion(object):
+    """A region of a memory-mapped file. Only the path and the location of the
+    region are pickled, so regions can be sent to worker processes, which parse
+    records directly from the map inherited from the main process (or create
+    their own map if the process was not forked).
+    
+    Args:
+        path: The mapped file.
+        offset: The start of the region.
+        length: The size of the region. Defaults to the rest of the file.
+    """
+    def __init__(self, path, offset=0, length=None):
+        self.name = self.path = path
+        self.offset = offset
+        if length is None:
+            length = len(self.buffer) - offset
+        self.length = length
+    
+    @property
+    def end(self):
+        """The end of the region.
+        """
+        return self.offset + self.length
+    
+    @property
+    def buffer(self):
+        """The memory map of the file.
+        """
+        return map_file(self.path)
+    
+    def close(self):
+        """Close the region, removing the memory map of the file.
+        """
+        unmap_file(self.path)
+    
+    def __reduce__(self):
+        return (MmapRegion, (self.path, self.offset, self.length))
+    
+    def __repr__(self):
+        return "MmapRegion({!r}, {}, {})".format(
+            self.path, self.offset, self.length)
+
 try:
-    from ._seqio import Sequence, FastqReader
+    from ._seqio import (
+        Sequence, FastqReader, FastqChunker, DEFAULT_BUFFER_SIZE,
+        find_records, format_records)
 except ImportError:
     pass
 
@@ -235,7 +372,7 @@ class FastaReader(SequenceReader):
     
     Args:
         path: A path or a file-like object. In both cases, the file may
-            be compressed (.gz, .bz2, .xz).
+            be compressed (.gz, .bz2, .xz, .zst).
         keep_linebreaks: Whether to keep newline characters in the sequence.
         sequence_class: The class to use when creating new sequence objects.
     """
@@ -243,8 +380,10 @@ class FastaReader(SequenceReader):
     
     def __init__(
             self, path, keep_linebreaks=False, sequence_class=Sequence,
-            alphabet=None):
-        super().__init__(path, alphabet=alphabet)
+            alphabet=None, decompression_threads=None):
+        super().__init__(
+            path, alphabet=alphabet,
+            decompression_threads=decompression_threads)
         self.sequence_class = sequence_class
         self._delimiter = '\n' if keep_linebreaks else ''
     
@@ -288,31 +427,38 @@ class ColorspaceFastaReader(FastaReader):
     """
     colorspace = True
     
-    def __init__(self, path, keep_linebreaks=False, alphabet=None):
+    def __init__(
+            self, path, keep_linebreaks=False, alphabet=None,
+            decompression_threads=None):
         super().__init__(
             path, keep_linebreaks, sequence_class=ColorspaceSequence,
-            alphabet=alphabet)
+            alphabet=alphabet, decompression_threads=decompression_threads)
 
 class ColorspaceFastqReader(FastqReader):
     """Reads colorspace sequences from a FASTQ.
     """
     colorspace = True
     
-    def __init__(self, path, quality_base=33, alphabet=None):
+    def __init__(
+            self, path, quality_base=33, alphabet=None,
+            decompression_threads=None, use_mmap=False):
         super().__init__(
             path, quality_base=quality_base, sequence_class=ColorspaceSequence,
-            alphabet=alphabet)
+            alphabet=alphabet, decompression_threads=decompression_threads,
+            use_mmap=use_mmap)
 
 class SRAColorspaceFastqReader(FastqReader):
     """Reads SRA-formatted colorspace sequences from a FASTQ.
     """
     colorspace = True
     
-    def __init__(self, path, quality_base=33, alphabet=None):
+    def __init__(
+            self, path, quality_base=33, alphabet=None,
+            decompression_threads=None):
         super().__init__(
             path, quality_base=quality_base,
             sequence_class=sra_colorspace_sequence,
-            alphabet=alphabet)
+            alphabet=alphabet, decompression_threads=decompression_threads)
 
 class FastaQualReader(SequenceReaderBase):
     """Reader for reads that are stored in .(CS)FASTA and .QUAL files.
@@ -331,9 +477,13 @@ class FastaQualReader(SequenceReaderBase):
     
     def __init__(
             self, fastafile, qualfile, quality_base=33,
-            sequence_class=Sequence, alphabet=None):
-        self.fastareader = FastaReader(fastafile)
-        self.qualreader = FastaReader(qualfile, keep_linebreaks=True)
+            sequence_class=Sequence, alphabet=None,
+            decompression_threads=None):
+        self.fastareader = FastaReader(
+            fastafile, decompression_threads=decompression_threads)
+        self.qualreader = FastaReader(
+            qualfile, keep_linebreaks=True,
+            decompression_threads=decompression_threads)
         self.quality_base = quality_base
         self.sequence_class = sequence_class
         self.alphabet = alphabet
@@ -389,10 +539,13 @@ class ColorspaceFastaQualReader(FastaQualReader):
     """
     colorspace = True
     
-    def __init__(self, fastafile, qualfile, quality_base=33, alphabet=None):
+    def __init__(
+            self, fastafile, qualfile, quality_base=33, alphabet=None,
+            decompression_threads=None):
         super().__init__(
             fastafile, qualfile, quality_base=quality_base,
-            sequence_class=ColorspaceSequence, alphabet=alphabet)
+            sequence_class=ColorspaceSequence, alphabet=alphabet,
+            decompression_threads=decompression_threads)
 
 class PairedSequenceReader(SequenceReaderBase):
     """Read paired-end reads from two files. Wraps two SequenceReader
@@ -402,19 +555,23 @@ class PairedSequenceReader(SequenceReaderBase):
         file1, file2: The pair of files.
         colorspace: Whether the sequences are in colorspace.
         file_format: A file_format instance.
+        use_mmap: Whether to memory-map uncompressed FASTQ files.
     """
     input_read = PAIRED
     interleaved = False
     
     def __init__(
             self, file1, file2, quality_base=33, colorspace=False,
-            file_format=None, alphabet=None):
+            file_format=None, alphabet=None, decompression_threads=None,
+            use_mmap=False):
         self.reader1 = open_reader(
             file1, colorspace=colorspace, quality_base=quality_base,
-            file_format=file_format, alphabet=alphabet)
+            file_format=file_format, alphabet=alphabet,
+            decompression_threads=decompression_threads, use_mmap=use_mmap)
         self.reader2 = open_reader(
             file2, colorspace=colorspace, quality_base=quality_base,
-            file_format=file_format, alphabet=alphabet)
+            file_format=file_format, alphabet=alphabet,
+            decompression_threads=decompression_threads, use_mmap=use_mmap)
     
     @property
     def input_names(self):
@@ -457,6 +614,26 @@ class PairedSequenceReader(SequenceReaderBase):
                         read1.name, read2.name))
             yield (read1, read2)
     
+    def read_batch(self, size):
+        batch1 = self.reader1.read_batch(size)
+        batch2 = self.reader2.read_batch(len(batch1))
+        if len(batch2) < len(batch1):
+            raise FormatError(
+                "Reads are improperly paired. There are more reads in "
+                "file 1 than in file 2.")
+        if len(batch1) < size and self.reader2.read_batch(1):
+            raise FormatError(
+                "Reads are improperly paired. There are more reads in "
+                "file 2 than in file 1.")
+        batch = list(zip(batch1, batch2))
+        for read1, read2 in batch:
+            if not sequence_names_match(read1, read2):
+                raise FormatError(
+                    "Reads are improperly paired. Read name '{0}' in file 1 "
+                    "does not match '{1}' in file 2.".format(
+                        read1.name, read2.name))
+        return batch
+    
     def close(self):
         """Close the underlying files.
         """
@@ -476,16 +653,18 @@ class InterleavedSequenceReader(SequenceReaderBase):
         path: The interleaved FASTQ file.
         colorspace: Whether the sequences are in colorspace.
         file_format: A file_format instance.
+        use_mmap: Whether to memory-map the file if it is uncompressed.
     """
     input_read = PAIRED
     interleaved = True
     
     def __init__(
             self, path, quality_base=33, colorspace=False, file_format=None,
-            alphabet=None):
+            alphabet=None, decompression_threads=None, use_mmap=False):
         self.reader = open_reader(
             path, quality_base=quality_base, colorspace=colorspace,
-            file_format=file_format, alphabet=alphabet)
+            file_format=file_format, alphabet=alphabet,
+            decompression_threads=decompression_threads, use_mmap=use_mmap)
     
     def __getattr__(self, name):
         return getattr(self.reader, name)
@@ -506,6 +685,20 @@ class InterleavedSequenceReader(SequenceReaderBase):
                     "match {1!r} (second).".format(read1.name, read2.name))
             yield (read1, read2)
     
+    def read_batch(self, size):
+        records = self.reader.read_batch(2 * size)
+        if len(records) % 2 != 0:
+            raise FormatError(
+                "Interleaved input file incomplete: Last record has no "
+                "partner.")
+        batch = list(zip(records[0::2], records[1::2]))
+        for read1, read2 in batch:
+            if not sequence_names_match(read1, read2):
+                raise FormatError(
+                    "Reads are improperly paired. Name {0!r} (first) does not "
+                    "match {1!r} (second).".format(read1.name, read2.name))
+        return batch
+    
     def close(self):
         """Close the underlying reader.
         """
@@ -517,6 +710,309 @@ class InterleavedSequenceReader(SequenceReaderBase):
     def __exit__(self, *args):
         self.close()
 
+class RawBatch(object):
+    """A batch of raw (unparsed) FASTQ records. The records are parsed when
+    the batch is iterated, which allows parsing to be deferred to worker
+    processes.
+    
+    Args:
+        chunks: Tuple of bytes (the raw data) or :class:`MmapRegion`s (the
+            location of the data in a memory-mapped file), one for each input
+            file.
+        size: The number of records (or read pairs) in the batch.
+        reader_args: Keyword arguments to `open_reader`.
+    """
+    def __init__(self, chunks, size, reader_args):
+        self.chunks = chunks
+        self.size = size
+        self.reader_args = reader_args
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+        reader = open_reader(
+            *(
+                chunk if isinstance(chunk, MmapRegion) else BytesIO(chunk)
+                for chunk in self.chunks),
+            file_format='fastq', **self.reader_args)
+        with reader:
+            return iter(reader.read_batch(self.size))
+
+class FastqChunkReader(object):
+    """Reads batches of raw FASTQ records. Paired-end files are cut in
+    lockstep so that each batch contains the same number of records from
+    each file.
+    
+    Args:
+        files: One or two binary file-like objects.
+        interleaved: Whether `files` is a single interleaved file.
+        buffer_size: Number of bytes to read at a time.
+        reader_args: Keyword arguments to `open_reader`, used to parse the
+            batches.
+    """
+    def __init__(
+            self, files, interleaved=False, buffer_size=DEFAULT_BUFFER_SIZE,
+            **reader_args):
+        self.chunkers = [FastqChunker(fileobj, buffer_size) for fileobj in files]
+        self.lines_per_record = 8 if interleaved else 4
+        self.reader_args = dict(reader_args, interleaved=interleaved)
+    
+    def read_batch(self, size):
+        """Read the next `size` records.
+        
+        Returns:
+            A :class:`RawBatch`, or an empty list if there are no more records.
+        """
+        chunk1, size1 = self.chunkers[0].read_chunk(size, self.lines_per_record)
+        chunks = (chunk1,)
+        if len(self.chunkers) == 2:
+            chunk2, size2 = self.chunkers[1].read_chunk(size)
+            if size1 > size2:
+                raise FormatError(
+                    "Reads are improperly paired. There are more reads in "
+                    "file 1 than in file 2.")
+            elif size2 > size1:
+                raise FormatError(
+                    "Reads are improperly paired. There are more reads in "
+                    "file 2 than in file 1.")
+            chunks = (chunk1, chunk2)
+        if size1 == 0:
+            return []
+        return RawBatch(chunks, size1, self.reader_args)
+
+class MmapChunkReader(object):
+    """Reads batches of FASTQ records from memory-mapped files. The data is not
+    copied; each batch only contains the location of its records in each file,
+    and the records are parsed directly from the map when the batch is
+    iterated. Paired-end files are cut in lockstep.
+    
+    Args:
+        regions: One or two :class:`MmapRegion`s.
+        interleaved: Whether `regions` is a single interleaved file.
+        reader_args: Keyword arguments to `open_reader`, used to parse the
+            batches.
+    """
+    def __init__(self, regions, interleaved=False, **reader_args):
+        self.regions = regions
+        self.positions = [region.offset for region in regions]
+        self.lines_per_record = 8 if interleaved else 4
+        self.reader_args = dict(reader_args, interleaved=interleaved)
+    
+    def _find_records(self, idx, size, lines_per_record=4):
+        region = self.regions[idx]
+        start = self.positions[idx]
+        end, num_records = find_records(
+            region.buffer, start, region.end, size, lines_per_record)
+        self.positions[idx] = end
+        return MmapRegion(region.path, start, end - start), num_records
+    
+    def read_batch(self, size):
+        """Locate the next `size` records.
+        
+        Returns:
+            A :class:`RawBatch` of :class:`MmapRegion`s, or an empty list if
+            there are no more records.
+        """
+        region1, size1 = self._find_records(0, size, self.lines_per_record)
+        regions = (region1,)
+        if len(self.regions) == 2:
+            region2, size2 = self._find_records(1, size)
+            if size1 > size2:
+                raise FormatError(
+                    "Reads are improperly paired. There are more reads in "
+                    "file 1 than in file 2.")
+            elif size2 > size1:
+                raise FormatError(
+                    "Reads are improperly paired. There are more reads in "
+                    "file 2 than in file 1.")
+            regions = (region1, region2)
+        if size1 == 0:
+            return []
+        return RawBatch(regions, size1, self.reader_args)
+
+BGZF_LOOKAHEAD_SIZE = 65536
+"""Minimum number of uncompressed bytes following each batch of BGZF blocks
+that are sent along with the batch, so that the last record can be completed.
+"""
+
+def find_fastq_record(data, pos=0):
+    """Find the start of the first FASTQ record at or after `pos`.
+    
+    A line starting with '@' can be either a header line or a quality line. It
+    is a header line if the line after next starts with '+'; if it were a
+    quality line, the line after next would be a sequence line.
+    
+    Args:
+        data: FASTQ data (bytes).
+        pos: A position in `data` that is at the start of a line.
+    
+    Returns:
+        The position of the first record, or -1 if no record is found.
+    """
+    size = len(data)
+    while pos < size:
+        if data[pos] == 64:  # '@'
+            end = data.find(b'\n', pos)
+            if end >= 0:
+                end = data.find(b'\n', end + 1)
+            if end < 0 or end + 1 >= size:
+                return -1
+            if data[end + 1] == 43:  # '+'
+                return pos
+        end = data.find(b'\n', pos)
+        if end < 0:
+            return -1
+        pos = end + 1
+    return -1
+
+class BgzfRawBatch(object):
+    """A batch of BGZF blocks from a FASTQ file. The blocks are decompressed
+    and the records parsed when the batch is iterated, which allows
+    decompression to be deferred to worker processes. The number of records
+    is not known until then, so `size` is None.
+    
+    Block boundaries do not align with record boundaries, so each batch also
+    carries the blocks that follow it ("lookahead"). A batch yields the
+    records that start before the first line break at or after the end of its
+    own blocks; the next batch begins with the first record after that line
+    break.
+    
+    Args:
+        blocks: The compressed blocks of the batch (bytes).
+        lookahead: The compressed blocks that follow the batch (bytes).
+        first: Whether this is the first batch in the file.
+        at_eof: Whether `lookahead` extends to the end of the file.
+        reader_args: Keyword arguments to `open_reader`.
+    """
+    size = None
+    
+    def __init__(self, blocks, lookahead, first, at_eof, reader_args):
+        self.blocks = blocks
+        self.lookahead = lookahead
+        self.first = first
+        self.at_eof = at_eof
+        self.reader_args = reader_args
+    
+    def __iter__(self):
+        data = gzip.decompress(self.blocks)
+        body_size = len(data)
+        if self.lookahead:
+            data += gzip.decompress(self.lookahead)
+        
+        if self.first:
+            start = 0
+        else:
+            start = find_fastq_record(data, data.find(b'\n') + 1 or len(data))
+            if start < 0:
+                return iter(())
+        
+        if body_size == len(data):
+            end = body_size
+        else:
+            end = find_fastq_record(
+                data, data.find(b'\n', body_size) + 1 or len(data))
+            if end < 0:
+                if not self.at_eof:
+                    raise FormatError(
+                        "FASTQ record extends more than {} bytes past the end "
+                        "of a batch of BGZF blocks".format(
+                            len(data) - body_size))
+                end = len(data)
+        
+        if start >= end:
+            return iter(())
+        reader = open_reader(
+            BytesIO(data[start:end]), file_format='fastq', **self.reader_args)
+        with reader:
+            return iter(list(reader))
+
+class BgzfBlockReader(object):
+    """Reads batches of raw BGZF blocks from a single-end FASTQ file.
+    
+    Args:
+        path: The path of a BGZF-compressed FASTQ file.
+        lookahead_size: Minimum number of uncompressed bytes following each
+            batch to include with the batch.
+        reader_args: Keyword arguments to `open_reader`, used to parse the
+            batches.
+    """
+    def __init__(
+            self, path, lookahead_size=BGZF_LOOKAHEAD_SIZE, **reader_args):
+        self._file = open(path, 'rb')
+        self.lookahead_size = lookahead_size
+        self.reader_args = reader_args
+        self.record_size = None
+        self.first = True
+        self.eof = False
+        self.pending = deque()
+        self.pending_size = 0
+    
+    def _read_until(self, size):
+        """Read blocks until the pending blocks contain at least `size`
+        uncompressed bytes or the end of the file is reached. Empty blocks are
+        discarded.
+        """
+        while not self.eof and self.pending_size < size:
+            block = read_bgzf_block(self._file)
+            if not block:
+                self.eof = True
+                self.close()
+                break
+            block_size = bgzf_uncompressed_size(block)
+            if block_size > 0:
+                self.pending.append((block, block_size))
+                self.pending_size += block_size
+    
+    def _estimate_record_size(self):
+        """Estimate the uncompressed size of a record from the first block.
+        """
+        self._read_until(1)
+        if not self.pending:
+            return 1
+        data = decompress_bgzf_blocks((self.pending[0][0],))
+        return max(1, 4 * len(data) // max(1, data.count(b'\n')))
+    
+    def read_batch(self, size):
+        """Read blocks containing approximately `size` records.
+        
+        Returns:
+            A :class:`BgzfRawBatch`, or an empty list if there are no more
+            blocks.
+        """
+        if self.record_size is None:
+            self.record_size = self._estimate_record_size()
+        self._read_until(size * self.record_size)
+        if not self.pending:
+            return []
+        blocks = []
+        batch_size = 0
+        while self.pending and (
+                not blocks or batch_size < size * self.record_size):
+            block, block_size = self.pending.popleft()
+            self.pending_size -= block_size
+            blocks.append(block)
+            batch_size += block_size
+        self._read_until(self.lookahead_size)
+        lookahead = []
+        lookahead_size = 0
+        for block, block_size in self.pending:
+            if lookahead_size >= self.lookahead_size:
+                break
+            lookahead.append(block)
+            lookahead_size += block_size
+        batch = BgzfRawBatch(
+            b''.join(blocks), b''.join(lookahead), self.first,
+            self.eof and len(lookahead) == len(self.pending), self.reader_args)
+        self.first = False
+        return batch
+    
+    def close(self):
+        """Close the underlying file.
+        """
+        if not self._file.closed:
+            self._file.close()
+
 # TODO: SAM/BAM classes need unit tests
 
 class SAMReader(SequenceReaderBase):
@@ -652,6 +1148,18 @@ class SequenceFileFormat():
             file format.
         """
         raise NotImplementedError()
+    
+    def format_item(self, read):
+        """Format a Sequence for a batch of output records.
+        
+        Args:
+            read: The Sequence object.
+        
+        Returns:
+            The formatted read (a string), or a Sequence that is formatted
+            when the batch is converted to bytes by :func:`format_records`.
+        """
+        return self.format(read)
 
 class FastaFormat(SequenceFileFormat):
     """FASTA SequenceFileFormat.
@@ -686,9 +1194,19 @@ class FastqFormat(SequenceFileFormat):
     """FASTQ SequenceFileFormat.
     """
     def format(self, read):
+        raw = read.raw_record()
+        if raw is not None:
+            # The read is unchanged, so the original record is written
+            return raw.decode()
         return self.format_entry(
             read.name, read.sequence, read.qualities, read.name2)
     
+    def format_item(self, read):
+        if type(read) is Sequence:
+            # Formatted directly into the output buffer
+            return read
+        return self.format(read)
+    
     def format_entry(self, name, sequence, qualities, name2=""):
         """Convert a sequence record to a string.
         """
@@ -704,6 +1222,8 @@ class ColorspaceFastqFormat(FastqFormat):
     def format(self, read):
         return self.format_entry(
             read.name, read.primer + read.sequence, read.qualities)
+    
+    format_item = SequenceFileFormat.format_item
 
 class SingleEndFormatter():
     """Wrapper for a SequenceFileFormat for single-end data.
@@ -723,10 +1243,11 @@ class SingleEndFormatter():
         """Format read(s) and add them to `result`.
         
         Args:
-            result: A dict mapping file names to lists of formatted reads.
+            result: A dict mapping file names to lists of formatted reads (see
+                :method:`SequenceFileFormat.format_item`).
             read1, read2: The reads to format.
         """
-        result[self.file1].append(self.seq_format.format(read1))
+        result[self.file1].append(self.seq_format.format_item(read1))
         self.written += 1
         self.read1_bp += len(read1)
     
@@ -741,8 +1262,8 @@ class InterleavedFormatter(SingleEndFormatter):
     """
     def format(self, result, read1, read2=None):
         result[self.file1].extend((
-            self.seq_format.format(read1),
-            self.seq_format.format(read2)))
+            self.seq_format.format_item(read1),
+            self.seq_format.format_item(read2)))
         self.written += 1
         self.read1_bp += len(read1)
         self.read2_bp += len(read2)
@@ -756,8 +1277,8 @@ class PairedEndFormatter(SingleEndFormatter):
         self.file2 = file2
     
     def format(self, result, read1, read2):
-        result[self.file1].append(self.seq_format.format(read1))
-        result[self.file2].append(self.seq_format.format(read2))
+        result[self.file1].append(self.seq_format.format_item(read1))
+        result[self.file2].append(self.seq_format.format_item(read2))
         self.written += 1
         self.read1_bp += len(read1)
         self.read2_bp += len(read2)
@@ -804,7 +1325,8 @@ def paired_to_read2(reader):
 def open_reader(
         file1=None, file2=None, qualfile=None, quality_base=None, 
         colorspace=False, file_format=None, interleaved=False, 
-        input_read=None, alphabet=None):
+        input_read=None, alphabet=None, decompression_threads=None,
+        use_mmap=False):
     """Open sequence files in FASTA or FASTQ format for reading. This is
     a factory that returns an instance of one of the ...Reader
     classes also defined in this module.
@@ -830,6 +1352,11 @@ def open_reader(
             (1 or 2) or to use both reads (None).
         alphabet: An Alphabet instance - the alphabet to use to validate 
             sequences.
+        decompression_threads: Number of threads to use for decompressing
+            gzip files.
+        use_mmap: Whether to memory-map uncompressed FASTQ files and parse
+            records directly from the map. Ignored for compressed files,
+            pipes and standard input.
     """
     if interleaved and (file2 is not None or qualfile is not None):
         raise ValueError(
@@ -845,16 +1372,19 @@ def open_reader(
     if file2 is not None:
         return PairedSequenceReader(
             file1, file2, quality_base=quality_base, colorspace=colorspace,
-            file_format=file_format, alphabet=alphabet)
+            file_format=file_format, alphabet=alphabet,
+            decompression_threads=decompression_threads, use_mmap=use_mmap)
     
     if qualfile is not None:
         if colorspace:
             # read from .(CS)FASTA/.QUAL
             return ColorspaceFastaQualReader(
-                file1, qualfile, quality_base=quality_base, alphabet=alphabet)
+                file1, qualfile, quality_base=quality_base, alphabet=alphabet,
+                decompression_threads=decompression_threads)
         else:
             return FastaQualReader(
-                file1, qualfile, quality_base=quality_base, alphabet=alphabet)
+                file1, qualfile, quality_base=quality_base, alphabet=alphabet,
+                decompression_threads=decompression_threads)
     
     if file_format is None and file1 != STDOUT:
         file_format = guess_format_from_name(file1)
@@ -896,7 +1426,8 @@ def open_reader(
         elif interleaved:
             reader = InterleavedSequenceReader(
                 file1, quality_base=quality_base, colorspace=colorspace,
-                file_format=file_format, alphabet=alphabet)
+                file_format=file_format, alphabet=alphabet,
+                decompression_threads=decompression_threads, use_mmap=use_mmap)
             if input_read == READ1:
                 return paired_to_read1(reader)
             elif input_read == READ2:
@@ -905,19 +1436,70 @@ def open_reader(
                 return reader
         elif file_format == 'fasta':
             fasta_handler = ColorspaceFastaReader if colorspace else FastaReader
-            return fasta_handler(file1, alphabet=alphabet)
+            return fasta_handler(
+                file1, alphabet=alphabet,
+                decompression_threads=decompression_threads)
         elif file_format == 'fastq':
             fastq_handler = ColorspaceFastqReader if colorspace else FastqReader
             return fastq_handler(
-                file1, quality_base=quality_base, alphabet=alphabet)
+                file1, quality_base=quality_base, alphabet=alphabet,
+                decompression_threads=decompression_threads, use_mmap=use_mmap)
         elif file_format == 'sra-fastq' and colorspace:
             return SRAColorspaceFastqReader(
-                file1, quality_base=quality_base, alphabet=alphabet)
+                file1, quality_base=quality_base, alphabet=alphabet,
+                decompression_threads=decompression_threads)
     
     raise UnknownFileType(
         "File format {0!r} is unknown (expected 'sra-fastq' (only for "
         "colorspace), 'fasta', 'fastq', 'sam', or 'bam').".format(file_format))
 
+def open_chunk_reader(reader, bgzf_blocks=False, mmap_only=False):
+    """Create a :class:`FastqChunkReader` for the files underlying a reader.
+    
+    Args:
+        reader: A reader returned by `open_reader` that has not yet been
+            read from.
+        bgzf_blocks: Whether to return a :class:`BgzfBlockReader` if the
+            input is a single-end, BGZF-compressed FASTQ file, so that
+            decompression is also deferred.
+        mmap_only: Whether to only return a :class:`MmapChunkReader`, i.e.
+            return None unless the input files are memory-mapped.
+    
+    Returns:
+        A FastqChunkReader, MmapChunkReader or BgzfBlockReader, or None if the
+        input is not one or two FASTQ files opened in binary mode.
+    """
+    interleaved = False
+    if isinstance(reader, PairedSequenceReader):
+        readers = (reader.reader1, reader.reader2)
+    elif isinstance(reader, InterleavedSequenceReader):
+        readers = (reader.reader,)
+        interleaved = True
+    else:
+        readers = (reader,)
+    if not all(
+            type(rdr) in (FastqReader, ColorspaceFastqReader) and rdr.chunked
+            for rdr in readers):
+        return None
+    reader_args = dict(
+        quality_base=readers[0].quality_base,
+        colorspace=readers[0].colorspace,
+        alphabet=readers[0].alphabet)
+    if all(isinstance(rdr._file, MmapRegion) for rdr in readers):
+        return MmapChunkReader(
+            tuple(rdr._file for rdr in readers), interleaved=interleaved,
+            **reader_args)
+    if mmap_only:
+        return None
+    if (
+            bgzf_blocks and readers[0] is reader and
+            isinstance(reader.name, str) and os.path.isfile(reader.name) and
+            is_bgzf(reader.name)):
+        return BgzfBlockReader(reader.name, **reader_args)
+    return FastqChunkReader(
+        tuple(rdr._file for rdr in readers), interleaved=interleaved,
+        buffer_size=readers[0].buffer_size, **reader_args)
+
 def sra_reader(
         reader, quality_base=None, colorspace=False, input_read=None, 
         alphabet=None):
@@ -1,5 +1,6 @@
 """Widely useful utility methods.
 """
+from array import array
 from collections import OrderedDict, Iterable, Sequence
 from datetime import datetime
 import errno
@@ -100,18 +101,170 @@ MAGNITUDE = dict(
 
 LOG2 = math.log(2)
 
+def _log_add(log_x, log_y):
+    """Returns log(x + y) given log(x) and log(y).
+    """
+    if log_x < log_y:
+        log_x, log_y = log_y, log_x
+    if log_y == -math.inf:
+        return log_x
+    return log_x + math.log1p(math.exp(log_y - log_x))
+
+MAX_DENSE_LOG_TAIL_SIZE = 300
+"""Largest size for which a :class:`LogTailTable` precomputes all values."""
+
+MAX_CACHED_LOG_TAIL_ROWS = 64
+"""Maximum number of rows above the dense part of a :class:`LogTailTable`
+that are kept in memory."""
+
+class LogTailTable(object):
+    """Table of the log-probabilities that at least `matches` of `size`
+    independent positions match, i.e. log P(X >= matches) for
+    X ~ Binomial(size, match_prob), for all sizes up to `max_size`. Computed
+    with log-gamma, so that there is no overflow for long sequences.
+    
+    Values for sizes up to `MAX_DENSE_LOG_TAIL_SIZE` are precomputed. Since
+    a dense table grows with the square of `max_size`, the rows for larger
+    sizes are computed when they are first used, and a limited number of them
+    are cached.
+    
+    Args:
+        max_size: Largest size in the table.
+        match_prob: Probability of two random bases matching.
+        mismatch_prob: Probability of two random bases not matching.
+    
+    Attributes:
+        values: array('d') of size (dense_size + 1) ** 2, where dense_size is
+            the smaller of `max_size` and `MAX_DENSE_LOG_TAIL_SIZE`; the
+            value for (matches, size) is at index `size * stride + matches`.
+            Entries with matches > size are -inf.
+    """
+    def __init__(self, max_size, match_prob=0.25, mismatch_prob=0.75):
+        self.max_size = max_size
+        self.match_prob = match_prob
+        self.log_match = math.log(match_prob) if match_prob > 0 else -math.inf
+        self.log_mismatch = (
+            math.log(mismatch_prob) if mismatch_prob > 0 else -math.inf)
+        self.dense_size = min(max_size, MAX_DENSE_LOG_TAIL_SIZE)
+        self.stride = self.dense_size + 1
+        self.values = array('d', [-math.inf]) * (self.stride * self.stride)
+        self._rows = {}
+        for size in range(self.stride):
+            self._fill_row(self.values, size * self.stride, size)
+    
+    def _log_term(self, matches, size, log_nfac):
+        """Returns log P(X == matches).
+        """
+        mismatches = size - matches
+        log_term = (
+            log_nfac - math.lgamma(matches + 1) -
+            math.lgamma(mismatches + 1))
+        if matches:
+            log_term += matches * self.log_match
+        if mismatches:
+            log_term += mismatches * self.log_mismatch
+        return log_term
+    
+    def _fill_row(self, values, offset, size):
+        """Write the values for `size` to `values`, starting at `offset`.
+        """
+        log_nfac = math.lgamma(size + 1)
+        log_tail = -math.inf
+        for matches in range(size, -1, -1):
+            log_tail = _log_add(
+                log_tail, self._log_term(matches, size, log_nfac))
+            values[offset + matches] = log_tail
+    
+    def _get_row(self, size):
+        """Returns the values for a size above the dense part of the table.
+        """
+        row = self._rows.get(size, None)
+        if row is None:
+            row = array('d', [-math.inf]) * (size + 1)
+            self._fill_row(row, 0, size)
+            if len(self._rows) >= MAX_CACHED_LOG_TAIL_ROWS:
+                self._rows.clear()
+            self._rows[size] = row
+        return row
+    
+    def _log_tail(self, matches, size):
+        """Returns log P(X >= matches), summing the terms from `matches`
+        upwards until the remaining terms are negligible.
+        """
+        matches = max(matches, 0)
+        mean = size * self.match_prob
+        log_ratio = self.log_match - self.log_mismatch
+        log_term = self._log_term(matches, size, math.lgamma(size + 1))
+        log_tail = log_term
+        for i in range(matches + 1, size + 1):
+            # P(X == i) / P(X == i - 1) = (size - i + 1) / i * p / (1 - p)
+            log_term += math.log((size - i + 1) / i) + log_ratio
+            log_tail = _log_add(log_tail, log_term)
+            if i > mean and log_term < log_tail - 50:
+                break
+        return log_tail
+    
+    def __getitem__(self, key):
+        """Returns the log-probability for a (matches, size) tuple.
+        """
+        matches, size = key
+        if matches > size:
+            return -math.inf
+        if size > self.dense_size:
+            return self._get_row(size)[max(matches, 0)]
+        return self.values[size * self.stride + max(matches, 0)]
+    
+    def min_matches(self, max_prob):
+        """Returns an array('i') with, for each size up to `max_size`, the
+        smallest number of matches whose probability is at most `max_prob`
+        (or size + 1 if there is none).
+        """
+        result = array('i', [0]) * (self.max_size + 1)
+        values = self.values
+        for size in range(self.stride):
+            row = size * self.stride
+            matches = size
+            while matches >= 0 and math.exp(values[row + matches]) <= max_prob:
+                matches -= 1
+            result[size] = matches + 1
+        # Going from one size to the next, the smallest number of matches
+        # increases by at most one, so a single tail probability is needed
+        # for each size.
+        matches = result[self.dense_size]
+        for size in range(self.stride, self.max_size + 1):
+            if (
+                    matches <= size and
+                    math.exp(self._log_tail(matches, size)) > max_prob):
+                matches += 1
+            result[size] = matches
+        return result
+
 class RandomMatchProbability(object):
     """Class for computing random match probability for DNA sequences based on
-    binomial expectation. Maintains a cache of factorials to speed computation.
+    binomial expectation. Probabilities are looked up in a
+    :class:`LogTailTable` for each pair of base probabilities. The tables
+    are grown (by at least doubling) when a longer sequence is seen.
+    
+    The tables are only ever replaced, never modified (other than caching
+    rows that are computed on demand), so an instance can be shared by worker
+    threads, and tables that are built before worker
+    processes are started are shared with them; copying an instance returns
+    the instance itself.
     
     Args:
-        init_size: Initial cache size.
+        init_size: Initial table size; the table for the default base
+            probabilities is built immediately.
     """
     def __init__(self, init_size=150):
-        self.cache = {}
-        self.factorials = [1] * init_size
-        self.max_n = 1
-        self.cur_array_size = init_size
+        self.init_size = init_size
+        self.tables = {}
+        self.get_table(0.25, 0.75)
+    
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
     
     def __call__(self, matches, size, match_prob=0.25, mismatch_prob=0.75):
         """Computes the random-match probability for a given sequence size and
@@ -124,53 +277,27 @@ class RandomMatchProbability(object):
         Returns:
             The probability.
         """
-        # First see if we have the result in the cache
-        key = (matches, size, match_prob)
-        prob = self.cache.get(key, None)
-        if prob:
-            return prob
-        
-        # When there are no mismatches, the probability is
-        # just that of observing a specific sequence of the
-        # given length by chance.
-        if matches == size:
-            prob = match_prob ** matches
-        
-        else:
-            nfac = self.factorial(size)
-            prob = 0.0
-            
-            for i in range(matches, size+1):
-                j = size - i
-                # use integer division in the case that the numbers are too
-                # large for floating point division
-                try:
-                    div = nfac / self.factorial(i) / self.factorial(j)
-                except OverflowError:
-                    div = nfac // self.factorial(i) // self.factorial(j)
-                prob += (mismatch_prob ** j) * (match_prob ** i) * div
-        
-        self.cache[key] = prob
-        return prob
+        return math.exp(
+            self.get_table(match_prob, mismatch_prob, size)[matches, size])
+    
+    def get_table(self, match_prob=0.25, mismatch_prob=0.75, size=0):
+        """Returns the :class:`LogTailTable` for the given base probabilities
+        that includes sequences of length `size`.
+        """
+        key = (match_prob, mismatch_prob)
+        table = self.tables.get(key, None)
+        if table is None or table.max_size < size:
+            max_size = max(size, self.init_size)
+            if table is not None:
+                max_size = max(max_size, 2 * table.max_size)
+            table = LogTailTable(max_size, match_prob, mismatch_prob)
+            self.tables[key] = table
+        return table
     
     def factorial(self, num):
         """Returns `num`!.
         """
-        if num > self.max_n:
-            self._fill_upto(num)
-        return self.factorials[num]
-
-    def _fill_upto(self, num):
-        if num >= self.cur_array_size:
-            extension_size = num - self.cur_array_size + 1
-            self.factorials += [1] * extension_size
-        idx = self.max_n
-        next_i = idx + 1
-        while idx < num:
-            self.factorials[next_i] = next_i * self.factorials[idx]
-            idx = next_i
-            next_i += 1
-        self.max_n = idx
+        return math.factorial(num)
 
 class Mergeable(object):
     """Base class for objects that can merge themselves with another.
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Throughput benchmark for the batch transports used in parallel mode.
+
+The main process cuts a FASTQ file into raw batches and sends them to worker
+processes, which parse the reads, format them and send the results to a
+writer process. This is done using either multiprocessing queues or shared
+memory queues. If no input file is given, a random FASTQ file is generated.
+
+Example:
+    python benchmarks/bench_multicore.py -t 4 8 16
+"""
+from argparse import ArgumentParser
+from multiprocessing import Process, Queue
+import os
+import sys
+from tempfile import mkstemp
+import time
+from atropos.commands.multicore import (
+    close_queue, create_queue, dequeue, enqueue)
+from atropos.io.seqio import FastqFormat, FastqReader, open_chunk_reader
+from bench_seqio import write_random_fastq
+
+def worker(input_queue, result_queue):
+    """Parse and format batches until a None batch is received.
+    """
+    fmt = FastqFormat()
+    while True:
+        item = dequeue(input_queue)
+        if item is None:
+            break
+        index, batch = item
+        text = ''.join(fmt.format(read) for read in batch)
+        enqueue(result_queue, (index, dict(out=text)))
+
+def writer(result_queue, num_batches, done_queue):
+    """Consume `num_batches` results.
+    """
+    total = 0
+    for _ in range(num_batches):
+        _, result = dequeue(result_queue)
+        total += len(result['out'])
+    done_queue.put(total)
+
+def run(path, transport, threads, batch_size, queue_size):
+    """Returns the number of reads and seconds taken to process `path`.
+    """
+    input_queue = create_queue(transport, queue_size, threads)
+    result_queue = create_queue(transport, queue_size, threads)
+    done_queue = Queue()
+    try:
+        with FastqReader(path) as reader:
+            batches = []
+            chunk_reader = open_chunk_reader(reader)
+            while True:
+                batch = chunk_reader.read_batch(batch_size)
+                if not batch:
+                    break
+                batches.append(batch)
+        num_reads = sum(len(batch) for batch in batches)
+        
+        start = time.perf_counter()
+        workers = [
+            Process(target=worker, args=(input_queue, result_queue))
+            for _ in range(threads)]
+        writer_process = Process(
+            target=writer, args=(result_queue, len(batches), done_queue))
+        for proc in workers + [writer_process]:
+            proc.start()
+        for index, batch in enumerate(batches, 1):
+            enqueue(input_queue, (index, batch))
+        for _ in workers:
+            enqueue(input_queue, None)
+        done_queue.get()
+        elapsed = time.perf_counter() - start
+        for proc in workers + [writer_process]:
+            proc.join()
+        return num_reads, elapsed
+    finally:
+        close_queue(input_queue)
+        close_queue(result_queue)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        'input', nargs='?', default=None,
+        help="FASTQ file to read (may be compressed). If not specified, a "
+             "random FASTQ file is generated.")
+    parser.add_argument(
+        '-n', '--num-reads', type=int, default=500000,
+        help="Number of reads to generate. (500000)")
+    parser.add_argument(
+        '-l', '--read-length', type=int, default=150,
+        help="Length of reads to generate. (150)")
+    parser.add_argument(
+        '-t', '--threads', type=int, nargs='+', default=[4, 8, 16],
+        help="Numbers of worker processes to benchmark. (4 8 16)")
+    parser.add_argument(
+        '-b', '--batch-size', type=int, default=1000,
+        help="Number of reads per batch. (1000)")
+    parser.add_argument(
+        '-q', '--queue-size', type=int, default=0,
+        help="Maximum queue size. (THREADS * 4 for shared memory, "
+             "otherwise unlimited)")
+    args = parser.parse_args()
+    
+    path = args.input
+    tmp = None
+    if path is None:
+        fd, tmp = mkstemp(suffix='.fastq')
+        os.close(fd)
+        write_random_fastq(tmp, args.num_reads, args.read_length, seed=1)
+        path = tmp
+    
+    try:
+        for threads in args.threads:
+            for transport in ('chunks', 'shm'):
+                num_reads, elapsed = run(
+                    path, transport, threads, args.batch_size,
+                    args.queue_size)
+                print("threads={:<3} {:<7} {:>10} reads {:>8.3f} s "
+                      "{:>12.0f} reads/s".format(
+                          threads, 'queue' if transport == 'chunks' else 'shm',
+                          num_reads, elapsed, num_reads / elapsed))
+    finally:
+        if tmp:
+            os.remove(tmp)
+
+if __name__ == '__main__':
+    sys.exit(main())
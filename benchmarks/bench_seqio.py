@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Throughput benchmark for the FASTQ readers.
+
+Compares the chunked (byte-level) FASTQ parser, which is used when reading
+from a path, with the line-based parser, which is used for text file-like
+objects. Records created by the chunked parser only decode their names when
+accessed, so the chunked parser is measured both with and without accessing
+the names. The memory used per record is also reported. If no input file is
+given, a random FASTQ file is generated.
+
+Example:
+    python benchmarks/bench_seqio.py -n 1000000 -l 150
+"""
+from argparse import ArgumentParser
+import os
+import random
+import sys
+from tempfile import mkstemp
+import time
+import tracemalloc
+from atropos.io import xopen
+from atropos.io.seqio import FastqReader
+
+def write_random_fastq(path, num_reads, read_length, seed=None):
+    """Write `num_reads` random reads of length `read_length` to `path`.
+    """
+    rng = random.Random(seed)
+    with xopen(path, 'w') as out:
+        for i in range(num_reads):
+            seq = ''.join(rng.choice('ACGT') for _ in range(read_length))
+            qual = ''.join(
+                chr(rng.randint(35, 73)) for _ in range(read_length))
+            out.write('@read{0}\n{1}\n+\n{2}\n'.format(i, seq, qual))
+
+def count_reads(reader):
+    """Returns the number of reads in `reader`.
+    """
+    return sum(1 for _ in reader)
+
+def count_reads_with_names(reader):
+    """Returns the number of reads in `reader`, accessing the name of each.
+    """
+    return sum(1 for read in reader if read.name is not None)
+
+def time_reader(make_reader, repeat, count=count_reads):
+    """Returns the best time (in seconds) over `repeat` runs, along with the
+    number of reads parsed.
+    """
+    best = None
+    num_reads = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with make_reader() as reader:
+            num_reads = count(reader)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, num_reads
+
+def record_memory(make_reader, num_reads, names=False):
+    """Returns the average memory (in bytes) used by each of the first
+    `num_reads` records, including the buffers they reference. The reader
+    (and its read buffer) is released before measuring.
+    """
+    tracemalloc.start()
+    try:
+        with make_reader() as reader:
+            records = reader.read_batch(num_reads)
+        del reader
+        if names:
+            for record in records:
+                record.name
+        return tracemalloc.get_traced_memory()[0] / len(records)
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        'input', nargs='?', default=None,
+        help="FASTQ file to read (may be compressed). If not specified, a "
+             "random FASTQ file is generated.")
+    parser.add_argument(
+        '-n', '--num-reads', type=int, default=200000,
+        help="Number of reads to generate. (200000)")
+    parser.add_argument(
+        '-l', '--read-length', type=int, default=100,
+        help="Length of reads to generate. (100)")
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help="Number of times to repeat each measurement. (3)")
+    parser.add_argument(
+        '-b', '--buffer-size', type=int, default=None,
+        help="Buffer size (in bytes) for the chunked parser.")
+    parser.add_argument(
+        '-m', '--memory-reads', type=int, default=10000,
+        help="Number of records over which to measure memory usage. (10000)")
+    args = parser.parse_args()
+    
+    path = args.input
+    tmp = None
+    if path is None:
+        fd, tmp = mkstemp(suffix='.fastq')
+        os.close(fd)
+        write_random_fastq(tmp, args.num_reads, args.read_length, seed=1)
+        path = tmp
+    
+    kwargs = {}
+    if args.buffer_size:
+        kwargs['buffer_size'] = args.buffer_size
+    
+    try:
+        chunked = lambda: FastqReader(path, **kwargs)
+        lines = lambda: FastqReader(xopen(path))
+        engines = (
+            ('chunked', chunked, count_reads, False),
+            ('names', chunked, count_reads_with_names, True),
+            ('lines', lines, count_reads, False))
+        results = {}
+        for name, make_reader, count, names in engines:
+            elapsed, num_reads = time_reader(make_reader, args.repeat, count)
+            memory = record_memory(make_reader, args.memory_reads, names)
+            results[name] = elapsed
+            print(
+                "{:<8} {:>10} reads {:>8.3f} s {:>12.0f} reads/s {:>8.1f} "
+                "bytes/record".format(
+                    name, num_reads, elapsed, num_reads / elapsed, memory))
+        print("speedup: {:.2f}x".format(results['lines'] / results['chunked']))
+    finally:
+        if tmp:
+            os.remove(tmp)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -55,6 +55,41 @@ def test_issue_80():
     assert result.astop == 15, result
 
 
+def test_issue_80_no_indels():
+    adapter = Adapter(
+        sequence="TCGTATGCCGTCTTC",
+        where=BACK,
+        max_error_rate=0.2,
+        min_overlap=3,
+        read_wildcards=False,
+        adapter_wildcards=False,
+        indels=False)
+    read = Sequence(name="seq2", sequence="TCGTATGCCCTCC")
+    result = adapter.match_to(read)
+    assert result.errors == 2, result
+    assert result.astart == 0, result
+    assert result.astop == 13, result
+    assert result.rstop == 13, result
+
+
+def test_seed_filter():
+    sequence = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACCAGTCACACAGTGATCTCGTATGCCGTCTTC'
+    # the aligner of a short adapter already skips reads without a match
+    adapter = Adapter(sequence[:33], where=BACK, max_error_rate=0.1)
+    assert not adapter.use_seed_filter
+    adapter = Adapter(sequence, where=BACK, max_error_rate=0.1)
+    assert adapter.use_seed_filter
+    assert adapter.match_to(Sequence('r1', 'T' * 100)) is None
+    read = Sequence('r2', 'T' * 50 + sequence[:40] + 'A' + sequence[40:])
+    match = adapter.match_to(read)
+    assert match.rstart == 50
+    assert match.errors == 1
+    stats = adapter.summarize()['seed_filter']
+    assert stats['aligned'] == 1
+    assert stats['skipped'] == 1
+    assert adapter.seed_filter_aligned == 1
+
+
 def test_str():
     a = Adapter('ACGT', where=BACK, max_error_rate=0.1)
     str(a)
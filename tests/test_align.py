@@ -1,10 +1,17 @@
 # coding: utf-8
+import copy
 import math
+import pickle
+import random
+from pytest import raises
 from .utils import approx_equal
-from atropos.adapters import BACK
+from atropos.adapters import ANYWHERE, BACK, FRONT
 from atropos.align import (
-    locate, compare_prefixes, compare_suffixes, Aligner, InsertAligner)
-from atropos.util import RandomMatchProbability
+    locate, compare_prefixes, compare_suffixes, Aligner, HammingAligner,
+    InsertAligner, MultiAligner, OverlapAligner, SeedFilter, SeedIndex,
+    START_WITHIN_SEQ1, STOP_WITHIN_SEQ2)
+from atropos.util import (
+    MAX_DENSE_LOG_TAIL_SIZE, LogTailTable, RandomMatchProbability)
 
 class TestAligner():
     def test(self):
@@ -16,6 +23,306 @@ class TestAligner():
         reference = 'GCTTAGACATATC'
         aligner = Aligner(reference, 1.0, flags=BACK)
         aligner.locate('CAA')
+    
+    def test_bit_parallel(self):
+        assert Aligner('ACGT' * 16, 0.1).bit_parallel
+        aligner = Aligner('ACGT' * 17, 0.1)
+        assert not aligner.bit_parallel
+        try:
+            aligner.bit_parallel = True
+            assert False
+        except ValueError:
+            pass
+    
+    def test_bit_parallel_same_as_dp(self):
+        rng = random.Random(42)
+        def random_seq(length, alphabet='ACGT'):
+            return ''.join(rng.choice(alphabet) for _ in range(length))
+        for _ in range(5000):
+            reference = random_seq(rng.randint(1, 64))
+            query = random_seq(rng.randint(0, 100))
+            if rng.random() < 0.6:
+                # insert a mutated piece of the reference
+                piece = list(reference[rng.randint(0, len(reference) - 1):])
+                for _ in range(rng.randint(0, 3)):
+                    pos = rng.randint(0, len(piece))
+                    edit = rng.choice(('sub', 'ins', 'del'))
+                    if edit == 'ins':
+                        piece.insert(pos, rng.choice('ACGT'))
+                    elif pos < len(piece):
+                        if edit == 'sub':
+                            piece[pos] = rng.choice('ACGT')
+                        else:
+                            del piece[pos]
+                pos = rng.randint(0, len(query))
+                query = query[:pos] + ''.join(piece) + (
+                    query[pos:] if rng.random() < 0.5 else '')
+            wildcard_ref = rng.random() < 0.2
+            wildcard_query = rng.random() < 0.2
+            if wildcard_ref:
+                reference = random_seq(3, 'ACGTN') + reference[3:]
+            if wildcard_query:
+                query = random_seq(3, 'ACGTN') + query[3:]
+            args = (
+                reference, rng.choice((0, 0.1, 0.2, 0.3)), rng.randint(0, 15),
+                wildcard_ref, wildcard_query, rng.randint(1, 5),
+                rng.choice((1, 1, 2)))
+            aligner = Aligner(*args)
+            dp_aligner = Aligner(*args)
+            dp_aligner.bit_parallel = False
+            assert aligner.locate(query) == dp_aligner.locate(query), (
+                args, query)
+
+
+class TestHammingAligner():
+    def test_mismatches(self):
+        aligner = HammingAligner('GATCGGAAGAGC', 0.1, flags=BACK)
+        # one mismatch
+        assert aligner.locate('TTTTTTTTGATCGGTAGAGCTT') == (
+            0, 12, 8, 20, 11, 1)
+        # needs an indel
+        assert aligner.locate('TTTTTTTTGATCGGAGAGCTT') is None
+        # partial match at the end of the read
+        assert aligner.locate('TTTTTTTTTGATCG') == (0, 5, 9, 14, 5, 0)
+    
+    def test_same_as_aligner(self):
+        rng = random.Random(42)
+        def random_seq(length, alphabet='ACGT'):
+            return ''.join(rng.choice(alphabet) for _ in range(length))
+        for _ in range(5000):
+            reference = random_seq(rng.randint(1, 40))
+            query = random_seq(rng.randint(0, 80))
+            if rng.random() < 0.6:
+                # insert a piece of the reference with some mismatches
+                piece = list(reference[rng.randint(0, len(reference) - 1):])
+                for _ in range(rng.randint(0, 3)):
+                    piece[rng.randint(0, len(piece) - 1)] = rng.choice('ACGT')
+                pos = rng.randint(0, len(query))
+                query = query[:pos] + ''.join(piece) + (
+                    query[pos:] if rng.random() < 0.5 else '')
+            wildcard_ref = rng.random() < 0.2
+            wildcard_query = rng.random() < 0.2
+            if wildcard_ref:
+                reference = random_seq(3, 'ACGTN') + reference[3:]
+            if wildcard_query:
+                query = random_seq(3, 'ACGTN') + query[3:]
+            args = (
+                reference, rng.choice((0, 0.1, 0.2, 0.3)), rng.randint(0, 15),
+                wildcard_ref, wildcard_query, rng.randint(1, 5))
+            aligner = Aligner(*args, indel_cost=100000)
+            hamming_aligner = HammingAligner(*args)
+            assert aligner.locate(query) == hamming_aligner.locate(query), (
+                args, query)
+
+
+class TestSeedFilter():
+    def test_seed_length(self):
+        adapter = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCA'
+        assert SeedFilter(adapter, 0.1, BACK, 3).seed_length == 8
+        assert SeedFilter(adapter, 0.0, BACK, 3).seed_length == 31
+        # too many errors for seeds of the minimum length
+        assert SeedFilter(adapter, 0.2, BACK, 3).seed_length == 0
+        # only ACGT
+        assert SeedFilter('AGATCGGAANAGC', 0.1, BACK, 3).seed_length == 0
+        assert SeedFilter('AGATCGGAANAGC', 0.1, BACK, 3).may_match('TTTT')
+    
+    def test_may_match(self):
+        seed_filter = SeedFilter(
+            'AGATCGGAAGAGCACACGTCTGAACTCCAGTCA', 0.1, BACK, 3)
+        assert not seed_filter.may_match('T' * 100)
+        # seed
+        assert seed_filter.may_match('T' * 50 + 'CGTCTGAA' + 'T' * 50)
+        # partial matches at the 3' end, with and without errors
+        assert seed_filter.may_match('T' * 50 + 'AGA')
+        assert not seed_filter.may_match('T' * 50 + 'AGAC')
+        assert seed_filter.may_match('T' * 50 + 'AGATCGGTAGAG')
+    
+    def test_no_missed_alignments(self):
+        rng = random.Random(42)
+        def random_seq(length):
+            return ''.join(rng.choice('ACGT') for _ in range(length))
+        skipped = 0
+        for _ in range(5000):
+            reference = random_seq(rng.randint(1, 50))
+            query = random_seq(rng.randint(0, 100))
+            if rng.random() < 0.6:
+                # insert a mutated piece of the reference
+                start = rng.randint(0, len(reference) - 1)
+                piece = list(
+                    reference[start:rng.randint(start + 1, len(reference))])
+                for _ in range(rng.randint(0, 4)):
+                    pos = rng.randint(0, len(piece))
+                    edit = rng.choice(('sub', 'ins', 'del'))
+                    if edit == 'ins':
+                        piece.insert(pos, rng.choice('ACGT'))
+                    elif pos < len(piece):
+                        if edit == 'sub':
+                            piece[pos] = rng.choice('ACGT')
+                        else:
+                            del piece[pos]
+                pos = rng.randint(0, len(query))
+                query = query[:pos] + ''.join(piece) + (
+                    query[pos:] if rng.random() < 0.5 else '')
+            args = (
+                reference, rng.choice((0, 0.05, 0.1, 0.2)), rng.randint(0, 15))
+            min_overlap = rng.randint(1, 5)
+            if SeedFilter(*args, min_overlap=min_overlap).may_match(query):
+                continue
+            skipped += 1
+            aligner = Aligner(
+                *args, min_overlap=min_overlap, indel_cost=rng.choice((1, 2)))
+            assert aligner.locate(query) is None, (args, min_overlap, query)
+            hamming_aligner = HammingAligner(*args, min_overlap=min_overlap)
+            assert hamming_aligner.locate(query) is None, (
+                args, min_overlap, query)
+        assert skipped > 1000
+
+
+def test_locate_batch():
+    rng = random.Random(42)
+    def random_seq(length):
+        return ''.join(rng.choice('ACGTN') for _ in range(length))
+    for _ in range(50):
+        args = (
+            random_seq(rng.randint(1, 80)), rng.choice((0, 0.1, 0.2)),
+            rng.randint(0, 15))
+        kwargs = dict(
+            wildcard_ref=rng.random() < 0.2, wildcard_query=rng.random() < 0.2,
+            min_overlap=rng.randint(1, 5))
+        queries = [random_seq(rng.randint(0, 100)) for _ in range(20)]
+        buffer = ''.join(queries).encode('ascii')
+        offsets = [0]
+        for query in queries:
+            offsets.append(offsets[-1] + len(query))
+        for aligner in (Aligner(*args, **kwargs), HammingAligner(*args, **kwargs)):
+            results = aligner.locate_batch(queries)
+            assert len(results) == 6 * len(queries)
+            assert aligner.locate_batch(buffer, offsets) == results
+            for i, query in enumerate(queries):
+                expected = aligner.locate(query)
+                if expected is None:
+                    assert list(results[6 * i:6 * i + 6]) == [-1] * 6
+                else:
+                    assert tuple(results[6 * i:6 * i + 6]) == expected
+    aligner = Aligner('ACGT', 0.1)
+    assert len(aligner.locate_batch([])) == 0
+    with raises(ValueError):
+        aligner.locate_batch(b'ACGT', [0, 5])
+    with raises(ValueError):
+        aligner.locate_batch(b'ACGT', [2, 1, 4])
+
+
+def test_multi_aligner_locate_batch():
+    rng = random.Random(42)
+    def random_seq(length):
+        return ''.join(rng.choice('ACGT') for _ in range(length))
+    aligner = MultiAligner(0.2, START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2, 5)
+    references = [random_seq(rng.randint(1, 60)) for _ in range(100)]
+    queries = [
+        reference[rng.randint(0, len(reference)):] + random_seq(
+            rng.randint(0, 20))
+        for reference in references]
+    results, offsets = aligner.locate_batch(references, queries, 10)
+    assert len(offsets) == len(queries) + 1
+    assert len(results) == 6 * offsets[-1]
+    for i, (reference, query) in enumerate(zip(references, queries)):
+        matches = [
+            tuple(results[6 * j:6 * j + 6])
+            for j in range(offsets[i], offsets[i + 1])]
+        assert (aligner.locate(reference, query, 10) or []) == matches
+    assert offsets[-1] > 0
+    with raises(ValueError):
+        aligner.locate_batch(references, queries[1:])
+
+def test_overlap_aligner():
+    rng = random.Random(42)
+    for _ in range(500):
+        max_error_rate = rng.choice((0, 0.1, 0.2))
+        min_overlap = rng.randint(1, 10)
+        multi_aligner = MultiAligner(
+            max_error_rate, START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2, min_overlap)
+        aligner = OverlapAligner(max_error_rate, min_overlap)
+        alphabet = rng.choice(('ACGT', 'AC', 'A'))
+        def random_seq(length):
+            return ''.join(rng.choice(alphabet) for _ in range(length))
+        reference = random_seq(rng.randint(1, 150))
+        query = random_seq(len(reference))
+        if rng.random() < 0.5:
+            overlap = rng.randint(1, len(reference))
+            query = reference[-overlap:] + query[overlap:]
+        expected = []
+        # the DP reports the full-length overlap twice
+        for match in multi_aligner.locate(reference, query) or []:
+            if match not in expected:
+                expected.append(match)
+        assert (aligner.locate(reference, query) or []) == expected
+    
+    aligner = OverlapAligner(0.2, 3)
+    assert aligner.locate('', 'ACGT') is None
+    assert aligner.locate('TTTACG', 'ACGTTT') == [(3, 6, 0, 3, 3, 0)]
+    assert aligner.locate('ACGTTT', 'ACGTTT') == [(0, 6, 0, 6, 6, 0)]
+    assert aligner.locate('AAAAAA', 'AAAAAA') == [(0, 6, 0, 6, 6, 0)]
+    aligner.min_matches = [0, 0, 0, 4]
+    assert aligner.locate('GGAAAAA', 'AAAAA') == [
+        (3, 7, 0, 4, 4, 0), (2, 7, 0, 5, 5, 0)]
+    assert aligner.locate('TTTACG', 'ACGTTT') is None
+    results, offsets = aligner.locate_batch(
+        ['TTTACG', 'GGAAAAA'], ['ACGTTT', 'AAAAA'])
+    assert list(offsets) == [0, 0, 2]
+    assert list(results) == [3, 7, 0, 4, 4, 0, 2, 7, 0, 5, 5, 0]
+    aligner_copy = copy.deepcopy(aligner)
+    assert list(aligner_copy.min_matches) == [0, 0, 0, 4]
+    assert aligner_copy.locate('GGAAAAA', 'AAAAA') == [
+        (3, 7, 0, 4, 4, 0), (2, 7, 0, 5, 5, 0)]
+
+
+def test_seed_index():
+    rng = random.Random(42)
+    def random_seq(length):
+        return ''.join(rng.choice('ACGT') for _ in range(length))
+    for _ in range(200):
+        references = [
+            random_seq(rng.randint(1, 40)) for _ in range(rng.randint(1, 20))]
+        seed_filters = [
+            SeedFilter(
+                reference, rng.choice((0, 0.1, 0.2)),
+                rng.choice((BACK, FRONT, ANYWHERE)), rng.randint(1, 5))
+            for reference in references]
+        seed_filters.append(None)
+        index = SeedIndex(seed_filters)
+        for _ in range(20):
+            query = random_seq(rng.randint(0, 100))
+            if rng.random() < 0.5:
+                reference = rng.choice(references)
+                pos = rng.randint(0, len(query))
+                query = query[:pos] + reference + query[pos:]
+            expected = [
+                i for i, seed_filter in enumerate(seed_filters)
+                if seed_filter is None or seed_filter.may_match(query)]
+            assert index.candidates(query) == expected, query
+
+def test_copy_aligners():
+    reference = 'ACGTACGTTTACGATCGATCGA'
+    query = 'GGACGTACGTTTACGATCGTTCGAGG'
+    aligner = Aligner(reference, 0.1, flags=ANYWHERE, indel_cost=2)
+    aligner.min_overlap = 3
+    hamming_aligner = HammingAligner(reference, 0.1, flags=ANYWHERE)
+    seed_filter = SeedFilter(reference, 0.1, ANYWHERE)
+    multi_aligner = MultiAligner(0.1, ANYWHERE, 3)
+    objects = [
+        aligner, hamming_aligner, seed_filter, SeedIndex([seed_filter]),
+        multi_aligner]
+    for copied in (copy.deepcopy(objects), pickle.loads(pickle.dumps(objects))):
+        aligner_copy = copied[0]
+        assert aligner_copy.min_overlap == 3
+        assert aligner_copy.bit_parallel
+        assert aligner_copy.locate(query) == aligner.locate(query)
+        assert copied[1].locate(query) == hamming_aligner.locate(query)
+        assert copied[2].seeds == seed_filter.seeds
+        assert copied[3].candidates(query) == [0]
+        assert (
+            copied[4].locate(reference, query) ==
+            multi_aligner.locate(reference, query))
 
 
 def test_polya():
@@ -141,6 +448,51 @@ def test_match_probability():
     i5 = 0.25 ** 5
     assert approx_equal(a.match_probability(k, n), i3 + i4 + i5, 0.0001)
 
+def test_match_probability_table():
+    rmp = RandomMatchProbability(init_size=10)
+    for n in (0, 1, 5, 10, 30, 300):
+        for k in range(n + 2):
+            expected = sum(
+                math.factorial(n) // math.factorial(i) // math.factorial(n - i)
+                * (0.25 ** i) * (0.75 ** (n - i))
+                for i in range(k, n + 1))
+            assert approx_equal(rmp(k, n), expected, 1E-9)
+    assert rmp.get_table().max_size == 300
+    assert approx_equal(
+        rmp(2, 3, match_prob=0.5, mismatch_prob=0.5), 0.5, 1E-9)
+    table = rmp.get_table(size=20)
+    min_matches = table.min_matches(0.001)
+    assert len(min_matches) == table.max_size + 1
+    for size in (5, 20):
+        k = min_matches[size]
+        assert rmp(k, size) <= 0.001
+        assert k == 0 or rmp(k - 1, size) > 0.001
+    assert min_matches[4] == 5
+    # the tables are shared rather than copied
+    assert copy.deepcopy(rmp) is rmp
+
+def test_match_probability_table_sparse_rows():
+    table = LogTailTable(MAX_DENSE_LOG_TAIL_SIZE + 100)
+    assert len(table.values) == (MAX_DENSE_LOG_TAIL_SIZE + 1) ** 2
+    dense = LogTailTable(MAX_DENSE_LOG_TAIL_SIZE)
+    for size in (MAX_DENSE_LOG_TAIL_SIZE + 1, MAX_DENSE_LOG_TAIL_SIZE + 100):
+        for matches in range(0, size + 1, 7):
+            expected = sum(
+                math.factorial(size) // math.factorial(i) //
+                math.factorial(size - i) * (0.25 ** i) * (0.75 ** (size - i))
+                for i in range(matches, size + 1))
+            assert approx_equal(
+                math.exp(table[matches, size]), expected, 1E-9)
+    for max_prob in (0.5, 0.001, 1E-20):
+        min_matches = table.min_matches(max_prob)
+        assert len(min_matches) == table.max_size + 1
+        assert list(min_matches[:dense.max_size + 1]) == \
+            list(dense.min_matches(max_prob))
+        for size in range(dense.max_size + 1, table.max_size + 1, 11):
+            k = min_matches[size]
+            assert math.exp(table[k, size]) <= max_prob
+            assert math.exp(table[k - 1, size]) > max_prob
+
 def test_insert_align():
     a1_seq = 'TTAGACATATGG'
     a2_seq = 'CAGTGGAGTATA'
@@ -2,11 +2,14 @@
 # TODO
 # test with the --output option
 # test reading from standard input
+import gzip
 from io import StringIO
 import os
 from pytest import raises
 import sys
 from atropos.commands import execute_cli, get_command
+from atropos.commands.trim.writers import Writers
+from atropos.io.compression import BGZF_EOF, compress_bgzf_block, is_bgzf
 from unittest import skipIf
 from .utils import (
     run, files_equal, datapath, cutpath, redirect_stderr, temporary_path,
@@ -146,6 +149,66 @@ def test_gz_multiblock():
     '''compressed gz file with multiple blocks (created by concatenating two .gz files)'''
     run("-b TTAGACATATCTCCGTCG", "small.fastq", "multiblock.fastq.gz")
 
+def test_bgzf():
+    '''BGZF-compressed input, decompressed in worker processes'''
+    with open(datapath('small.fastq'), 'rb') as f:
+        data = f.read()
+    with temporary_path('small.bgzf.fastq.gz') as path:
+        with open(path, 'wb') as out:
+            for i in range(0, len(data), 100):
+                out.write(compress_bgzf_block(data[i:i+100]))
+            out.write(BGZF_EOF)
+        run("-b TTAGACATATCTCCGTCG", "small.fastq", path)
+        run("-b TTAGACATATCTCCGTCG --threads 2 --preserve-order "
+            "--transport chunks --batch-size 1", "small.fastq", path)
+
+def test_bgzf_output():
+    '''BGZF-compressed output, compressed by the main process and by
+    worker processes'''
+    with open(cutpath('small.fastq'), 'rb') as f:
+        expected = f.read()
+    for args in (
+            '', '--threads 2 --preserve-order --compression worker '
+            '--batch-size 1'):
+        with temporary_path('small.out.fastq.gz') as path:
+            params = (
+                '-b TTAGACATATCTCCGTCG --output-format bgzf --bgzf-index ' +
+                args).split() + ['-se', datapath('small.fastq'), '-o', path]
+            retcode, summary = get_command('trim').execute(params)
+            assert retcode == 0
+            assert is_bgzf(path)
+            with open(path, 'rb') as f:
+                assert f.read().endswith(BGZF_EOF)
+            with gzip.open(path, 'rb') as f:
+                assert f.read() == expected
+            assert os.path.exists(path + '.gzi')
+            os.remove(path + '.gzi')
+
+def test_bgzf_output_empty():
+    '''empty BGZF output files still end with the EOF block'''
+    with temporary_path('empty.out.fastq.gz') as path:
+        writers = Writers(force_create=[path], output_format='bgzf')
+        writers.close()
+        assert is_bgzf(path)
+        with open(path, 'rb') as f:
+            assert f.read() == BGZF_EOF
+
+def test_compression_level():
+    '''compressed output with a fixed or automatic compression level'''
+    with open(cutpath('small.fastq'), 'rb') as f:
+        expected = f.read()
+    for args in (
+            '--compression-level 1',
+            '--compression-level auto',
+            '--compression-level auto --threads 2 --compression worker'):
+        with temporary_path('small.out.fastq.gz') as path:
+            params = ('-b TTAGACATATCTCCGTCG ' + args).split() + [
+                '-se', datapath('small.fastq'), '-o', path]
+            retcode, summary = get_command('trim').execute(params)
+            assert retcode == 0
+            with gzip.open(path, 'rb') as f:
+                assert f.read() == expected
+
 def test_suffix():
     '''-y/--suffix parameter, combined with _F3'''
     run("-c -e 0.12 -a 1=330201030313112312 -y _my_suffix_{name} --strip-f3", "suffix.fastq", "solid.csfasta", qualfile='solid.qual')
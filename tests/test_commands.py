@@ -1,8 +1,12 @@
 
 # Tests for internal components of the atropos commands
 from pytest import raises
+from atropos import AtroposError
+from atropos.commands.base import SingleEndPipelineMixin
+from atropos.commands.trim import TrimPipeline
 from atropos.commands.trim.multicore import OrderPreservingWriterResultHandler
 from atropos.commands.trim.writers import Writers
+from atropos.io.seqio import Sequence
 import tempfile
 import os
 
@@ -28,3 +32,23 @@ def test_order_preserving_writer():
     finally:
         os.remove(path)
 
+
+def test_trim_pipeline_error():
+    class FailingRecordHandler(object):
+        def handle_records(self, context, reads1, reads2=None):
+            for read in reads1:
+                self.handle_record(context, read)
+        
+        def handle_record(self, context, read1, read2=None):
+            if read1.sequence == 'N':
+                raise ValueError("invalid read")
+    
+    pipeline_class = type(
+        'TrimPipelineImpl', (SingleEndPipelineMixin, TrimPipeline), {})
+    pipeline = pipeline_class(FailingRecordHandler(), None)
+    context = dict(index=3, bp=[0, 0], results={})
+    records = [Sequence('read1', 'A'), Sequence('read2', 'N')]
+    with raises(AtroposError) as excinfo:
+        pipeline.handle_records(context, records)
+    assert str(excinfo.value) == (
+        "An error occurred at record 1 ('read2') of batch 3")
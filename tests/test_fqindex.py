@@ -0,0 +1,144 @@
+import os
+import pickle
+from pytest import raises
+from atropos.commands import get_command
+from atropos.io.compression import iter_bgzf_blocks
+from atropos.io.fqindex import (
+    FastqIndex, IndexedChunkReader, get_index_path, open_index_reader)
+from atropos.io.seqio import (
+    FastqReader, FormatError, InterleavedSequenceReader, PairedSequenceReader)
+from .test_paired import run_paired
+from .utils import datapath, cutpath, temporary_path, write_bgzf
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def records(data):
+    lines = data.splitlines(True)
+    return [b''.join(lines[i:i+4]) for i in range(0, len(lines), 4)]
+
+def test_index():
+    data = read_bytes(datapath('paired.1.fastq'))
+    expected = records(data)
+    with temporary_path('index.fastq') as path, \
+            temporary_path('index.fastq.gz') as bgzf_path:
+        with open(path, 'wb') as out:
+            out.write(data)
+        write_bgzf(bgzf_path, data, 50)
+        for fname, bgzf in ((path, False), (bgzf_path, True)):
+            index = FastqIndex.build(fname, interval=3)
+            assert index.bgzf == bgzf
+            assert index.num_records == len(expected)
+            assert len(index.offsets) == 3
+            index.save()
+            index_path = get_index_path(fname)
+            try:
+                loaded = FastqIndex.load(fname)
+                assert loaded.num_records == index.num_records
+                assert list(loaded.offsets) == list(index.offsets)
+                assert loaded.is_current()
+                for start in range(len(expected)):
+                    for count in range(len(expected) - start + 1):
+                        assert loaded.read_records(start, count) == b''.join(
+                            expected[start:start+count])
+                with raises(IndexError):
+                    loaded.read_records(1, len(expected))
+            finally:
+                os.remove(index_path)
+
+def test_index_not_bgzf():
+    with raises(ValueError):
+        FastqIndex.build(datapath('small.fastq.gz'))
+
+def test_index_reader():
+    path1, path2 = datapath('paired.1.fastq'), datapath('paired.2.fastq')
+    with PairedSequenceReader(path1, path2) as reader:
+        expected = list(reader)
+    indexes = [FastqIndex.build(path, interval=2) for path in (path1, path2)]
+    chunk_reader = IndexedChunkReader(indexes)
+    assert chunk_reader.num_records == len(expected)
+    batches = []
+    while True:
+        batch = chunk_reader.read_batch(3)
+        if not batch:
+            break
+        # batches are sent to worker processes
+        batches.append(pickle.loads(pickle.dumps(batch)))
+    assert [len(batch) for batch in batches] == [3, 1]
+    assert [rec for batch in batches for rec in batch] == expected
+
+def test_index_reader_interleaved():
+    path = cutpath('interleaved.fastq')
+    with InterleavedSequenceReader(path) as reader:
+        expected = list(reader)
+    chunk_reader = IndexedChunkReader(
+        [FastqIndex.build(path, interval=3)], interleaved=True)
+    batch = chunk_reader.read_batch(len(expected))
+    assert list(batch) == expected
+    assert chunk_reader.read_batch(1) == []
+
+def test_index_reader_improperly_paired():
+    indexes = [
+        FastqIndex.build(datapath(name))
+        for name in ('paired.1.fastq', 'simple.fastq')]
+    with raises(FormatError):
+        IndexedChunkReader(indexes)
+
+def test_open_index_reader():
+    data = read_bytes(datapath('small.fastq'))
+    with temporary_path('index.fastq') as path:
+        with open(path, 'wb') as out:
+            out.write(data)
+        with FastqReader(path) as reader:
+            assert open_index_reader(reader) is None
+        FastqIndex.build(path).save()
+        try:
+            with FastqReader(path) as reader:
+                assert open_index_reader(reader).num_records == 3
+            # index is out of date
+            with open(path, 'ab') as out:
+                out.write(data)
+            with FastqReader(path) as reader:
+                assert open_index_reader(reader) is None
+            # index is corrupt
+            with open(get_index_path(path), 'wb') as out:
+                out.write(b'not an index')
+            with FastqReader(path) as reader:
+                assert open_index_reader(reader) is None
+        finally:
+            os.remove(get_index_path(path))
+
+def test_read_truncated_bgzf():
+    data = read_bytes(datapath('paired.1.fastq'))
+    with temporary_path('index.fastq.gz') as path:
+        write_bgzf(path, data, 50)
+        index = FastqIndex.build(path, interval=3)
+        # truncate the file at a block boundary
+        with open(path, 'rb') as inp:
+            blocks = list(iter_bgzf_blocks(inp))
+        with open(path, 'wb') as out:
+            out.write(b''.join(blocks[:len(blocks) // 2]))
+        with raises(FormatError):
+            index.read_records(0, index.num_records)
+
+def test_index_command():
+    with temporary_path('index.1.fastq') as path1, \
+            temporary_path('index.2.fastq') as path2:
+        for name, path in (('paired.1.fastq', path1), ('paired.2.fastq', path2)):
+            with open(path, 'wb') as out:
+                out.write(read_bytes(datapath(name)))
+        retcode, summary = get_command('index').execute(
+            ['-pe1', path1, '-pe2', path2, '--interval', '2', '--quiet'])
+        assert retcode == 0
+        assert summary['index']['record_counts'] == (4, 4)
+        try:
+            # worker processes read the indexed files directly
+            run_paired(
+                '--threads 2 --preserve-order --batch-size 3 '
+                '-a TTAGACATAT -m 14',
+                in1=path1, in2=path2,
+                expected1='paired.m14.1.fastq', expected2='paired.m14.2.fastq')
+        finally:
+            for path in (path1, path2):
+                os.remove(get_index_path(path))
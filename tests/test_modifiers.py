@@ -1,4 +1,5 @@
 # coding: utf-8
+import random
 from atropos.adapters import *
 from atropos.align import MatchInfo
 from atropos.commands.trim.modifiers import *
@@ -84,6 +85,43 @@ def test_Modifiers_paired_both():
     assert mod_read1.sequence == 'TACGTA'
     assert mod_read2.sequence == 'TACGTA'
 
+def test_Modifiers_fused_trimmers():
+    def add_trimmers(mods):
+        mods.add_modifier(UnconditionalCutter, lengths=[2, -1])
+        mods.add_modifier(NextseqQualityTrimmer, cutoff=20)
+        mods.add_modifier(QualityTrimmer, cutoff_front=10, cutoff_back=15)
+        mods.add_modifier(NEndTrimmer)
+    fused = PairedEndModifiers(paired="both")
+    add_trimmers(fused)
+    plan = fused._get_plan()
+    assert len(plan) == 1
+    assert all(isinstance(mod, FusedTrimmer) for mod in plan[0])
+    unfused = PairedEndModifiers(paired="both")
+    add_trimmers(unfused)
+    unfused._plan = unfused.modifiers
+    random.seed(5)
+    reads = []
+    for i in range(200):
+        length = random.randint(0, 20)
+        read = Sequence(
+            'read', ''.join(random.choice('ACGGTNN') for _ in range(length)),
+            ''.join(chr(33 + random.randint(0, 40)) for _ in range(length)))
+        if length > 2 and i % 2:
+            read = read[1:-1]
+        reads.append(read)
+    reads1 = reads[:100]
+    reads2 = reads[100:]
+    for mods in (fused, unfused):
+        mods.result = list(zip(*mods.modify_batch(reads1, reads2)))
+        mods.result.extend(
+            mods.modify(read1, read2) for read1, read2 in zip(reads1, reads2))
+    for pair1, pair2 in zip(fused.result, unfused.result):
+        for read1, read2 in zip(pair1, pair2):
+            assert read1.sequence == read2.sequence
+            assert read1.qualities == read2.qualities
+            assert read1.clipped == read2.clipped
+    assert fused.summarize() == unfused.summarize()
+
 def test_min_cutter_T_T():
     unconditional_before = UnconditionalCutter((2,-2))
     unconditional_after = UnconditionalCutter((1,-1))
@@ -165,6 +203,118 @@ def test_non_directional_bisulfite_trimmer():
     assert trimmer(read2).sequence == "CTATCGA"
     assert trimmer(read3).sequence == "CTATCGATCCA"
 
+def test_adapter_cutter_index():
+    rng = random.Random(42)
+    def random_seq(length):
+        return ''.join(rng.choice('ACGT') for _ in range(length))
+    sequences = [random_seq(rng.randint(8, 40)) for _ in range(50)]
+    wheres = [rng.choice((BACK, FRONT, ANYWHERE)) for _ in sequences]
+    def create_adapters():
+        adapters = [
+            Adapter(sequence, where=where, max_error_rate=0.1, min_overlap=3)
+            for sequence, where in zip(sequences, wheres)]
+        # an adapter with a wildcard is a candidate for every read
+        adapters.append(
+            Adapter('ACGTNNNNACGT', where=BACK, max_error_rate=0.1))
+        return adapters
+    cutter = AdapterCutter(create_adapters())
+    assert cutter.index is not None
+    unindexed_cutter = AdapterCutter(create_adapters())
+    unindexed_cutter.index = None
+    for i in range(500):
+        seq = random_seq(100)
+        if i % 2:
+            pos = rng.randint(0, 100)
+            seq = seq[:pos] + rng.choice(sequences) + seq[pos:]
+        read = Sequence('read{}'.format(i), seq)
+        trimmed = cutter(read)
+        expected = unindexed_cutter(read)
+        assert trimmed.sequence == expected.sequence
+        assert (trimmed.match is None) == (expected.match is None)
+        if trimmed.match is not None:
+            assert cutter.adapters.index(trimmed.match.adapter) == \
+                unindexed_cutter.adapters.index(expected.match.adapter)
+    assert cutter.with_adapters == unindexed_cutter.with_adapters > 250
+    # reads that the index skips are counted by the adapters
+    for adapter in cutter.adapters[:-1]:
+        stats = adapter.summarize()['seed_filter']
+        assert stats['aligned'] + stats['skipped'] <= 500
+        assert stats['skipped'] > 0
+    assert 'seed_filter' not in cutter.adapters[-1].summarize()
+
+def test_adapter_cutter_process_batch():
+    rng = random.Random(42)
+    def random_seq(length):
+        return ''.join(rng.choice('ACGT') for _ in range(length))
+    sequences = [random_seq(rng.randint(8, 40)) for _ in range(5)]
+    def create_adapters():
+        adapters = [
+            Adapter(
+                sequence, where=where, max_error_rate=0.1, min_overlap=3,
+                name=str(i))
+            for i, (sequence, where) in enumerate(zip(
+                sequences, (BACK, FRONT, ANYWHERE, BACK, BACK)))]
+        adapters.append(LinkedAdapter('ACGTACGT', 'TTTTGGGG', name='linked'))
+        return adapters
+    reads = []
+    for i in range(300):
+        seq = random_seq(rng.randint(0, 100))
+        for _ in range(i % 3):
+            pos = rng.randint(0, len(seq))
+            seq = seq[:pos] + rng.choice(sequences) + seq[pos:]
+        reads.append(Sequence('read{}'.format(i), seq, '#' * len(seq)))
+    for action in ('trim', 'mask', None):
+        cutter = AdapterCutter(create_adapters(), times=2, action=action)
+        batch_cutter = AdapterCutter(create_adapters(), times=2, action=action)
+        trimmed = batch_cutter.process_batch(reads)
+        assert len(trimmed) == len(reads)
+        for read, batch_read in zip(reads, trimmed):
+            expected = cutter(read)
+            assert batch_read.sequence == expected.sequence
+            assert batch_read.qualities == expected.qualities
+            assert (
+                getattr(batch_read, 'match_info', None) ==
+                getattr(expected, 'match_info', None))
+        assert batch_cutter.with_adapters == cutter.with_adapters > 100
+        assert batch_cutter.summarize() == cutter.summarize()
+
+def test_insert_adapter_cutter_process_batch():
+    rng = random.Random(42)
+    a1 = 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTC'
+    a2 = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACGAGTTA'
+    def mutate(seq):
+        return ''.join(
+            rng.choice('ACGT') if rng.random() < 0.02 else base
+            for base in seq)
+    reads1 = []
+    reads2 = []
+    for i in range(200):
+        frag = ''.join(rng.choice('ACGT') for _ in range(rng.randint(5, 120)))
+        r1 = mutate((frag + a1)[:100])
+        r2 = mutate((reverse_complement(frag) + a2)[:100])
+        reads1.append(Sequence('read{}'.format(i), r1, '#' * len(r1)))
+        reads2.append(Sequence('read{}'.format(i), r2, '#' * len(r2)))
+    def create_cutter():
+        parser = AdapterParser()
+        return InsertAdapterCutter(
+            parser.parse_from_spec(a1, name='a1'),
+            parser.parse_from_spec(a2, name='a2'),
+            mismatch_action='liberal')
+    cutter = create_cutter()
+    batch_cutter = create_cutter()
+    copy_reads = lambda reads: [read[:] for read in reads]
+    trimmed1, trimmed2 = batch_cutter.process_batch(
+        copy_reads(reads1), copy_reads(reads2))
+    for read1, read2, batch_read1, batch_read2 in zip(
+            copy_reads(reads1), copy_reads(reads2), trimmed1, trimmed2):
+        expected1, expected2 = cutter(read1, read2)
+        assert batch_read1.sequence == expected1.sequence
+        assert batch_read2.sequence == expected2.sequence
+        assert batch_read1.insert_overlap == expected1.insert_overlap
+    assert batch_cutter.with_adapters == cutter.with_adapters
+    assert batch_cutter.with_adapters[0] > 100
+    assert batch_cutter.summarize() == cutter.summarize()
+
 def test_TruSeq_trimmer():
     trimmer = TruSeqBisulfiteTrimmer()
     read1 = Sequence('read1', "CTATCGATCCACGAGACTAAC")
@@ -444,6 +594,24 @@ def test_error_correction_unequal_read_lengths():
         assert read1.sequence[i] == 'N', 'Read 1 not corrected to N at {}'.format(i)
         assert read2.sequence[104-i] == 'N', 'Read 2 not corrected to N at {}'.format(104-i)
 
+def test_error_correction_truncated_read1():
+    # read1 is longer than read2; when read1 is corrected, it is truncated to
+    # the length of read2, which removes the adapter beyond the insert
+    read1 = Sequence('read1', 'ACGTNACGTTT', 'IIII#IIIIII')
+    read2 = Sequence('read1', 'CATTACGT', 'I#IIIIII')
+    ec = ErrorCorrectorMixin('conservative')
+    ec.correct_errors(read1, read2, (0, 8, 0, 8, 8, 0), truncate_seqs=True)
+    assert read1.sequence == 'ACGTAACG'
+    assert read1.qualities == 'IIIIIIII'
+    assert read2.sequence == 'CGTTACGT'
+    assert ec.summarize() == dict(records_corrected=1, bp_corrected=[1, 1])
+    # read1 is not truncated if only read2 is corrected
+    read1 = Sequence('read1', 'ACGTAACGTTT', 'IIIIIIIIIII')
+    read2 = Sequence('read1', 'CATTACGT', 'I#IIIIII')
+    ec.correct_errors(read1, read2, (0, 8, 0, 8, 8, 0), truncate_seqs=True)
+    assert read1.sequence == 'ACGTAACGTTT'
+    assert read2.sequence == 'CGTTACGT'
+
 def ints2quals(ints):
     return ''.join(chr(i+33) for i in ints)
 
@@ -69,6 +69,54 @@ def test_dequeue_timeout():
     with raises(TimeoutException):
         dequeue(Queue(1), timeout=1, block_timeout=2, timeout_callback=TimeoutException)
 
+def _consume(queue, num_items):
+    for i in range(num_items):
+        assert queue.get(timeout=5) == (i, b'x' * (5000 * (i % 3)))
+
+def test_shared_memory_queue():
+    q = SharedMemoryQueue(2, slot_size=64 * 1024)
+    try:
+        assert q.empty()
+        item = dict(text='ACGT', data=b'x' * 10000)
+        enqueue(q, item)
+        enqueue(q, [1, 2, 3])
+        assert q.full()
+        with raises(Full):
+            q.put(1, timeout=0.1)
+        assert dequeue(q) == item
+        assert dequeue(q) == [1, 2, 3]
+        with raises(Empty):
+            q.get(timeout=0.1)
+        # items larger than a slot
+        q.put(b'y' * 100000)
+        assert q.get() == b'y' * 100000
+        # items are passed between processes
+        proc = Process(target=_consume, args=(q, 50))
+        proc.start()
+        for i in range(50):
+            enqueue(q, (i, b'x' * (5000 * (i % 3))))
+        proc.join()
+        assert proc.exitcode == 0
+    finally:
+        q.close()
+
+def test_create_queue():
+    q = create_queue('shm', 0, 2)
+    try:
+        assert isinstance(q, SharedMemoryQueue)
+        assert q.num_slots == 2 * SHM_SLOTS_PER_THREAD
+    finally:
+        close_queue(q)
+    q = create_queue('shm', 3, 2)
+    try:
+        assert q.num_slots == 3
+    finally:
+        close_queue(q)
+    assert not isinstance(create_queue('records', 3, 2), SharedMemoryQueue)
+    q = create_queue('shm', 3, 2, worker_backend='thread')
+    assert isinstance(q, queue.Queue)
+    assert q.maxsize == 3
+
 # TODO: port tests from testparallel here
 # Test worker vs writer compression
 # Test without writer process
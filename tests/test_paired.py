@@ -70,6 +70,46 @@ def test_paired_separate():
     run('-a TTAGACATAT', 'paired-separate.1.fastq', 'paired.1.fastq')
     run('-a CAGTGGAGTA', 'paired-separate.2.fastq', 'paired.2.fastq')
 
+def test_paired_end_chunks():
+    """paired-end input sent to workers as raw chunks"""
+    run_paired(
+        '--threads 2 --preserve-order --transport chunks --batch-size 2 '
+        '-a TTAGACATAT -m 14',
+        in1='paired.1.fastq', in2='paired.2.fastq',
+        expected1='paired.m14.1.fastq', expected2='paired.m14.2.fastq'
+    )
+
+def test_paired_end_shm():
+    """paired-end input and results sent through shared memory"""
+    for compression in ('worker', 'writer'):
+        run_paired(
+            '--threads 3 --preserve-order --transport shm --batch-size 2 '
+            '--compression {} -a TTAGACATAT -m 14'.format(compression),
+            in1='paired.1.fastq', in2='paired.2.fastq',
+            expected1='paired.m14.1.fastq', expected2='paired.m14.2.fastq'
+        )
+
+def test_paired_end_worker_threads():
+    """paired-end reads processed by worker threads"""
+    for args in (
+            '--compression worker',
+            '--transport chunks --compression writer'):
+        run_paired(
+            '--threads 3 --worker-backend thread --preserve-order '
+            '--batch-size 2 {} -a TTAGACATAT -m 14'.format(args),
+            in1='paired.1.fastq', in2='paired.2.fastq',
+            expected1='paired.m14.1.fastq', expected2='paired.m14.2.fastq'
+        )
+
+def test_paired_end_mmap():
+    """paired-end input memory-mapped and sent to workers as locations"""
+    run_paired(
+        '--threads 2 --preserve-order --mmap --batch-size 2 '
+        '-a TTAGACATAT -m 14',
+        in1='paired.1.fastq', in2='paired.2.fastq',
+        expected1='paired.m14.1.fastq', expected2='paired.m14.2.fastq'
+    )
+
 def test_paired_end_legacy():
     '''--paired-output, not using -A/-B/-G'''
     # The -m 14 filters out one read, which should then also be filtered out in 
@@ -237,6 +277,14 @@ def test_interleaved():
         aligners=BACK_ALIGNERS
     )
 
+def test_interleaved_chunks():
+    """interleaved input sent to workers as raw chunks"""
+    run_interleaved(
+        '--threads 2 --preserve-order --transport chunks --batch-size 1 '
+        '-q 20 -a TTAGACATAT -A CAGTGGAGTA -m 14 -M 90',
+        inpath='interleaved.fastq', expected='interleaved.fastq'
+    )
+
 def test_interleaved_no_paired_output():
     with temporary_path("temp-paired.1.fastq") as p1:
         with temporary_path("temp-paired.2.fastq") as p2:
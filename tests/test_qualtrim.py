@@ -1,5 +1,7 @@
 # coding: utf-8
-from atropos.commands.trim.qualtrim import nextseq_trim_index
+from pytest import raises
+from atropos.commands.trim.qualtrim import (
+    EndTrimmer, correct_mismatches, nextseq_trim_index, quality_trim_index)
 from atropos.io.seqio import Sequence
 
 def test_nextseq_trim():
@@ -10,3 +12,50 @@ def test_nextseq_trim():
         'AA//EAEE//A6///E//A//EA/EEEEEEAEA//EEEEEEEEEEEEEEE###########EE#EA'
     )
     assert nextseq_trim_index(s, cutoff=22) == 33
+    # trimming a view of the read
+    assert nextseq_trim_index(s[10:], cutoff=22) == 23
+
+def test_quality_trim_range():
+    qualities = '##IIIIII##'
+    assert quality_trim_index(qualities, 10, 10) == (2, 8)
+    assert quality_trim_index(qualities, 10, 10, offset=1, length=8) == (1, 7)
+    assert quality_trim_index(qualities, 10, 10, offset=2, length=6) == (0, 6)
+    assert quality_trim_index(qualities, 10, 10, offset=0, length=2) == (0, 0)
+    with raises(IndexError):
+        quality_trim_index(qualities, 10, 10, offset=5, length=6)
+
+def test_end_trimmer():
+    trimmer = EndTrimmer([('cut', 1, -1), ('quality', 10, 10, 33), ('n_end',)])
+    sequence = 'ANACGTACGTNA'
+    qualities = '##IIIIIIII##'
+    # cut: NACGTACGTN; quality: ACGTACGT; n_end: unchanged
+    assert trimmer.trim(sequence, qualities, 0, 12) == (2, 10, 2, 2)
+    assert trimmer.pop_trimmed() == [2, 2, 0]
+    assert trimmer.pop_trimmed() == [0, 0, 0]
+    # all Ns
+    trimmer = EndTrimmer([('n_end',), ('cut', 2, 0)])
+    assert trimmer.trim('ANNNA', None, 1, 4) == (4, 4, 3, 3)
+    assert trimmer.pop_trimmed() == [6, 0]
+    with raises(TypeError):
+        EndTrimmer([('nextseq', 20, 33)]).trim('ACGT', None, 0, 4)
+    with raises(IndexError):
+        trimmer.trim('ACGT', None, 0, 5)
+
+def test_correct_mismatches():
+    # read2 is the reverse complement of ACGTAACG with a low-quality error
+    seq1 = 'ACGTNACG'
+    qual1 = 'IIII#III'
+    seq2 = 'CATTACGT'
+    qual2 = 'I#IIIIII'
+    assert correct_mismatches(
+        seq1, qual1, seq2, qual2, 0, 8, 0, 8, 'N') == (
+        'ACGTNANG', qual1, 'CNTNACGT', qual2, 2, 2)
+    assert correct_mismatches(
+        seq1, qual1, seq2, qual2, 0, 8, 0, 8, 'conservative') == (
+        'ACGTAACG', 'IIIIIIII', 'CGTTACGT', 'IIIIIIII', 1, 1)
+    # nothing to correct outside of the overlap
+    assert correct_mismatches(
+        seq1, qual1, seq2, qual2, 0, 2, 6, 8, 'N') == (
+        seq1, qual1, seq2, qual2, 0, 0)
+    with raises(IndexError):
+        correct_mismatches(seq1, qual1, seq2, qual2, 0, 9, 0, 8, 'N')
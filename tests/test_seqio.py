@@ -4,17 +4,20 @@ from collections import defaultdict
 import random
 import sys
 import os
-from io import StringIO
+import pickle
+from io import BytesIO, StringIO
 import shutil
 from textwrap import dedent
 from tempfile import mkdtemp
 from atropos.io import xopen, open_output
 from atropos.io.seqio import (Sequence, ColorspaceSequence, FormatError,
     FastaReader, FastqReader, FastaQualReader, InterleavedSequenceReader,
+    PairedSequenceReader, BgzfBlockReader, MmapChunkReader, MmapRegion,
+    find_fastq_record, open_chunk_reader, format_records,
     FastaFormat, FastqFormat, InterleavedFormatter, get_format,
     open_reader as openseq, sequence_names_match)
 from atropos.util import ALPHABETS
-from .utils import temporary_path
+from .utils import temporary_path, write_bgzf
 
 # files tests/data/simple.fast{q,a}
 simple_fastq = [
@@ -45,6 +48,55 @@ class TestSequence:
     def test_invalid_primer(self):
         with raises(FormatError):
             ColorspaceSequence(name="name", sequence="K0123", qualities="####")
+    
+    def test_parsed_record(self):
+        fastq = b"@r1 x\nACGT\n+r1 x\nIIII\n@r2\nTTTT\n+\nHHHH\r\n"
+        with FastqReader(BytesIO(fastq)) as fq:
+            read1, read2 = list(fq)
+        assert read1.raw_record() == fastq[:22]
+        # DOS line breaks are not written out
+        assert read2.raw_record() is None
+        assert (read1.name, read1.name2) == ('r1 x', 'r1 x')
+        assert (read2.name, read2.name2) == ('r2', '')
+        # pickling preserves an unchanged record
+        assert pickle.loads(pickle.dumps(read1)).raw_record() == fastq[:22]
+        # slices share the name, but are modified
+        trimmed = read1[1:3]
+        assert (trimmed.name, trimmed.name2) == ('r1 x', 'r1 x')
+        assert trimmed.raw_record() is None
+        # renaming a read does not change name2
+        read1.name = 'r3'
+        assert (read1.name, read1.name2) == ('r3', 'r1 x')
+        assert read1.raw_record() is None
+        read2.sequence = 'GGGG'
+        assert read2.raw_record() is None
+        assert pickle.loads(pickle.dumps(read1)) == read1
+    
+    def test_slice_view(self):
+        read = Sequence('r1', 'ACGTACGTAC', '0123456789')
+        trimmed = read[2:][:-3][1:]
+        assert len(trimmed) == 4
+        assert trimmed.view() == ('ACGTACGTAC', '0123456789', 3, 7)
+        assert trimmed.original_length == 10
+        assert trimmed.clipped is not read.clipped
+        assert (trimmed.sequence, trimmed.qualities) == ('TACG', '3456')
+        assert trimmed.view() == ('TACG', '3456', 0, 4)
+        assert read[5:2].sequence == ''
+        assert read[::2].sequence == 'AGAGA'
+        # assigning a field replaces the view
+        trimmed = read[2:5]
+        trimmed.sequence = 'NNNN'
+        assert (trimmed.sequence, trimmed.qualities) == ('NNNN', '234')
+    
+    def test_subseq(self):
+        read = Sequence('r1', 'ACGTACGTAC', '0123456789')
+        begin, end_bases, trimmed = read.subseq(2, 8)
+        assert (begin, end_bases) == (2, 2)
+        assert trimmed.clipped == [2, 2, 0, 0]
+        assert read.clipped == [0, 0, 0, 0]
+        _, _, trimmed = trimmed.clip(1, -2)
+        assert trimmed.clipped == [3, 4, 0, 0]
+        assert trimmed.sequence == 'TAC'
 
 
 class TestFastaReader:
@@ -152,6 +204,58 @@ class TestFastqReader:
             reads = list(f)
             assert reads[0].sequence == 'ACGNGGACT'
             assert reads[1].sequence == 'CGGACNNNC'
+    
+    def test_chunked_matches_lines(self):
+        for name in (
+                'simple.fastq', 'dos.fastq', 'small.fastq', 'plus.fastq',
+                'illumina5.fastq', 'small.fastq.gz', 'small.fastq.bz2'):
+            path = os.path.join('tests', 'data', name)
+            with xopen(path) as f:
+                with FastqReader(StringIO(f.read())) as fq:
+                    expected = list(fq)
+            # small buffers force records to span block boundaries
+            for buffer_size in (1, 7, 64, None):
+                kwargs = {} if buffer_size is None else dict(
+                    buffer_size=buffer_size)
+                with FastqReader(path, **kwargs) as fq:
+                    assert fq.chunked
+                    assert list(fq) == expected
+    
+    def test_chunked_no_final_newline(self):
+        with FastqReader(BytesIO(b"@r1\nACGT\n+\nIIII")) as fq:
+            assert list(fq) == [Sequence('r1', 'ACGT', 'IIII')]
+    
+    def test_chunked_errors(self):
+        for fastq in (
+                "@name\nACGT+\n",
+                "@name\nACGT\n+\nIIII\n\n",
+                "name\nACGT\n+\nIIII\n",
+                "@name\nACGT\nIIII\n+\n",
+                "@name\nACGT\n+other\nIIII\n",
+                "@name\nACGT\n+\nIII\n"):
+            with raises(FormatError) as expected, FastqReader(
+                    StringIO(fastq)) as fq:
+                list(fq)
+            for buffer_size in (3, 1024):
+                with raises(FormatError) as actual, FastqReader(
+                        BytesIO(fastq.encode()),
+                        buffer_size=buffer_size) as fq:
+                    assert fq.chunked
+                    list(fq)
+                assert str(actual.value) == str(expected.value)
+    
+    def test_read_batch(self):
+        path = "tests/data/small.fastq"
+        with FastqReader(path) as fq:
+            expected = list(fq)
+        for reader in (FastqReader(path), FastqReader(xopen(path))):
+            with reader:
+                batches = list(reader.iter_batches(2))
+            assert [len(batch) for batch in batches] == [2, 1]
+            assert sum(batches, []) == expected
+        with FastqReader(path) as fq:
+            assert fq.read_batch(10) == expected
+            assert fq.read_batch(10) == []
 
 
 class TestFastaQualReader:
@@ -256,6 +360,21 @@ class TestInterleavedReader:
         with raises(FormatError):
             s = StringIO('@r1/1\nACG\n+\nHHH\n@wrong_name\nTTT\n+\nHHH')
             list(InterleavedSequenceReader(s))
+    
+    def test_read_batch(self):
+        reader = InterleavedSequenceReader("tests/cut/interleaved.fastq")
+        with reader:
+            expected = list(reader)
+        reader = InterleavedSequenceReader("tests/cut/interleaved.fastq")
+        with reader:
+            assert reader.read_batch(1) == expected[:1]
+            assert reader.read_batch(5) == expected[1:]
+            assert reader.read_batch(5) == []
+    
+    def test_read_batch_missing_partner(self):
+        with raises(FormatError):
+            s = StringIO('@r1\nACG\n+\nHHH')
+            InterleavedSequenceReader(s).read_batch(10)
 
 
 class TestFastaWriter:
@@ -322,6 +441,40 @@ class TestFastqWriter:
             fw.write(fmt.format(Sequence("name2", "HELLO", "&&&!&", name2="name2")))
         with open(self.path) as t:
             assert t.read() == '@name\nCCATA\n+name\n!#!#!\n@name2\nHELLO\n+name2\n&&&!&\n'
+    
+    def test_unchanged_records(self):
+        fmt = FastqFormat()
+        fastq = "@r1\nACGT\n+r1\nIIII\n@r2\nTTTT\n+\nHHHH\n"
+        with FastqReader(BytesIO(fastq.encode())) as fq:
+            reads = list(fq)
+        assert ''.join(fmt.format(read) for read in reads) == fastq
+        reads[0].name = 'r3'
+        reads[1] = reads[1][:2]
+        assert ''.join(fmt.format(read) for read in reads) == (
+            "@r3\nACGT\n+r1\nIIII\n@r2\nTT\n+\nHH\n")
+    
+    def test_format_records(self):
+        fmt = FastqFormat()
+        fastq = "@r1\nACGT\n+r1\nIIII\n@r2 x\nTTTT\n+r2 x\nHHHH\n@r3\nGG\n+\nII\n"
+        with FastqReader(BytesIO(fastq.encode())) as fq:
+            reads = list(fq)
+        reads[0] = reads[0][1:3]
+        reads[1].name = 'r4'
+        items = [fmt.format_item(read) for read in reads]
+        items.extend((
+            'info\n',
+            fmt.format_item(Sequence('r5', 'ACGTA', 'IIIII', name2='r5')[1:]),
+            fmt.format_item(ColorspaceSequence('r6', 'T0123', '####'))))
+        assert items[0] is reads[0]
+        expected = (
+            "@r1\nCG\n+r1\nII\n@r4\nTTTT\n+r2 x\nHHHH\n@r3\nGG\n+\nII\n"
+            "info\n@r5\nCGTA\n+r5\nIIII\n@r6\n0123\n+\n####\n")
+        assert format_records(items) == expected.encode()
+        assert ''.join(
+            item if isinstance(item, str) else fmt.format(item)
+            for item in items) == expected
+        with raises(TypeError):
+            format_records([Sequence('r7', 'ACGT')])
 
 
 class TestInterleavedWriter:
@@ -340,7 +493,7 @@ class TestInterleavedWriter:
         assert fmt.read1_bp == 5
         assert fmt.read2_bp == 5
         assert "foo" in result
-        assert "".join(result["foo"]) == '@A/1 comment\nTTA\n+\n##H\n@A/2 comment\nGCT\n+\nHH#\n@B/1\nCC\n+\nHH\n@B/2\nTG\n+\n#H\n'
+        assert format_records(result["foo"]).decode() == '@A/1 comment\nTTA\n+\n##H\n@A/2 comment\nGCT\n+\nHH#\n@B/1\nCC\n+\nHH\n@B/2\nTG\n+\n#H\n'
 
 class TestPairedSequenceReader:
     def test_sequence_names_match(self):
@@ -354,7 +507,185 @@ class TestPairedSequenceReader:
         assert match('abc.1', 'abc.2')
         assert match('abc1', 'abc2')
         assert not match('abc', 'xyz')
-
+    
+    def test_read_batch(self):
+        with PairedSequenceReader(
+                "tests/data/paired.1.fastq",
+                "tests/data/paired.2.fastq") as reader:
+            expected = list(reader)
+        with PairedSequenceReader(
+                "tests/data/paired.1.fastq",
+                "tests/data/paired.2.fastq") as reader:
+            batches = list(reader.iter_batches(3))
+        assert sum(batches, []) == expected
+    
+    def test_read_batch_improperly_paired(self):
+        with raises(FormatError), PairedSequenceReader(
+                "tests/data/paired.1.fastq",
+                "tests/data/simple.fastq") as reader:
+            reader.read_batch(1000)
+        with raises(FormatError), PairedSequenceReader(
+                "tests/data/simple.fastq",
+                "tests/data/paired.2.fastq") as reader:
+            reader.read_batch(1000)
+
+
+
+class TestFastqChunkReader:
+    def test_chunks(self):
+        with FastqReader("tests/data/small.fastq") as reader:
+            expected = list(reader)
+        for buffer_size in (5, 1024):
+            with FastqReader(
+                    "tests/data/small.fastq", buffer_size=buffer_size) as reader:
+                chunk_reader = open_chunk_reader(reader)
+                batches = [chunk_reader.read_batch(2) for _ in range(3)]
+            assert [len(batch) for batch in batches] == [2, 1, 0]
+            assert list(batches[0]) + list(batches[1]) == expected
+    
+    def test_paired_chunks(self):
+        path1, path2 = "tests/data/paired.1.fastq", "tests/data/paired.2.fastq"
+        with PairedSequenceReader(path1, path2) as reader:
+            expected = list(reader)
+        with PairedSequenceReader(path1, path2) as reader:
+            batch = open_chunk_reader(reader).read_batch(3)
+            # RawBatch is sent to worker processes
+            batch = pickle.loads(pickle.dumps(batch))
+        assert list(batch) == expected[:3]
+    
+    def test_interleaved_chunks(self):
+        path = "tests/cut/interleaved.fastq"
+        with InterleavedSequenceReader(path) as reader:
+            expected = list(reader)
+        with InterleavedSequenceReader(path) as reader:
+            batch = open_chunk_reader(reader).read_batch(5)
+        assert len(batch) == len(expected)
+        assert list(batch) == expected
+    
+    def test_improperly_paired(self):
+        with raises(FormatError), PairedSequenceReader(
+                "tests/data/paired.1.fastq",
+                "tests/data/simple.fastq") as reader:
+            open_chunk_reader(reader).read_batch(3)
+    
+    def test_unsupported(self):
+        with FastaReader("tests/data/simple.fasta") as reader:
+            assert open_chunk_reader(reader) is None
+        with FastqReader(StringIO("@r1\nACGT\n+\nIIII\n")) as reader:
+            assert open_chunk_reader(reader) is None
+
+class TestMmapReader:
+    def test_mmap_matches_chunked(self):
+        for name in (
+                'simple.fastq', 'dos.fastq', 'small.fastq', 'plus.fastq',
+                'illumina5.fastq'):
+            path = os.path.join('tests', 'data', name)
+            with FastqReader(path) as fq:
+                expected = list(fq)
+            with FastqReader(path, use_mmap=True) as fq:
+                assert isinstance(fq._file, MmapRegion)
+                assert list(fq) == expected
+    
+    def test_fallback(self):
+        # compressed and empty files are read as usual
+        for name in ('small.fastq.gz', 'empty.fastq'):
+            path = os.path.join('tests', 'data', name)
+            with FastqReader(path, use_mmap=True) as fq:
+                assert not isinstance(fq._file, MmapRegion)
+                assert fq.chunked
+                list(fq)
+    
+    def test_region(self):
+        fastq = b"@r1\nACGT\n+\nIIII\n@r2\nTTTT\n+\nHHHH"
+        with temporary_path("mmap.fastq") as path:
+            with open(path, 'wb') as out:
+                out.write(fastq)
+            region = MmapRegion(path, fastq.index(b'@r2'))
+            with FastqReader(region) as fq:
+                assert list(fq) == [Sequence('r2', 'TTTT', 'HHHH')]
+            # only the location of the region is pickled
+            region = pickle.loads(pickle.dumps(MmapRegion(path, 0, 16)))
+            assert (region.offset, region.length) == (0, 16)
+            with FastqReader(region) as fq:
+                assert list(fq) == [Sequence('r1', 'ACGT', 'IIII')]
+    
+    def test_chunks(self):
+        path = "tests/data/small.fastq"
+        with FastqReader(path) as reader:
+            expected = list(reader)
+        with FastqReader(path, use_mmap=True) as reader:
+            chunk_reader = open_chunk_reader(reader)
+            assert isinstance(chunk_reader, MmapChunkReader)
+            batches = [chunk_reader.read_batch(2) for _ in range(3)]
+        assert [len(batch) for batch in batches] == [2, 1, 0]
+        batches = [pickle.loads(pickle.dumps(batch)) for batch in batches[:2]]
+        assert list(batches[0]) + list(batches[1]) == expected
+    
+    def test_paired_chunks(self):
+        path1, path2 = "tests/data/paired.1.fastq", "tests/data/paired.2.fastq"
+        with PairedSequenceReader(path1, path2) as reader:
+            expected = list(reader)
+        with PairedSequenceReader(path1, path2, use_mmap=True) as reader:
+            assert list(reader) == expected
+        with PairedSequenceReader(path1, path2, use_mmap=True) as reader:
+            batch = open_chunk_reader(reader, mmap_only=True).read_batch(3)
+        assert list(batch) == expected[:3]
+    
+    def test_mmap_only(self):
+        with FastqReader("tests/data/small.fastq") as reader:
+            assert open_chunk_reader(reader, mmap_only=True) is None
+
+class TestBgzfBlockReader:
+    def test_find_fastq_record(self):
+        data = b"@r1\nACGT\n+\n@III\n@r2\nACGT\n+\nIIII\n"
+        # the quality line of r1 starts with '@'
+        assert find_fastq_record(data, 0) == 0
+        assert find_fastq_record(data, 4) == 16
+        assert find_fastq_record(data, 11) == 16
+        assert find_fastq_record(data, 16) == 16
+        assert find_fastq_record(data, 20) == -1
+        assert find_fastq_record(data[:25], 11) == -1
+    
+    def test_blocks(self):
+        rng = random.Random(1)
+        data = ''.join(
+            '@read{0}\n{1}\n+\n{2}\n'.format(
+                i, ''.join(rng.choice('ACGT') for _ in range(i % 20 + 1)),
+                ''.join(rng.choice('@I#') for _ in range(i % 20 + 1)))
+            for i in range(200)).encode()
+        with FastqReader(BytesIO(data)) as reader:
+            expected = list(reader)
+        with temporary_path("bgzf_blocks.fastq.gz") as path:
+            for block_size, batch_size in ((17, 1), (100, 7), (5000, 1000)):
+                write_bgzf(path, data, block_size)
+                with FastqReader(path) as reader:
+                    chunk_reader = open_chunk_reader(reader, bgzf_blocks=True)
+                    assert isinstance(chunk_reader, BgzfBlockReader)
+                    chunk_reader.lookahead_size = 200
+                    records = []
+                    while True:
+                        batch = chunk_reader.read_batch(batch_size)
+                        if not batch:
+                            break
+                        # batches are sent to worker processes
+                        batch = pickle.loads(pickle.dumps(batch))
+                        records.extend(batch)
+                assert records == expected
+    
+    def test_record_too_long(self):
+        data = b"@r1\nACGT\n+\nIIII\n@r2\n" + b"A" * 100 + b"\n+\n" + b"I" * 100 + b"\n"
+        with temporary_path("bgzf_long.fastq.gz") as path:
+            write_bgzf(path, data, 10)
+            reader = BgzfBlockReader(path, lookahead_size=20)
+            batch = reader.read_batch(1)
+            with raises(FormatError):
+                list(batch)
+            reader.close()
+    
+    def test_not_bgzf(self):
+        with FastqReader("tests/data/small.fastq.gz") as reader:
+            chunk_reader = open_chunk_reader(reader, bgzf_blocks=True)
+            assert not isinstance(chunk_reader, BgzfBlockReader)
 
 def create_truncated_file(path):
     # Random text
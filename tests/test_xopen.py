@@ -2,10 +2,19 @@
 import gzip
 import os
 import random
+import struct
 import sys
+from pytest import raises
+from unittest import skipIf
 from atropos.io import xopen, open_output
-from atropos.io.compression import get_compressor
-from .utils import temporary_path
+from atropos.io import compression
+from atropos.io.compression import (
+    BGZF_BLOCK_DATA_SIZE, BGZF_EOF, GZIP_DECOMPRESSORS, AutoCompressionLevel,
+    BgzfReader, BgzfWriter, ThreadedGzipReader, ThreadedGzipWriter,
+    compress_bgzf, compress_bgzf_block, compress_data, get_compressor,
+    get_gzip_compressor, get_gzip_decompressor, get_program_path, is_bgzf,
+    iter_bgzf_blocks, splitext_compressed)
+from .utils import no_import, temporary_path
 
 base = "tests/data/small.fastq"
 files = [ base + ext for ext in ['', '.gz', '.bz2', '.xz' ] ]
@@ -70,3 +79,204 @@ def test_xopen_binary():
             assert lines[5] == b'AGCCGCTANGACGGGTTGGCCCTTAGACGTATCT\n', name
         finally:
             f.close()
+
+def test_threaded_gzip_reader():
+    with open(base, 'rb') as f:
+        data = f.read()
+    with temporary_path('multimember.fastq.gz') as path:
+        # multi-member gzip file
+        with open(path, 'wb') as out:
+            out.write(gzip.compress(data[:100]))
+            out.write(gzip.compress(data[100:]))
+        with ThreadedGzipReader(path, block_size=64) as f:
+            assert f.read() == data
+        with ThreadedGzipReader(path, block_size=64) as f:
+            lines = list(f)
+            assert len(lines) == 12
+            assert b''.join(lines) == data
+        with xopen(path, 'rt', use_system=False, decompression_threads=1) as f:
+            assert f.read() == data.decode()
+
+def test_threaded_gzip_reader_truncated():
+    with open(base, 'rb') as f:
+        compressed = gzip.compress(f.read())
+    with temporary_path('truncated.fastq.gz') as path:
+        with open(path, 'wb') as out:
+            out.write(compressed[:len(compressed) // 2])
+        with ThreadedGzipReader(path) as f:
+            with raises(EOFError):
+                f.read()
+
+def test_get_gzip_decompressor():
+    assert get_gzip_decompressor() in ('gzip', None)
+    assert get_gzip_decompressor(4) in GZIP_DECOMPRESSORS + (None,)
+    assert get_gzip_decompressor(1) in ('igzip', 'gzip', None)
+
+def test_get_gzip_compressor():
+    assert get_gzip_compressor() in ('gzip', None)
+    assert get_gzip_compressor(4) in ('pigz', None)
+
+def test_threaded_gzip_writer():
+    with open(base, 'rb') as f:
+        data = f.read()
+    with temporary_path('small.threaded.fastq.gz') as path:
+        with ThreadedGzipWriter(path, threads=2, block_size=100) as out:
+            # writes that are smaller and larger than a block
+            out.write(data[:10])
+            out.write(memoryview(data[10:350]))
+            out.write(data[350:])
+        with gzip.open(path, 'rb') as f:
+            assert f.read() == data
+        with xopen(path, 'wb', use_system=False, compression_threads=2) as out:
+            assert isinstance(out, ThreadedGzipWriter)
+            out.write(data)
+        with gzip.open(path, 'rb') as f:
+            assert f.read() == data
+
+def test_compression_level():
+    with open(base, 'rb') as f:
+        data = f.read()
+    for ext in ('.gz', '.bz2', '.xz'):
+        compressor = get_compressor('small.fastq' + ext)
+        for level in (None, 1, 9):
+            cdata = compress_data(data, compressor, level)
+            assert compressor.decompress(cdata) == data
+        with temporary_path('small.fastq' + ext) as path:
+            for level in (1, AutoCompressionLevel()):
+                with xopen(path, 'wb', compression_level=level) as out:
+                    out.write(data)
+                with xopen(path, 'rb') as f:
+                    assert f.read() == data
+    # gzip uses level 6 by default, rather than 9
+    assert (
+        compress_data(data, gzip, None)[10:] ==
+        gzip.compress(data, 6)[10:])
+
+def test_auto_compression_level(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(compression.time, 'perf_counter', lambda: now[0])
+    def step(produce, compress):
+        now[0] += produce
+        level.start()
+        now[0] += compress
+        level.stop()
+    level = AutoCompressionLevel(level=2, min_level=1, max_level=3)
+    # compression takes longer than producing the data
+    step(0.4, 0.6)
+    step(0.4, 0.6)
+    assert level.level == 1
+    step(0.4, 0.6)
+    step(0.4, 0.6)
+    assert level.level == 1
+    # compression takes less than half as long as producing the data
+    step(0.8, 0.3)
+    assert level.level == 2
+    step(0.8, 0.3)
+    step(0.8, 0.3)
+    assert level.level == 3
+    # in between
+    step(0.6, 0.4)
+    step(0.6, 0.4)
+    assert level.level == 3
+    # with a writer that compresses blocks in the calling thread, and for
+    # which compression (0.5 s per block) is the bottleneck
+    level = AutoCompressionLevel(level=9, interval=0)
+    block_levels = []
+    with temporary_path('auto.fastq.gz') as path:
+        with ThreadedGzipWriter(path, 1, block_size=10, level=level) as out:
+            compress = out._compress
+            def slow_compress(data, block_level):
+                block_levels.append(block_level)
+                now[0] += 0.5
+                return compress(data, block_level)
+            out._compress = slow_compress
+            for i in range(4):
+                now[0] += 1
+                out.write(b'ACGT' * 10)
+        assert level.level == 5
+        assert block_levels == [9] * 4 + [8] * 4 + [7] * 4 + [6] * 4
+        with gzip.open(path, 'rb') as f:
+            assert f.read() == b'ACGT' * 40
+
+@skipIf(
+    get_program_path('zstd') is None and no_import('zstandard'),
+    "requires the zstd program or the zstandard package")
+def test_zstd():
+    with open(base, 'rb') as f:
+        data = f.read()
+    assert splitext_compressed('small.fastq.zst') == (
+        'small', '.fastq', '.zst')
+    with temporary_path('small.fastq.zst') as path:
+        for use_system in (True, False):
+            with xopen(
+                    path, 'wb', use_system=use_system,
+                    compression_threads=2, compression_level=19) as out:
+                out.write(data)
+            with xopen(path, 'rt', use_system=use_system) as f:
+                assert f.read() == data.decode()
+        # concatenated frames (as written by worker compression)
+        compressor = get_compressor(path)
+        with open(path, 'wb') as out:
+            out.write(compressor.compress(data[:100]))
+            out.write(compressor.compress(data[100:]))
+        with xopen(path, 'rb') as f:
+            assert f.read() == data
+
+def test_bgzf_writer():
+    data = bytes(random.getrandbits(8) for _ in range(BGZF_BLOCK_DATA_SIZE))
+    data = data * 2 + b'ACGT' * 1000
+    with temporary_path('bgzf_writer.gz') as path:
+        for threads in (None, 2):
+            with BgzfWriter(path, threads=threads, index=True) as out:
+                out.write(data[:1000])
+                out.write(data[1000:])
+            assert is_bgzf(path)
+            with open(path, 'rb') as f:
+                blocks = list(iter_bgzf_blocks(f))
+            assert len(blocks) == 4
+            assert blocks[-1] == BGZF_EOF
+            with gzip.open(path, 'rb') as f:
+                assert f.read() == data
+            # index of the start of each block except the first
+            with open(path + '.gzi', 'rb') as f:
+                index = f.read()
+            os.remove(path + '.gzi')
+            offsets = struct.unpack('<5Q', index)
+            assert offsets[0] == 2
+            assert offsets[1:] == (
+                len(blocks[0]), BGZF_BLOCK_DATA_SIZE,
+                len(blocks[0]) + len(blocks[1]), 2 * BGZF_BLOCK_DATA_SIZE)
+        # data that is already compressed
+        with BgzfWriter(path, compressed=True) as out:
+            out.write(compress_bgzf(data[:100]))
+            out.write(memoryview(compress_bgzf(data[100:])))
+        with open(path, 'rb') as f:
+            assert len(list(iter_bgzf_blocks(f))) == 5
+        with gzip.open(path, 'rb') as f:
+            assert f.read() == data
+
+def test_bgzf_reader():
+    with open(base, 'rb') as f:
+        data = f.read()
+    with temporary_path('small.bgzf.fastq.gz') as path:
+        with open(path, 'wb') as out:
+            for i in range(0, len(data), 50):
+                out.write(compress_bgzf_block(data[i:i+50]))
+            out.write(BGZF_EOF)
+        assert is_bgzf(path)
+        assert not is_bgzf(base + '.gz')
+        assert not is_bgzf(base)
+        # BGZF files are valid gzip files
+        with gzip.open(path, 'rb') as f:
+            assert f.read() == data
+        with BgzfReader(path, threads=2, blocks_per_task=2) as f:
+            assert f.read() == data
+        with xopen(path, 'rb', decompression_threads=2) as f:
+            assert isinstance(f, BgzfReader)
+            assert list(f) == data.splitlines(True)
+        # truncated
+        with open(path, 'rb+') as f:
+            f.truncate(len(data) // 2)
+        with BgzfReader(path, threads=2) as f:
+            with raises(EOFError):
+                f.read()
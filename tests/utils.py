@@ -6,6 +6,7 @@ import sys
 import traceback
 import urllib.request
 from atropos.commands import get_command
+from atropos.io.compression import BGZF_EOF, compress_bgzf_block
 
 @contextmanager
 def redirect_stderr():
@@ -27,6 +28,15 @@ def temporary_path(name):
         os.remove(path)
 
 
+def write_bgzf(path, data, block_size):
+    """Write `data` to a BGZF file with blocks of `block_size` bytes.
+    """
+    with open(path, 'wb') as out:
+        for i in range(0, len(data), block_size):
+            out.write(compress_bgzf_block(data[i:i+block_size]))
+        out.write(BGZF_EOF)
+
+
 def datapath(path):
     return os.path.join(os.path.dirname(__file__), 'data', path)
 